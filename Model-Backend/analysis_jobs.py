@@ -0,0 +1,413 @@
+"""
+Background jobs for large inventory analyses.
+
+``POST /inventory/analysis/jobs`` queues an analysis and returns at once;
+worker threads score the items in vectorised chunks, reporting progress
+after each one, and write the result to disk, where it is kept for a TTL::
+
+    jobs/
+        jobs.sqlite3        # the queue: one row per job (state, progress, timings)
+        <job id>.input.json # the submitted request body, until the job has run
+        <job id>.json       # the result, same shape as /inventory/analysis
+
+The queue is a SQLite table, so no broker is needed and every Gunicorn
+worker process can submit jobs and run them: a job is claimed inside an
+immediate transaction, so exactly one worker picks it up. Jobs left
+``running`` by a process that died are queued again.
+
+Usage:
+    python analysis_jobs.py list
+    python analysis_jobs.py purge
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from response_formats import round_column
+from store_insights import classify
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = 'jobs'
+DATABASE_FILE = 'jobs.sqlite3'
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_POLL_SECONDS = 1.0
+PURGE_INTERVAL_SECONDS = 60
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+TOP_ITEMS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL,
+    worker_pid INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+def analyze_inventory(predictor, items: List[Any], chunk_size: int = None,
+                      progress: Callable[[int], None] = None, compact: bool = False) -> Dict[str, Any]:
+    """
+    Score ``items`` and summarise their stock position: the body of an
+    /inventory/analysis response. Items are scored ``chunk_size`` at a time
+    (all at once by default); ``progress`` is called with the number of
+    items processed after each chunk.
+
+    With ``compact``, ``detailed_analysis`` is a dict of columns (see
+    response_formats) and the critical / overstocked items are row
+    positions in those columns. The ID columns then hold the validated
+    string IDs; per-item results echo the IDs as the client sent them.
+    """
+    chunk_size = chunk_size or max(len(items), 1)
+    store_ids: List[Any] = []
+    product_ids: List[Any] = []
+    inventory_parts = [np.empty(0)]
+    demand_parts = [np.empty(0)]
+
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        scored, errors = predictor.predict_demand_batch(chunk)
+        for error in errors:
+            logger.error(f"Error analyzing item {error['item']}: {error['error']}")
+
+        if compact:
+            store_ids.extend(scored['Store ID'].tolist())
+            product_ids.extend(scored['Product ID'].tolist())
+        else:
+            # The client's own values (e.g. 1, not '1'), as before validation was columnar
+            valid = [chunk[i] for i in scored.index]
+            store_ids.extend(item['Store ID'] for item in valid)
+            product_ids.extend(item['Product ID'] for item in valid)
+        inventory_parts.append(scored['Inventory Level'].to_numpy(dtype=np.float64))
+        demand_parts.append(scored['predicted_demand'].to_numpy(dtype=np.float64))
+
+        if progress is not None:
+            progress(start + len(chunk))
+
+    inventory_levels = np.concatenate(inventory_parts)
+    predicted = np.concatenate(demand_parts)
+    stock_ratios = np.divide(predicted, inventory_levels,
+                             out=np.zeros_like(predicted), where=inventory_levels > 0)
+    # Same classification as /store-insights: an empty shelf with forecast
+    # demand is critical (although its stock ratio is reported as 0)
+    days, _, status = classify(inventory_levels, predicted)
+    critical = status == 'critical'
+    overstocked = status == 'overstocked'
+    # Top items by severity: fewest days of stock (ties: most demand first) and
+    # most days of stock (ties: most inventory first), then input order
+    critical_rows = np.flatnonzero(critical)
+    critical_rows = critical_rows[np.lexsort(
+        (critical_rows, -predicted[critical_rows], days[critical_rows]))][:TOP_ITEMS]
+    overstocked_rows = np.flatnonzero(overstocked)
+    overstocked_rows = overstocked_rows[np.lexsort(
+        (overstocked_rows, -inventory_levels[overstocked_rows], -days[overstocked_rows]))][:TOP_ITEMS]
+
+    total_inventory = float(inventory_levels.sum())
+    total_predicted_demand = float(predicted.sum())
+    # Overall analysis
+    overall_stock_ratio = total_predicted_demand / total_inventory if total_inventory > 0 else 0
+    summary = {
+        'total_items_analyzed': len(predicted),
+        'total_inventory_value': round(total_inventory, 2),
+        'total_predicted_demand': round(total_predicted_demand, 2),
+        'overall_stock_ratio': round(overall_stock_ratio, 2),
+        'critical_items_count': int(critical.sum()),
+        'overstocked_items_count': int(overstocked.sum())
+    }
+
+    if compact:
+        days_of_stock = np.divide(inventory_levels, predicted,
+                                  out=np.full_like(predicted, np.nan), where=predicted > 0)
+        return {
+            'summary': summary,
+            'detailed_analysis': {
+                'store_id': store_ids,
+                'product_id': product_ids,
+                'current_inventory': inventory_levels,
+                'predicted_demand': round_column(predicted),
+                'stock_ratio': round_column(stock_ratios),
+                'days_of_stock': round_column(days_of_stock, 1)
+            },
+            'critical_items': critical_rows,
+            'overstocked_items': overstocked_rows,
+        }
+
+    results = []
+    for store_id, product_id, inventory_level, predicted_demand, stock_ratio in zip(
+            store_ids, product_ids, inventory_levels, predicted, stock_ratios):
+        analysis = {
+            'store_id': store_id,
+            'product_id': product_id,
+            'current_inventory': float(inventory_level),
+            'predicted_demand': round(float(predicted_demand), 2),
+            'stock_ratio': round(float(stock_ratio), 2),
+            # No forecast demand: the stock never runs out (null, as inf isn't valid JSON)
+            'days_of_stock': round(float(inventory_level / predicted_demand), 1) if predicted_demand > 0 else None
+        }
+        results.append(analysis)
+
+    return {
+        'summary': summary,
+        'detailed_analysis': results,
+        'critical_items': [results[i] for i in critical_rows],
+        'overstocked_items': [results[i] for i in overstocked_rows],
+    }
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+
+class AnalysisJobs:
+    """SQLite-backed queue of inventory analyses and the threads that run them."""
+
+    def __init__(self, predictor, directory: str = DEFAULT_JOBS_DIR, workers: int = 1,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 poll_seconds: float = DEFAULT_POLL_SECONDS, ready: Callable[[], bool] = None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.predictor = predictor
+        self.directory = directory
+        self.workers = int(workers)
+        self.ttl_seconds = float(ttl_seconds)
+        self.chunk_size = int(chunk_size)
+        self.poll_seconds = float(poll_seconds)
+        # Jobs are only claimed while this returns True (e.g. once the model is loaded)
+        self.ready = ready
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._last_purge = 0.0
+
+    @classmethod
+    def from_env(cls, predictor, ready: Callable[[], bool] = None) -> 'AnalysisJobs':
+        return cls(predictor, ready=ready,
+                   directory=os.environ.get('ANALYSIS_JOBS_DIR', DEFAULT_JOBS_DIR),
+                   workers=int(os.environ.get('ANALYSIS_JOB_WORKERS', 1)),
+                   ttl_seconds=float(os.environ.get('ANALYSIS_JOB_TTL_SECONDS', DEFAULT_TTL_SECONDS)),
+                   chunk_size=int(os.environ.get('ANALYSIS_JOB_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)))
+
+    @property
+    def database_path(self) -> str:
+        return os.path.join(self.directory, DATABASE_FILE)
+
+    def _input_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.input.json")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread (and per process: connections don't survive a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    # Client side
+
+    def submit(self, body: bytes, total: int) -> Dict[str, Any]:
+        """
+        Queue the analysis of a request body (``{"items": [...]}`` with
+        ``total`` items) and return the new job's status.
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._input_path(job_id)}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, self._input_path(job_id))
+        self._db().execute("INSERT INTO jobs (id, status, total, created_at) VALUES (?, 'queued', ?, ?)",
+                           (job_id, int(total), time.time()))
+        self.start()
+        with self._cond:
+            self._cond.notify()
+        logger.info(f"Analysis job {job_id} queued ({total} items)")
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's state and progress, or None for unknown and expired jobs."""
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row['expires_at'] is not None and row['expires_at'] <= time.time()):
+            return None
+        return self._describe(row)
+
+    @staticmethod
+    def _describe(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'progress': {
+                'done': row['done'],
+                'total': row['total'],
+                'percent': round(100.0 * row['done'] / row['total'], 1) if row['total'] else 100.0
+            },
+            'created_at': _isoformat(row['created_at']),
+            'started_at': _isoformat(row['started_at']),
+            'finished_at': _isoformat(row['finished_at']),
+            'expires_at': _isoformat(row['expires_at']),
+            'error': row['error']
+        }
+
+    def list(self) -> List[Dict[str, Any]]:
+        rows = self._db().execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+        return [self._describe(row) for row in rows]
+
+    # Worker side
+
+    def start(self):
+        """Start the worker threads of this process (again after a fork)."""
+        with self._cond:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f'analysis-job-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            try:
+                self.purge_expired()
+                # A warming worker would fail the job; leave it queued for a ready one
+                job = self._claim() if self.ready is None or self.ready() else None
+            except Exception as e:
+                logger.error(f"Analysis job queue error: {str(e)}")
+                job = None
+            if job is None:
+                with self._cond:
+                    self._cond.wait(self.poll_seconds)
+                continue
+            self._execute(job)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        conn = self._db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Requeue the jobs of processes that died mid-run
+            for row in conn.execute("SELECT id, worker_pid FROM jobs WHERE status = 'running'").fetchall():
+                if row['worker_pid'] != os.getpid() and not _alive(row['worker_pid']):
+                    logger.warning(f"Requeuing analysis job {row['id']} of exited worker {row['worker_pid']}")
+                    conn.execute("UPDATE jobs SET status = 'queued', done = 0, started_at = NULL WHERE id = ?",
+                                 (row['id'],))
+            job = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if job is not None:
+                conn.execute("UPDATE jobs SET status = 'running', started_at = ?, worker_pid = ? WHERE id = ?",
+                             (time.time(), os.getpid(), job['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return job
+
+    def _execute(self, job: sqlite3.Row):
+        job_id = job['id']
+        conn = self._db()
+        started = time.perf_counter()
+        try:
+            with open(self._input_path(job_id), 'rb') as f:
+                items = json.load(f)['items']
+
+            def progress(done: int):
+                conn.execute("UPDATE jobs SET done = ? WHERE id = ?", (done, job_id))
+
+            result = analyze_inventory(self.predictor, items, self.chunk_size, progress)
+            finished = time.time()
+            tmp_path = f"{self.result_path(job_id)}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'success': True, 'job_id': job_id, **result,
+                           'timestamp': datetime.fromtimestamp(finished).isoformat()}, f)
+            os.replace(tmp_path, self.result_path(job_id))
+            conn.execute("UPDATE jobs SET status = 'done', done = total, finished_at = ?, expires_at = ? WHERE id = ?",
+                         (finished, finished + self.ttl_seconds, job_id))
+            logger.info(f"Analysis job {job_id} done: {len(items)} items in "
+                        f"{time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Analysis job {job_id} failed: {str(e)}")
+            finished = time.time()
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, expires_at = ? WHERE id = ?",
+                         (str(e), finished, finished + self.ttl_seconds, job_id))
+        finally:
+            self._remove(self._input_path(job_id))
+
+    def purge_expired(self, force: bool = False) -> int:
+        """Delete jobs (and their files) whose TTL has passed; returns how many."""
+        now = time.time()
+        if not force and now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return 0
+        self._last_purge = now
+        conn = self._db()
+        expired = [row['id'] for row in conn.execute(
+            "SELECT id FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).fetchall()]
+        for job_id in expired:
+            self._remove(self.result_path(job_id))
+            self._remove(self._input_path(job_id))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if expired:
+            logger.info(f"Purged {len(expired)} expired analysis jobs")
+        return len(expired)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the inventory analysis job queue")
+    parser.add_argument('command', choices=['list', 'purge'])
+    parser.add_argument('--dir', default=os.environ.get('ANALYSIS_JOBS_DIR', DEFAULT_JOBS_DIR),
+                        help="Job directory (default: $ANALYSIS_JOBS_DIR or jobs)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    jobs = AnalysisJobs(None, directory=args.dir)
+    if args.command == 'list':
+        for job in jobs.list():
+            print(json.dumps(job))
+    else:
+        print(f"Purged {jobs.purge_expired(force=True)} expired jobs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,153 +1,166 @@
-from flask import Flask, request, jsonify, render_template
+import time
+# Start of the import, for the startup timings
+STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, render_template, send_file, stream_with_context
 from flask_cors import CORS
-import pandas as pd
 import numpy as np
-import joblib
+import pandas as pd
+import itertools
 import os
+import shutil
+import tempfile
 from datetime import datetime, timedelta
 import logging
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 import traceback
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+import metrics
+import response_formats
+from analysis_jobs import AnalysisJobs, analyze_inventory
+from bulk_scoring import (CONTENT_TYPES, DEFAULT_CHUNK_SIZE, INPUT_COLUMNS, OUTPUT_FORMATS,
+                          detect_input_format, iter_input_chunks, score_stream)
+from config import env_flag
+from drift import DriftMonitor
+from feature_store import DEFAULT_FEATURES, FeatureStore
+from forecast_table import Forecaster
+from ingestion import IngestionStore
+from input_schema import DEMAND_SCHEMA
+# The model classes live in inventory_model; they are re-exported here for
+# existing ``from app import InventoryPredictor`` callers
+from inventory_model import InventoryPredictor, SimplePreprocessor
+from model_registry import ModelActivator, ModelRegistry
+from multi_model import HISTORY_FEATURES, MultiModelPredictor
+from profiling import COLLAPSED_CONTENT_TYPE, RequestProfiler
+from reorder import ReorderEngine, summarize_plan
+from startup import Startup, warm_up
+from store_insights import DEFAULT_TOP_K, MAX_TOP_K, StoreInsights
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+startup = Startup(STARTED)
+startup.mark_imported()
+# Load the models in the background and serve /health (warming) right away
+FAST_STARTUP = env_flag('FAST_STARTUP')
+
 app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing
+# Request counts and per-stage latency for /metrics
+metrics.instrument(app)
+# Opt-in stack sampling of sampled / slow requests, see /admin/profiling
+profiler = RequestProfiler.from_env()
+profiler.instrument(app)
 
-class SimplePreprocessor:
-    def __init__(self):
-        self.store_encoder = LabelEncoder()
-        self.product_encoder = LabelEncoder()
-        self.scaler = StandardScaler()
-        self.fitted = False
-    
-    def fit(self, X):
-        # Encode categorical features
-        self.store_encoder.fit(X['Store ID'].astype(str))
-        self.product_encoder.fit(X['Product ID'].astype(str))
-        
-        # Create encoded dataframe for scaling
-        X_encoded = X.copy()
-        X_encoded['Store ID'] = self.store_encoder.transform(X['Store ID'].astype(str))
-        X_encoded['Product ID'] = self.product_encoder.transform(X['Product ID'].astype(str))
-        
-        # Fit scaler on all features
-        self.scaler.fit(X_encoded)
-        self.fitted = True
-        return self
-    
-    def transform(self, X):
-        if not self.fitted:
-            raise ValueError("Preprocessor not fitted yet")
-        
-        X_encoded = X.copy()
-        
-        # Handle unknown categories by assigning them to the most frequent category
-        store_values = X['Store ID'].astype(str)
-        product_values = X['Product ID'].astype(str)
-        
-        # For new categories, use the first category seen during training
-        store_encoded = []
-        for val in store_values:
-            if val in self.store_encoder.classes_:
-                store_encoded.append(self.store_encoder.transform([val])[0])
-            else:
-                store_encoded.append(0)  # Default to first class
-        
-        product_encoded = []
-        for val in product_values:
-            if val in self.product_encoder.classes_:
-                product_encoded.append(self.product_encoder.transform([val])[0])
-            else:
-                product_encoded.append(0)  # Default to first class
-        
-        X_encoded['Store ID'] = store_encoded
-        X_encoded['Product ID'] = product_encoded
-        
-        return self.scaler.transform(X_encoded)
-    
-    def fit_transform(self, X):
-        return self.fit(X).transform(X)
-
-class InventoryPredictor:
-    def __init__(self, model_path: str = 'demand_model.pkl'):
-        """Initialize the inventory predictor with the trained model."""
-        self.model_path = model_path
-        self.model = None
-        self.load_model()
-        
-    def load_model(self):
-        """Load the trained demand forecasting model."""
-        try:
-            if os.path.exists(self.model_path):
-                self.model = joblib.load(self.model_path)
-                logger.info(f"Model loaded successfully from {self.model_path}")
-            else:
-                logger.error(f"Model file not found: {self.model_path}")
-                raise FileNotFoundError(f"Model file not found: {self.model_path}")
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            raise e
-    
-    def prepare_input_data(self, input_data: Dict) -> pd.DataFrame:
-        """
-        Prepare input data for prediction based on your model's expected features.
-        Based on your notebook, the simplified model expects:
-        ['Store ID', 'Product ID', 'Inventory Level']
-        """
+# Initialize the predictor, preferring the registry's active version. With
+# FAST_STARTUP the model itself is loaded by start_up() below.
+model_registry = ModelRegistry(os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+try:
+    with startup.phase('model_load'):
+        active_version = model_registry.get_active_version()
+        predictor = InventoryPredictor(model_registry.artifact_path(active_version) if active_version else None,
+                                       model_version=active_version, load=not FAST_STARTUP)
+except Exception as e:
+    logger.error(f"Failed to initialize predictor: {str(e)}")
+    predictor = None
+
+ingestion_store = IngestionStore()
+
+# Lag and rolling-mean history for the sales model, rebuilt from the most
+# recent ingested partitions by start_up()
+feature_store = FeatureStore(DEFAULT_FEATURES + [name for name in HISTORY_FEATURES if FeatureStore.supports(name)])
+
+# The sales model is optional; without it only /predict/combined is unavailable
+multi_model = None
+
+reorder_engine = ReorderEngine(predictor) if predictor is not None else None
+# Multi-day forecasts from the nightly table ($FORECAST_TABLE_DIR)
+forecaster = Forecaster(predictor, feature_store=feature_store) if predictor is not None else None
+store_insights = StoreInsights(predictor) if predictor is not None else None
+# Queued /inventory/analysis runs; worker threads start with the first submitted job,
+# or with the server (post_fork, __main__) when jobs were queued before a restart
+analysis_jobs = AnalysisJobs.from_env(predictor, ready=lambda: startup.ready)
+
+model_activator = ModelActivator(predictor, model_registry) if predictor is not None else None
+# Sketches of the scored traffic against the training baseline, see /admin/drift
+drift_monitor = DriftMonitor.from_env(predictor)
+for column in ('Store ID', 'Product ID'):
+    metrics.REGISTRY.gauge(f"inventory_api_drift_unknown_{column.split()[0].lower()}_rate",
+                           f"Share of scored {column}s the demand model wasn't trained on",
+                           lambda column=column: drift_monitor.unknown_rate(column) if drift_monitor is not None else None)
+metrics.REGISTRY.gauge('inventory_api_model_load_seconds', 'Seconds the live demand model took to load',
+                       lambda: predictor.model_load_seconds if predictor is not None else None)
+if model_activator is not None and float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 0)) > 0:
+    model_activator.watch(float(os.environ['MODEL_REGISTRY_POLL_SECONDS']))
+
+def start_up():
+    """
+    Load the demand model (if deferred) and warm it up with a synthetic
+    batch, then load the feature history and the sales model. Raises if the
+    demand model is unusable, which leaves the startup state 'failed'.
+    """
+    global multi_model
+    failure = None
+    if predictor is None:
+        failure = 'the predictor could not be initialized'
+    else:
         try:
-            # Create DataFrame from input
-            df = pd.DataFrame([input_data])
-            
-            # Ensure required columns exist
-            required_columns = ['Store ID', 'Product ID', 'Inventory Level']
-            
-            for col in required_columns:
-                if col not in df.columns:
-                    raise ValueError(f"Missing required column: {col}")
-            
-            # Convert data types
-            df['Store ID'] = df['Store ID'].astype(str)
-            df['Product ID'] = df['Product ID'].astype(str)
-            df['Inventory Level'] = pd.to_numeric(df['Inventory Level'])
-            
-            return df[required_columns]
-            
+            if predictor.model is None:
+                with startup.phase('model_load'):
+                    predictor.load_model()
+            warm_up(predictor, startup)
+            # Only real traffic counts towards drift
+            predictor.drift = drift_monitor
         except Exception as e:
-            logger.error(f"Error preparing input data: {str(e)}")
-            raise e
-    
-    def predict_demand(self, input_data: Dict) -> float:
-        """Predict demand for given input parameters."""
+            failure = str(e)
+
+    with startup.phase('feature_history'):
         try:
-            if self.model is None:
-                raise ValueError("Model not loaded")
-            
-            # Prepare input data
-            df = self.prepare_input_data(input_data)
-            
-            # Make prediction
-            prediction = self.model.predict(df)[0]
-            
-            # Ensure prediction is not negative
-            prediction = max(0, prediction)
-            
-            logger.info(f"Prediction made: {prediction}")
-            return float(prediction)
-            
+            feature_store.load_recent(ingestion_store)
         except Exception as e:
-            logger.error(f"Error making prediction: {str(e)}")
-            raise e
+            logger.error(f"Failed to load feature history: {str(e)}")
 
-# Initialize the predictor
-try:
-    predictor = InventoryPredictor()
-except Exception as e:
-    logger.error(f"Failed to initialize predictor: {str(e)}")
-    predictor = None
+    if failure is None:
+        with startup.phase('sales_model'):
+            try:
+                multi_model = MultiModelPredictor(predictor, feature_store=feature_store)
+            except Exception as e:
+                logger.error(f"Failed to load sales model: {str(e)}")
+    else:
+        raise RuntimeError(f"Demand model not available: {failure}")
+
+# Until start_up() has finished only these endpoints are served
+WARMING_ENDPOINTS = {'home', 'health_check', 'get_metrics', 'static', 'get_profiling', 'configure_profiling',
+                     'get_flamegraph', 'get_profile', 'list_models', 'get_analysis_job',
+                     'get_analysis_job_result'}
+
+@app.before_request
+def reject_while_warming():
+    if startup.warming and request.endpoint not in WARMING_ENDPOINTS:
+        response = jsonify({
+            'error': 'Service warming up',
+            'message': 'The models are still loading; retry shortly',
+            'startup': startup.status(),
+            'timestamp': datetime.now().isoformat()
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
+startup.run(start_up, background=FAST_STARTUP)
+
+def compact_response(payload: Dict[str, Any], content_type: str, table_key: str) -> Response:
+    """A batch endpoint's columnar payload in the negotiated compact format."""
+    started = metrics.clock()
+    body, content_type = response_formats.encode(payload, content_type, table_key)
+    metrics.lap('serialize', started)
+    return Response(body, content_type=content_type)
+
+def admin_authorized() -> bool:
+    """Check the admin token when ADMIN_TOKEN is configured."""
+    token = os.environ.get('ADMIN_TOKEN')
+    return not token or request.headers.get('X-Admin-Token') == token
 
 @app.route('/')
 def home():
@@ -156,13 +169,189 @@ def home():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint."""
+    """Health check endpoint; 503 while the models are still loading."""
+    if startup.warming:
+        return jsonify({
+            'status': 'warming',
+            'startup': startup.status(),
+            'timestamp': datetime.now().isoformat()
+        }), 503
+
     return jsonify({
         'status': 'healthy',
+        'startup': startup.status(),
         'model_loaded': predictor is not None and predictor.model is not None,
+        'model_version': predictor.model_version if predictor is not None else None,
+        'sales_model_loaded': multi_model is not None,
+        'model_loaded_at': predictor.model_loaded_at.isoformat() if predictor is not None and predictor.model_loaded_at else None,
+        'model_load_seconds': round(predictor.model_load_seconds, 4) if predictor is not None and predictor.model_load_seconds is not None else None,
+        'inference_mode': predictor.active_inference_mode if predictor is not None else None,
+        'model_activation': model_activator.status() if model_activator is not None else None,
+        'prediction_cache': predictor.cache.stats() if predictor is not None else None,
+        'micro_batching': (predictor.batcher.stats() if predictor is not None and predictor.batcher is not None
+                           else {'enabled': False}),
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request counters, latency histograms and process gauges in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/admin/profiling', methods=['GET'])
+def get_profiling():
+    """Profiler settings and the kept profiles (newest first, optionally of one route)."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'settings': profiler.settings(),
+        'profiles': profiler.summaries(request.args.get('route')),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/admin/profiling', methods=['POST'])
+def configure_profiling():
+    """
+    Switch profiling on or off and change its settings at runtime.
+    Only the worker process serving this request is reconfigured.
+    
+    Expected JSON input (every field optional):
+    {
+        "enabled": true,
+        "sample_rate": 0.01,
+        "threshold_ms": 250,
+        "interval_ms": 5,
+        "capacity": 50,
+        "clear": false
+    }
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'No JSON data provided'}), 400
+    
+    settings = {}
+    try:
+        if 'enabled' in data:
+            if not isinstance(data['enabled'], bool):
+                raise ValueError("enabled must be true or false")
+            settings['enabled'] = data['enabled']
+        for key, kind in (('sample_rate', float), ('interval_ms', float), ('capacity', int)):
+            if data.get(key) is not None:
+                settings[key] = kind(data[key])
+        if 'threshold_ms' in data:
+            settings['threshold_ms'] = float(data['threshold_ms']) if data['threshold_ms'] is not None else None
+        if data.get('clear'):
+            profiler.clear()
+        result = profiler.configure(**settings)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Validation error', 'message': str(e)}), 400
+    
+    logger.info(f"Profiling settings changed: {result}")
+    return jsonify({'success': True, 'settings': result, 'timestamp': datetime.now().isoformat()})
+
+@app.route('/admin/profiling/flamegraph', methods=['GET'])
+def get_flamegraph():
+    """Collapsed stacks of all kept profiles (optionally of one route), merged."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return Response(profiler.collapsed(route=request.args.get('route')), content_type=COLLAPSED_CONTENT_TYPE)
+
+@app.route('/admin/profiling/<int:profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Collapsed stacks of one kept profile."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    stacks = profiler.collapsed(profile_id=profile_id)
+    if stacks is None:
+        return jsonify({
+            'error': 'Profile not found',
+            'message': f"Profile {profile_id} is not in the ring (it may have been evicted)"
+        }), 404
+    return Response(stacks, content_type=COLLAPSED_CONTENT_TYPE)
+
+@app.route('/admin/drift', methods=['GET'])
+def get_drift():
+    """Sketches of the scored inputs and predictions compared against the training baseline."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    if drift_monitor is None:
+        return jsonify({
+            'error': 'Drift monitoring disabled',
+            'message': 'Set DRIFT_MONITOR=1 to monitor the scored traffic'
+        }), 404
+    
+    report = drift_monitor.report()
+    report['timestamp'] = datetime.now().isoformat()
+    return jsonify(report)
+
+@app.route('/admin/drift/reset', methods=['POST'])
+def reset_drift():
+    """Discard the sketches and start a new monitoring window."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    if drift_monitor is None:
+        return jsonify({
+            'error': 'Drift monitoring disabled',
+            'message': 'Set DRIFT_MONITOR=1 to monitor the scored traffic'
+        }), 404
+    
+    drift_monitor.flush()
+    drift_monitor.reset()
+    return jsonify({'since': drift_monitor.since.isoformat(), 'timestamp': datetime.now().isoformat()})
+
+@app.route('/admin/models', methods=['GET'])
+def list_models():
+    """List registered model versions and the state of the last activation."""
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'active_version': predictor.model_version if predictor is not None else None,
+        'registry_active_version': model_registry.get_active_version(),
+        'versions': model_registry.list_versions(),
+        'activation': model_activator.status() if model_activator is not None else None
+    })
+
+@app.route('/admin/models/activate', methods=['POST'])
+def activate_model():
+    """
+    Load, warm up and switch to a registered model version in the background.
+    
+    Expected JSON input:
+    {
+        "version": "v2"
+    }
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if model_activator is None:
+        return jsonify({
+            'error': 'Model not available',
+            'message': 'The prediction model is not loaded'
+        }), 500
+    
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    
+    try:
+        model_registry.validate_version(version)
+        status = model_activator.activate(version)
+    except ValueError as e:
+        return jsonify({'error': 'Validation error', 'message': str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({'error': 'Model version not found', 'message': str(e)}), 404
+    except RuntimeError as e:
+        return jsonify({'error': 'Activation in progress', 'message': str(e)}), 409
+    
+    return jsonify({'success': True, 'activation': status}), 202
+
 @app.route('/predict', methods=['POST'])
 def predict():
     """
@@ -185,7 +374,7 @@ def predict():
         
         # Get JSON data from request
         data = request.get_json()
-        print(data);
+        logger.debug(f"Prediction request: {data}")
         
         if not data:
             return jsonify({
@@ -194,7 +383,7 @@ def predict():
             }), 400
         
         # Validate required fields
-        required_fields = ['Store ID', 'Product ID', 'Inventory Level']
+        required_fields = DEMAND_SCHEMA.required
         missing_fields = [field for field in required_fields if field not in data]
         
         if missing_fields:
@@ -267,7 +456,15 @@ def predict_batch():
             {"Store ID": "S002", "Product ID": "P002", "Inventory Level": 150}
         ]
     }
+    
+    Add ?compact=1, or Accept: application/vnd.apache.arrow.stream (or
+    application/x-msgpack), for columns instead of per-item objects.
     """
+    try:
+        compact = response_formats.negotiate(request)
+    except response_formats.NotAcceptable as e:
+        return jsonify({'error': 'Not acceptable', 'message': str(e)}), 406
+    
     try:
         if predictor is None or predictor.model is None:
             return jsonify({
@@ -290,28 +487,38 @@ def predict_batch():
                 'message': 'Items should be a non-empty array'
             }), 400
         
-        predictions = []
-        errors = []
+        scored, errors = predictor.predict_demand_batch(items)
         
-        for i, item in enumerate(items):
-            try:
-                predicted_demand = predictor.predict_demand(item)
-                inventory_level = float(item['Inventory Level'])
-                stock_ratio = predicted_demand / inventory_level if inventory_level > 0 else 0
-                
-                predictions.append({
-                    'index': i,
-                    'input': item,
-                    'demand_forecast': round(predicted_demand, 2),
-                    'stock_ratio': round(stock_ratio, 2)
-                })
-                
-            except Exception as e:
-                errors.append({
-                    'index': i,
-                    'item': item,
-                    'error': str(e)
-                })
+        inventory_levels = scored['Inventory Level'].to_numpy()
+        predicted = scored['predicted_demand'].to_numpy()
+        stock_ratios = np.divide(predicted, inventory_levels,
+                                 out=np.zeros_like(predicted), where=inventory_levels > 0)
+        
+        if compact is not None:
+            # Columns, without echoing the inputs back
+            return compact_response({
+                'success': True,
+                'predictions': {
+                    'index': scored.index.to_numpy(dtype=np.int64),
+                    'demand_forecast': response_formats.round_column(predicted),
+                    'stock_ratio': response_formats.round_column(stock_ratios)
+                },
+                'errors': [{'index': error['index'], 'error': error['error']} for error in errors],
+                'total_items': len(items),
+                'successful_predictions': len(scored),
+                'failed_predictions': len(errors),
+                'timestamp': datetime.now().isoformat()
+            }, compact, 'predictions')
+        
+        predictions = [
+            {
+                'index': int(i),
+                'input': items[i],
+                'demand_forecast': round(float(demand), 2),
+                'stock_ratio': round(float(ratio), 2)
+            }
+            for i, demand, ratio in zip(scored.index, predicted, stock_ratios)
+        ]
         
         return jsonify({
             'success': True,
@@ -330,6 +537,338 @@ def predict_batch():
             'message': 'An error occurred during batch prediction'
         }), 500
 
+@app.route('/predict/bulk', methods=['POST'])
+def predict_bulk():
+    """
+    Score a CSV or Parquet upload in fixed-size chunks and stream the results.
+    
+    Send the file as the multipart form field "file", or as the raw request
+    body with Content-Type text/csv or application/vnd.apache.parquet.
+    
+    Query parameters:
+        format: "csv" or "ndjson" (default: from the Accept header, else csv)
+        chunk_size: rows per model call (default: 50000)
+    """
+    if predictor is None or predictor.model is None:
+        return jsonify({
+            'error': 'Model not available',
+            'message': 'The prediction model is not loaded'
+        }), 500
+    
+    output_format = request.args.get('format')
+    if output_format is None:
+        best = request.accept_mimetypes.best_match([CONTENT_TYPES['csv'], CONTENT_TYPES['ndjson']])
+        output_format = 'ndjson' if best == CONTENT_TYPES['ndjson'] else 'csv'
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({
+            'error': 'Invalid format',
+            'message': f"format must be one of: {', '.join(OUTPUT_FORMATS)}"
+        }), 400
+    
+    chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    if chunk_size is None or chunk_size <= 0:
+        return jsonify({
+            'error': 'Invalid chunk_size',
+            'message': 'chunk_size must be a positive integer'
+        }), 400
+    
+    upload = request.files.get('file')
+    if upload is not None:
+        input_format = detect_input_format(upload.filename, upload.mimetype)
+        source = upload.stream
+    elif request.content_length and not request.form:
+        input_format = detect_input_format(content_type=request.mimetype)
+        if input_format == 'parquet':
+            # Parquet needs random access, so spool the body to disk first
+            source = tempfile.TemporaryFile()
+            shutil.copyfileobj(request.stream, source)
+            source.seek(0)
+        else:
+            source = request.stream
+    else:
+        return jsonify({
+            'error': 'No data provided',
+            'message': 'Upload a CSV or Parquet file as the "file" form field or the request body'
+        }), 400
+    
+    # Read the first chunk up front so malformed files are rejected with a 400
+    try:
+        chunks = iter_input_chunks(source, input_format, chunk_size)
+        first_chunk = next(chunks, None)
+    except Exception as e:
+        return jsonify({
+            'error': 'Invalid file',
+            'message': str(e)
+        }), 400
+    
+    if first_chunk is not None:
+        missing_fields = [col for col in INPUT_COLUMNS if col not in first_chunk.columns]
+        if missing_fields:
+            return jsonify({
+                'error': 'Missing required fields',
+                'missing_fields': missing_fields,
+                'required_fields': INPUT_COLUMNS
+            }), 400
+        chunks = itertools.chain([first_chunk], chunks)
+    
+    def generate():
+        try:
+            yield from score_stream(predictor, chunks, output_format)
+        except Exception as e:
+            # Headers are already sent, so all we can do is log and end the stream
+            logger.error(f"Bulk scoring error: {str(e)}")
+            logger.error(traceback.format_exc())
+            if output_format == 'ndjson':
+                yield '{"error": "An error occurred during bulk scoring"}\n'
+    
+    return Response(stream_with_context(generate()), mimetype=CONTENT_TYPES[output_format])
+
+@app.route('/predict/combined', methods=['POST'])
+def predict_combined():
+    """
+    Predict demand and sales for one or more items in a single request.
+    
+    Expected JSON input (a single item object is also accepted):
+    {
+        "items": [
+            {"Store ID": "S001", "Product ID": "P0001", "Inventory Level": 200,
+             "Date": "2024-01-15", "Category": "Groceries", "Region": "North",
+             "Weather Condition": "Sunny", "Seasonality": "Winter",
+             "Price": 33.5, "Discount": 10, "Competitor Pricing": 35.0, "Units Ordered": 80}
+        ]
+    }
+    
+    Lag and moving-average fields (e.g. "units_sold_lag_1") are optional.
+    Items with only the demand fields still get a demand forecast.
+    """
+    try:
+        if multi_model is None or predictor.model is None:
+            return jsonify({
+                'error': 'Model not available',
+                'message': 'The demand and sales models are not both loaded'
+            }), 500
+        
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and 'items' not in data:
+            data = {'items': [data]}
+        
+        if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+            return jsonify({
+                'error': 'Invalid data format',
+                'message': 'Please provide a non-empty "items" array or a single item object'
+            }), 400
+        
+        items = data['items']
+        scored, errors = multi_model.predict_combined(items)
+        
+        inventory_levels = scored['Inventory Level'].to_numpy()
+        demand = scored['predicted_demand'].to_numpy()
+        stock_ratios = np.divide(demand, inventory_levels,
+                                 out=np.zeros_like(demand), where=inventory_levels > 0)
+        
+        predictions = []
+        for i, demand_value, ratio, sales_value, sales_error in zip(
+                scored.index, demand, stock_ratios, scored['predicted_sales'], scored['sales_error']):
+            prediction = {
+                'index': int(i),
+                'input': items[i],
+                'demand_forecast': round(float(demand_value), 2),
+                'stock_ratio': round(float(ratio), 2),
+                'sales_forecast': round(float(sales_value), 2) if np.isfinite(sales_value) else None
+            }
+            if isinstance(sales_error, str):
+                prediction['sales_error'] = sales_error
+            predictions.append(prediction)
+        
+        return jsonify({
+            'success': True,
+            'predictions': predictions,
+            'errors': errors,
+            'total_items': len(items),
+            'successful_predictions': len(predictions),
+            'sales_predictions': int(scored['sales_error'].isna().sum()),
+            'failed_predictions': len(errors),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Combined prediction error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred during combined prediction'
+        }), 500
+
+@app.route('/forecast', methods=['POST'])
+def forecast():
+    """
+    Daily demand forecasts for one or more store/product pairs over a date range.
+    
+    Expected JSON input (a single item object is also accepted):
+    {
+        "start_date": "2024-01-01",
+        "end_date": "2024-01-07",
+        "items": [
+            {"Store ID": "S001", "Product ID": "P0001"},
+            {"Store ID": "S009", "Product ID": "P0001", "Inventory Level": 200}
+        ]
+    }
+    
+    The dates default to the forecast table's range. Pairs and dates the
+    nightly table covers are read from it; anything else is forecast live
+    and needs "Inventory Level".
+    """
+    try:
+        if forecaster is None or predictor.model is None:
+            return jsonify({
+                'error': 'Model not available',
+                'message': 'The prediction model is not loaded'
+            }), 500
+        
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and 'items' not in data:
+            data = {'items': [data], 'start_date': data.get('start_date'), 'end_date': data.get('end_date')}
+        
+        if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+            return jsonify({
+                'error': 'Invalid data format',
+                'message': 'Please provide a non-empty "items" array or a single item object'
+            }), 400
+        
+        items = data['items']
+        try:
+            result, errors = forecaster.forecast(items, data.get('start_date'), data.get('end_date'))
+        except ValueError as e:
+            return jsonify({
+                'error': 'Validation error',
+                'message': str(e)
+            }), 400
+        
+        dates = result['dates']
+        forecasts = []
+        for i, store_id, product_id, source, demand, inventory in zip(
+                result['index'], result['store_id'], result['product_id'], result['source'],
+                result['demand'].tolist(), result['inventory'].tolist()):
+            forecasts.append({
+                'index': int(i),
+                'store_id': store_id,
+                'product_id': product_id,
+                'source': str(source),
+                'total_demand': round(sum(demand), 2),
+                'daily': [
+                    {'date': date, 'demand_forecast': round(value, 2), 'projected_inventory': round(level, 2)}
+                    for date, value, level in zip(dates, demand, inventory)
+                ]
+            })
+        
+        table = result['table']
+        return jsonify({
+            'success': True,
+            'start_date': dates[0],
+            'end_date': dates[-1],
+            'forecasts': forecasts,
+            'errors': errors,
+            'table': {
+                **table.manifest,
+                # Built by a model that has since been replaced
+                'stale': table.model_version != predictor.model_version
+            } if table is not None else None,
+            'total_items': len(items),
+            'table_forecasts': int((result['source'] == 'table').sum()),
+            'live_forecasts': int((result['source'] == 'live').sum()),
+            'failed_items': len(errors),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Forecast error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred during forecasting'
+        }), 500
+
+@app.route('/reorder/plan', methods=['POST'])
+def reorder_plan():
+    """
+    Compute safety stock and order quantities for many items at once.
+    
+    Expected JSON input (a single item object is also accepted):
+    {
+        "policy": {"lead_time_days": 7, "service_level": 0.95},
+        "items": [
+            {"Store ID": "S001", "Product ID": "P0001", "Inventory Level": 200},
+            {"Store ID": "S001", "Product ID": "P0002", "Inventory Level": 40,
+             "on_order": 50, "pack_size": 12}
+        ]
+    }
+    
+    "policy" is optional and sets the defaults for every item; any policy
+    field can also be set on an item.
+    """
+    try:
+        if reorder_engine is None or predictor.model is None:
+            return jsonify({
+                'error': 'Model not available',
+                'message': 'The prediction model is not loaded'
+            }), 500
+        
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and 'items' not in data:
+            data = {'items': [data]}
+        
+        if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+            return jsonify({
+                'error': 'Invalid data format',
+                'message': 'Please provide a non-empty "items" array or a single item object'
+            }), 400
+        
+        items = data['items']
+        try:
+            planned, errors = reorder_engine.plan(items, data.get('policy'))
+        except ValueError as e:
+            return jsonify({
+                'error': 'Invalid policy',
+                'message': str(e)
+            }), 400
+        
+        col = {name: planned[name].to_numpy() for name in planned.columns}
+        plan = []
+        for n, i in enumerate(planned.index):
+            days_of_cover = col['days_of_cover'][n]
+            plan.append({
+                'index': int(i),
+                'store_id': col['Store ID'][n],
+                'product_id': col['Product ID'][n],
+                'current_inventory': float(col['Inventory Level'][n]),
+                'demand_forecast': round(float(col['predicted_demand'][n]), 2),
+                'lead_time_days': float(col['lead_time_days'][n]),
+                'service_level': float(col['service_level'][n]),
+                'safety_stock': round(float(col['safety_stock'][n]), 2),
+                'reorder_point': round(float(col['reorder_point'][n]), 2),
+                'order_up_to_level': round(float(col['order_up_to_level'][n]), 2),
+                'inventory_position': float(col['inventory_position'][n]),
+                'order_quantity': float(col['order_quantity'][n]),
+                'below_reorder_point': bool(col['below_reorder_point'][n]),
+                'days_of_cover': round(float(days_of_cover), 1) if np.isfinite(days_of_cover) else None
+            })
+        
+        return jsonify({
+            'success': True,
+            'plan': plan,
+            'summary': summarize_plan(planned),
+            'errors': errors,
+            'total_items': len(items),
+            'failed_items': len(errors),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Reorder plan error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred while computing the reorder plan'
+        }), 500
+
 @app.route('/inventory/analysis', methods=['POST'])
 def inventory_analysis():
     """
@@ -342,7 +881,15 @@ def inventory_analysis():
             {"Store ID": "S002", "Product ID": "P002", "Inventory Level": 150}
         ]
     }
+    
+    Add ?compact=1, or Accept: application/vnd.apache.arrow.stream (or
+    application/x-msgpack), for columns instead of per-item objects.
     """
+    try:
+        compact = response_formats.negotiate(request)
+    except response_formats.NotAcceptable as e:
+        return jsonify({'error': 'Not acceptable', 'message': str(e)}), 406
+    
     try:
         if predictor is None or predictor.model is None:
             return jsonify({
@@ -359,59 +906,24 @@ def inventory_analysis():
             }), 400
         
         items = data['items']
-        results = []
-        total_inventory = 0
-        total_predicted_demand = 0
-        critical_items = []
-        overstocked_items = []
+        if not isinstance(items, list):
+            return jsonify({
+                'error': 'Invalid items format',
+                'message': 'Items should be an array'
+            }), 400
         
-        for item in items:
-            try:
-                predicted_demand = predictor.predict_demand(item)
-                inventory_level = float(item['Inventory Level'])
-                stock_ratio = predicted_demand / inventory_level if inventory_level > 0 else 0
-                
-                total_inventory += inventory_level
-                total_predicted_demand += predicted_demand
-                
-                analysis = {
-                    'store_id': item['Store ID'],
-                    'product_id': item['Product ID'],
-                    'current_inventory': inventory_level,
-                    'predicted_demand': round(predicted_demand, 2),
-                    'stock_ratio': round(stock_ratio, 2),
-                    'days_of_stock': round(inventory_level / predicted_demand, 1) if predicted_demand > 0 else float('inf')
-                }
-                
-                if stock_ratio > 1.5:
-                    critical_items.append(analysis)
-                elif stock_ratio < 0.5:
-                    overstocked_items.append(analysis)
-                
-                results.append(analysis)
-                
-            except Exception as e:
-                logger.error(f"Error analyzing item {item}: {str(e)}")
-                continue
-        
-        # Overall analysis
-        overall_stock_ratio = total_predicted_demand / total_inventory if total_inventory > 0 else 0
-        
-        summary = {
-            'total_items_analyzed': len(results),
-            'total_inventory_value': round(total_inventory, 2),
-            'total_predicted_demand': round(total_predicted_demand, 2),
-            'overall_stock_ratio': round(overall_stock_ratio, 2),
-            'critical_items_count': len(critical_items),
-            'overstocked_items_count': len(overstocked_items)
-        }
+        result = analyze_inventory(predictor, items, compact=compact is not None)
+        
+        if compact is not None:
+            return compact_response({
+                'success': True,
+                **result,
+                'timestamp': datetime.now().isoformat()
+            }, compact, 'detailed_analysis')
         
         return jsonify({
             'success': True,
-            'summary': summary,
-            'detailed_analysis': results,
-            'critical_items': critical_items[:10],  # Top 10 critical items
-            'overstocked_items': overstocked_items[:10],  # Top 10 overstocked items
+            **result,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -422,6 +934,321 @@ def inventory_analysis():
             'message': 'An error occurred during inventory analysis'
         }), 500
 
+@app.route('/inventory/analysis/jobs', methods=['POST'])
+def submit_analysis_job():
+    """
+    Queue an inventory analysis and return its job ID at once.
+    
+    Takes the same JSON input as /inventory/analysis. Poll
+    /inventory/analysis/jobs/<job_id> for progress and fetch the result from
+    /inventory/analysis/jobs/<job_id>/result.
+    """
+    try:
+        if predictor is None or predictor.model is None:
+            return jsonify({
+                'error': 'Model not available',
+                'message': 'The prediction model is not loaded'
+            }), 500
+        
+        data = request.get_json()
+        
+        if not data or 'items' not in data:
+            return jsonify({
+                'error': 'Invalid data format',
+                'message': 'Please provide "items" array in the request body'
+            }), 400
+        
+        if not isinstance(data['items'], list):
+            return jsonify({
+                'error': 'Invalid items format',
+                'message': 'Items should be an array'
+            }), 400
+        
+        job = analysis_jobs.submit(request.get_data(), len(data['items']))
+        return jsonify({
+            'success': True,
+            'job': job,
+            'status_url': f"/inventory/analysis/jobs/{job['job_id']}",
+            'result_url': f"/inventory/analysis/jobs/{job['job_id']}/result",
+            'timestamp': datetime.now().isoformat()
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Analysis job submission error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred while queuing the analysis'
+        }), 500
+
+def analysis_job_not_found(job_id: str):
+    return jsonify({
+        'error': 'Job not found',
+        'message': f"No analysis job {job_id} (results expire after {analysis_jobs.ttl_seconds:g}s)"
+    }), 404
+
+@app.route('/inventory/analysis/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    """State and progress of an analysis job."""
+    job = analysis_jobs.status(job_id)
+    if job is None:
+        return analysis_job_not_found(job_id)
+    return jsonify({'success': True, 'job': job, 'timestamp': datetime.now().isoformat()})
+
+@app.route('/inventory/analysis/jobs/<job_id>/result', methods=['GET'])
+def get_analysis_job_result(job_id):
+    """The result of a finished analysis job, in the /inventory/analysis format."""
+    job = analysis_jobs.status(job_id)
+    if job is None:
+        return analysis_job_not_found(job_id)
+    if job['status'] == 'failed':
+        return jsonify({'error': 'Analysis failed', 'message': job['error'], 'job': job}), 500
+    if job['status'] != 'done':
+        return jsonify({
+            'error': 'Job not finished',
+            'message': f"Analysis job {job_id} is {job['status']}",
+            'job': job
+        }), 409
+    try:
+        return send_file(os.path.abspath(analysis_jobs.result_path(job_id)), mimetype='application/json')
+    except FileNotFoundError:
+        # Purged since the status check
+        return analysis_job_not_found(job_id)
+
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """
+    Append an inventory CSV to the partitioned Parquet store.
+    
+    Send the file as the multipart form field "file", or as the raw request
+    body with Content-Type text/csv. Rows already ingested (same Date, Store ID
+    and Product ID) and files ingested before are skipped.
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, source = upload.stream, upload.filename or 'upload.csv'
+    elif request.content_length and not request.form:
+        stream, source = request.stream, request.args.get('filename', 'upload.csv')
+    else:
+        return jsonify({
+            'error': 'No data provided',
+            'message': 'Upload a CSV file as the "file" form field or the request body'
+        }), 400
+    
+    try:
+        batch = ingestion_store.ingest_upload(stream, source)
+        if not batch.get('skipped'):
+            feature_store.load_parquet([ingestion_store.file_path(relative) for relative in batch['files']])
+    except ValueError as e:
+        return jsonify({
+            'error': 'Invalid file',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Ingestion error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred during ingestion'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'batch': batch,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/features', methods=['POST'])
+def lookup_features():
+    """
+    Look up lag and rolling-mean features for one or more store/product pairs.
+    
+    Expected JSON input (a single item object is also accepted):
+    {
+        "items": [
+            {"Store ID": "S001", "Product ID": "P0001", "Date": "2024-01-15"}
+        ]
+    }
+    
+    "Date" is optional and defaults to the day after the pair's latest data.
+    Features the store has no history for are null.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and 'items' not in data:
+        data = {'items': [data]}
+    
+    if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+        return jsonify({
+            'error': 'Invalid data format',
+            'message': 'Please provide a non-empty "items" array or a single item object'
+        }), 400
+    
+    items = data['items']
+    if not all(isinstance(item, dict) and 'Store ID' in item and 'Product ID' in item for item in items):
+        return jsonify({
+            'error': 'Invalid items format',
+            'message': 'Each item needs "Store ID" and "Product ID"'
+        }), 400
+    
+    dates = [item.get('Date') for item in items]
+    values = feature_store.lookup_batch(
+        [item['Store ID'] for item in items], [item['Product ID'] for item in items],
+        dates if any(date is not None for date in dates) else None
+    )
+    features = [
+        {name: round(float(value), 4) if np.isfinite(value) else None
+         for name, value in zip(feature_store.feature_names, row)}
+        for row in values
+    ]
+    
+    return jsonify({
+        'success': True,
+        'features': features,
+        'feature_names': feature_store.feature_names,
+        'pairs_tracked': len(feature_store),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/features/update', methods=['POST'])
+def update_features():
+    """
+    Add daily observations to the feature store.
+    
+    Expected JSON input:
+    {
+        "items": [
+            {"Date": "2024-01-15", "Store ID": "S001", "Product ID": "P0001",
+             "Units Sold": 120, "Inventory Level": 200, "Units Ordered": 80}
+        ]
+    }
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+        return jsonify({
+            'error': 'Invalid data format',
+            'message': 'Please provide a non-empty "items" array in the request body'
+        }), 400
+    
+    try:
+        df = pd.DataFrame.from_records(
+            [item for item in data['items'] if isinstance(item, dict)],
+            columns=['Date', 'Store ID', 'Product ID', 'Units Sold', 'Inventory Level', 'Units Ordered']
+        ).dropna(subset=['Date', 'Store ID', 'Product ID'])
+        pairs_updated = feature_store.update(df)
+    except Exception as e:
+        logger.error(f"Feature store update error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred while updating the feature store'
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'pairs_updated': pairs_updated,
+        'pairs_tracked': len(feature_store),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/store-insights', methods=['GET'])
+def get_store_insights():
+    """
+    Serve a store's precomputed rollups, or totals for every store when no
+    store_id is given.
+    
+    Query parameters: store_id (optional), k (top items per list, default 10)
+    """
+    if store_insights is None:
+        return jsonify({
+            'error': 'Model not available',
+            'message': 'The prediction model is not loaded'
+        }), 500
+    
+    store_id = request.args.get('store_id')
+    if not store_id:
+        return jsonify({
+            'success': True,
+            'stores': store_insights.overview(),
+            'model_version': store_insights.model_version,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    try:
+        k = int(request.args.get('k', DEFAULT_TOP_K))
+    except ValueError:
+        k = -1
+    if not 1 <= k <= MAX_TOP_K:
+        return jsonify({
+            'error': 'Invalid k',
+            'message': f'k must be an integer between 1 and {MAX_TOP_K}'
+        }), 400
+    
+    insights = store_insights.insights(store_id, k)
+    if insights is None:
+        return jsonify({
+            'error': 'Store not found',
+            'message': f'No inventory levels have been received for store {store_id}'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'insights': insights,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/store-insights/update', methods=['POST'])
+def update_store_insights():
+    """
+    Fold new inventory levels into the store rollups.
+    
+    Expected JSON input:
+    {
+        "items": [
+            {"Store ID": "S001", "Product ID": "P0001", "Inventory Level": 200}
+        ]
+    }
+    
+    Each item replaces the previous inventory level of its store/product pair.
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        if store_insights is None or predictor.model is None:
+            return jsonify({
+                'error': 'Model not available',
+                'message': 'The prediction model is not loaded'
+            }), 500
+        
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data.get('items'), list) or len(data['items']) == 0:
+            return jsonify({
+                'error': 'Invalid data format',
+                'message': 'Please provide a non-empty "items" array in the request body'
+            }), 400
+        
+        items = data['items']
+        summary, errors = store_insights.update(items)
+        
+        return jsonify({
+            'success': True,
+            **summary,
+            'errors': errors,
+            'total_items': len(items),
+            'failed_items': len(errors),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logger.error(f"Store insights update error: {str(e)}")
+        return jsonify({
+            'error': 'Internal server error',
+            'message': 'An error occurred while updating store insights'
+        }), 500
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
@@ -435,6 +1262,10 @@ if __name__ == '__main__':
     if not os.path.exists('demand_model.pkl'):
         logger.warning("demand_model.pkl not found. Please ensure the model file is in the same directory as app.py")
     
+    # Pick up analysis jobs queued before a restart
+    if os.path.exists(analysis_jobs.database_path):
+        analysis_jobs.start()
+    
     # Run the Flask app
     app.run(
         host='0.0.0.0',
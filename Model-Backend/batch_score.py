@@ -0,0 +1,336 @@
+"""
+Offline batch scoring of full inventory datasets, partitioned by Store ID.
+
+The run has two resumable phases:
+
+1. Staging: the input is streamed in chunks and each chunk is split by
+   Store ID into ``<output>/_staging/store=<id>/part-NNNNN.csv``. A
+   marker ``_staging/_chunks/NNNNN.json`` records each finished chunk, and
+   an interrupted staging run resumes after the last one.
+2. Scoring: the staged parts are scored in a process pool (each worker loads
+   the model once) and written to ``<output>/store=<id>/part-NNNNN.<ext>``.
+
+Every output part is written to a temporary file and renamed into place when
+complete, so a finished part is its own checkpoint. Re-running the same
+command after an interruption skips whatever is already done.
+
+Usage:
+    python batch_score.py retail_store_inventory.csv -o scores/
+    python batch_score.py snapshot.parquet -o scores/ --workers 32 --output-format parquet
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from bulk_scoring import INPUT_COLUMNS, detect_input_format, iter_input_chunks, score_chunk
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION_ROWS = 1000000
+STAGING_DIR = '_staging'
+STAGING_DONE = '_DONE'
+STAGING_RUN = '_RUN'
+CHUNKS_DIR = '_chunks'
+SUCCESS_FILE = '_SUCCESS'
+OUTPUT_FORMATS = ('csv', 'parquet')
+
+# Set in each worker process by _init_worker
+_predictor = None
+
+
+def partition_name(store_id: Any) -> str:
+    """
+    Directory name for a store partition (rows without a Store ID go to
+    store=_missing). IDs that aren't safe as a file name as they are get a
+    hash of the raw ID appended, so two IDs never share a partition.
+    """
+    if pd.isna(store_id):
+        return 'store=_missing'
+    raw = str(store_id)
+    safe = re.sub(r'[^A-Za-z0-9._-]', '_', raw)
+    if safe == raw and raw not in ('', '_missing', '.', '..'):
+        return 'store=' + raw
+    # '~' never appears in a safe name, so these can't collide with one
+    return f"store={safe}~{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _staged_chunks(staging_dir: str) -> List[Dict[str, Any]]:
+    """Markers of the chunks an earlier run finished staging, in input order."""
+    chunks = []
+    while True:
+        path = os.path.join(staging_dir, CHUNKS_DIR, f"{len(chunks):05d}.json")
+        if not os.path.exists(path):
+            return chunks
+        with open(path) as f:
+            chunks.append(json.load(f))
+
+
+def stage_input(input_path: str, output_dir: str, input_format: str, partition_rows: int) -> Dict[str, Any]:
+    """
+    Split the input into per-store staging parts. Returns the staging
+    manifest, reusing a completed staging directory from an earlier run and
+    resuming an interrupted one after its last finished chunk.
+    """
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    done_path = os.path.join(staging_dir, STAGING_DONE)
+    run_path = os.path.join(staging_dir, STAGING_RUN)
+
+    if os.path.exists(done_path):
+        with open(done_path) as f:
+            manifest = json.load(f)
+        if manifest.get('input') != os.path.abspath(input_path):
+            raise ValueError(
+                f"{output_dir} holds a run for {manifest.get('input')}; use --restart or another output directory"
+            )
+        logger.info(f"Reusing staged input: {manifest['rows']} rows in {len(manifest['parts'])} parts")
+        return manifest
+
+    # A staging directory without the marker is from an interrupted run
+    run_info = {'input': os.path.abspath(input_path), 'partition_rows': partition_rows}
+    chunks: List[Dict[str, Any]] = []
+    if os.path.exists(run_path):
+        with open(run_path) as f:
+            previous = json.load(f)
+        if previous.get('input') != run_info['input']:
+            raise ValueError(
+                f"{output_dir} holds a run for {previous.get('input')}; use --restart or another output directory"
+            )
+        if previous == run_info:
+            chunks = _staged_chunks(staging_dir)
+    if not chunks:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(os.path.join(staging_dir, CHUNKS_DIR))
+        _write_json(run_path, run_info)
+
+    start = time.perf_counter()
+    rows = sum(chunk['rows'] for chunk in chunks)
+    parts: List[str] = [part for chunk in chunks for part in chunk['parts']]
+    if chunks:
+        logger.info(f"Resuming staging after {len(chunks)} chunks ({rows} rows)")
+    staged = iter_input_chunks(input_path, input_format, partition_rows, skip_rows=rows)
+    for chunk_number, chunk in enumerate(staged, start=len(chunks)):
+        missing = [col for col in INPUT_COLUMNS if col not in chunk.columns]
+        if 'Store ID' in missing:
+            raise ValueError("Input has no 'Store ID' column to partition by")
+
+        chunk.index.name = 'row'
+        chunk_parts: List[str] = []
+        for store_id, group in chunk.groupby('Store ID', dropna=False, sort=False):
+            part = os.path.join(partition_name(store_id), f"part-{chunk_number:05d}.csv")
+            if part in chunk_parts:
+                raise ValueError(f"Store ID {store_id!r} maps to the same partition as another ID: {part}")
+            chunk_parts.append(part)
+            os.makedirs(os.path.join(staging_dir, os.path.dirname(part)), exist_ok=True)
+            group.to_csv(os.path.join(staging_dir, part))
+        # Written last, so a chunk without a marker is staged again
+        _write_json(os.path.join(staging_dir, CHUNKS_DIR, f"{chunk_number:05d}.json"),
+                    {'rows': len(chunk), 'parts': chunk_parts})
+        parts.extend(chunk_parts)
+        rows += len(chunk)
+        logger.info(f"Staged {rows} rows")
+
+    manifest = {
+        'input': run_info['input'],
+        'rows': rows,
+        'parts': parts,
+        'staged_at': datetime.now().isoformat()
+    }
+    _write_json(done_path, manifest)
+    logger.info(f"Staged {rows} rows into {len(parts)} parts in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+def output_path_for(output_dir: str, part: str, output_format: str) -> str:
+    return os.path.join(output_dir, os.path.splitext(part)[0] + '.' + output_format)
+
+
+def _init_worker(model_path: str):
+    """Load the model once per worker process."""
+    global _predictor
+
+    # Parallelism comes from the processes; keep LightGBM single-threaded so
+    # the workers don't oversubscribe the cores. Must be set before import.
+    os.environ['OMP_NUM_THREADS'] = '1'
+    logging.getLogger('inventory_model').setLevel(logging.WARNING)
+
+    from inventory_model import InventoryPredictor
+    from prediction_cache import PredictionCache
+
+    _predictor = InventoryPredictor(model_path, cache=PredictionCache(max_size=0))
+
+
+def _score_part(staging_path: str, output_path: str, output_format: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    chunk = pd.read_csv(staging_path, index_col='row', dtype={'Store ID': str, 'Product ID': str})
+    out = score_chunk(_predictor, chunk)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    if output_format == 'parquet':
+        if out['Inventory Level'].dtype == object:
+            # Unparseable inventory values are echoed back as strings
+            out['Inventory Level'] = out['Inventory Level'].astype('string')
+        out.to_parquet(tmp_path, index=False)
+    else:
+        out.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+
+    return {
+        'rows': len(out),
+        'failed': int(out['error'].notna().sum()),
+        'seconds': time.perf_counter() - start
+    }
+
+
+def score_partitions(manifest: Dict[str, Any], output_dir: str, model_path: str,
+                     workers: int, output_format: str) -> Dict[str, Any]:
+    """Score every staged part that has no output yet."""
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    pending = [
+        part for part in manifest['parts']
+        if not os.path.exists(output_path_for(output_dir, part, output_format))
+    ]
+    skipped = len(manifest['parts']) - len(pending)
+    if skipped:
+        logger.info(f"Resuming: {skipped} of {len(manifest['parts'])} parts already scored")
+    # Largest parts first so no worker is left with a big part at the end
+    pending.sort(key=lambda part: os.path.getsize(os.path.join(staging_dir, part)), reverse=True)
+
+    start = time.perf_counter()
+    rows = 0
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+            futures = {
+                pool.submit(
+                    _score_part,
+                    os.path.join(staging_dir, part),
+                    output_path_for(output_dir, part, output_format),
+                    output_format
+                ): part
+                for part in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                rows += result['rows']
+                failed += result['failed']
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"[{done}/{len(pending)}] {futures[future]}: {result['rows']} rows in "
+                    f"{result['seconds']:.2f}s ({rows / elapsed:.0f} rows/s overall)"
+                )
+
+    return {
+        'parts': len(manifest['parts']),
+        'parts_scored': len(pending),
+        'parts_skipped': skipped,
+        'rows_scored': rows,
+        'rows_failed': failed,
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+
+def run(input_path: str, output_dir: str, model_path: str = None, workers: int = None,
+        input_format: str = None, output_format: str = 'csv',
+        partition_rows: int = DEFAULT_PARTITION_ROWS, keep_staging: bool = False) -> Dict[str, Any]:
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    if model_path is None:
+        from inventory_model import default_model_path
+        model_path = default_model_path()
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found: {model_path}")
+    workers = workers or os.cpu_count() or 1
+    input_format = input_format or detect_input_format(input_path)
+
+    success_path = os.path.join(output_dir, SUCCESS_FILE)
+    if os.path.exists(success_path):
+        with open(success_path) as f:
+            previous = json.load(f)
+        if previous.get('input') != os.path.abspath(input_path):
+            raise ValueError(
+                f"{output_dir} holds a run for {previous.get('input')}; use --restart or another output directory"
+            )
+        logger.info(f"{output_dir} is already complete; use --restart to score it again")
+        return previous
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = stage_input(input_path, output_dir, input_format, partition_rows)
+    summary = score_partitions(manifest, output_dir, os.path.abspath(model_path), workers, output_format)
+    summary.update({
+        'input': manifest['input'],
+        'rows': manifest['rows'],
+        'model': os.path.abspath(model_path),
+        'workers': workers,
+        'output_format': output_format,
+        'finished_at': datetime.now().isoformat()
+    })
+
+    with open(os.path.join(output_dir, SUCCESS_FILE), 'w') as f:
+        json.dump(summary, f, indent=2)
+    if not keep_staging:
+        shutil.rmtree(os.path.join(output_dir, STAGING_DIR), ignore_errors=True)
+    return summary
+
+
+def restart(output_dir: str):
+    """Remove the staging area and all outputs of a previous run."""
+    if not os.path.isdir(output_dir):
+        return
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if name == STAGING_DIR or name.startswith('store='):
+            shutil.rmtree(path)
+        elif name == SUCCESS_FILE:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a full inventory dataset in parallel, partitioned by Store ID')
+    parser.add_argument('input', help='Input CSV or Parquet file')
+    parser.add_argument('-o', '--output-dir', required=True, help='Directory for partitioned outputs and checkpoints')
+    parser.add_argument('--model', help='Model artifact directory or .pkl (default: demand_model, else demand_model.pkl)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--input-format', choices=('csv', 'parquet'), help='Default: guessed from the file name')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='csv')
+    parser.add_argument('--partition-rows', type=int, default=DEFAULT_PARTITION_ROWS,
+                        help=f"Input rows read per staging chunk; bounds part size (default: {DEFAULT_PARTITION_ROWS})")
+    parser.add_argument('--keep-staging', action='store_true', help='Keep the staged input after a successful run')
+    parser.add_argument('--restart', action='store_true', help='Discard checkpoints from a previous run first')
+    args = parser.parse_args()
+
+    if args.restart:
+        restart(args.output_dir)
+
+    try:
+        summary = run(
+            args.input, args.output_dir, model_path=args.model, workers=args.workers,
+            input_format=args.input_format, output_format=args.output_format,
+            partition_rows=args.partition_rows, keep_staging=args.keep_staging
+        )
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    main()
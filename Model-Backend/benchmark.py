@@ -0,0 +1,351 @@
+"""
+Load-testing and latency benchmark for the Inventory Management API.
+
+Drives /predict, /predict/batch and /inventory/analysis with synthetic
+store/product/inventory workloads and reports p50/p95/p99 latency,
+throughput and peak RSS. Results are written as JSON so runs from different
+commits can be compared.
+
+The in-process app runs with the prediction cache off, so every /predict
+request reaches the model; pass ``--cache`` to measure with it. Against a
+server the cache is whatever the server was started with, and the JSON
+records it either way.
+
+Usage:
+    python benchmark.py                                   # in-process (Flask test client)
+    python benchmark.py --url http://localhost:5000       # against a running server
+    python benchmark.py --sizes 1 100 --output before.json
+    python benchmark.py --output after.json --compare before.json
+    python benchmark.py --sizes 1 --endpoints /predict --cache    # with the prediction cache
+    python benchmark.py --sizes 100000 --endpoints /predict/batch /inventory/analysis \
+        --formats json compact arrow                  # response formats: latency and bytes
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+DEFAULT_SIZES = [1, 100, 10000, 100000]
+DEFAULT_ENDPOINTS = ['/predict', '/predict/batch', '/inventory/analysis']
+STORE_IDS = [f"S{i:03d}" for i in range(1, 6)]
+PRODUCT_IDS = [f"P{i:04d}" for i in range(1, 21)]
+# Response formats of the batch endpoints: (query string, extra headers)
+FORMATS = {
+    'json': ('', {}),
+    'compact': ('?compact=1', {}),
+    'arrow': ('', {'Accept': 'application/vnd.apache.arrow.stream'}),
+    'msgpack': ('', {'Accept': 'application/x-msgpack'}),
+}
+
+
+def generate_items(count: int, seed: int = 42, unknown_rate: float = 0.0) -> List[Dict[str, Any]]:
+    """Generate synthetic store/product/inventory items."""
+    rng = np.random.default_rng(seed)
+    stores = rng.choice(STORE_IDS, count)
+    products = rng.choice(PRODUCT_IDS, count)
+    inventory = rng.integers(0, 500, count)
+    if unknown_rate > 0:
+        unknown = rng.random(count) < unknown_rate
+        products = np.where(unknown, 'P9999', products)
+    return [
+        {'Store ID': str(s), 'Product ID': str(p), 'Inventory Level': int(i)}
+        for s, p, i in zip(stores, products, inventory)
+    ]
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Peak resident set size of ``pid`` (default: this process) in MB."""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(peak / divisor, 1)
+
+
+class InProcessClient:
+    """Sends requests through the Flask test client (no network)."""
+
+    def __init__(self, log_level: str = 'WARNING', cache: bool = False):
+        if not cache:
+            # /predict cycles through a few distinct items, which would otherwise be cache hits
+            os.environ['PREDICTION_CACHE_SIZE'] = '0'
+        from app import app as flask_app, predictor
+
+        # Per-prediction INFO logging would otherwise dominate the console
+        logging.getLogger('app').setLevel(log_level)
+        logging.getLogger('inventory_model').setLevel(log_level)
+        if predictor is None:
+            raise RuntimeError("Model failed to load; see the log above")
+        self._app = flask_app
+        self._predictor = predictor
+        self._local = threading.local()
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str] = None) -> Tuple[int, int]:
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.post(path, data=body, content_type='application/json', headers=headers)
+        return response.status_code, len(response.get_data())
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self._predictor.cache.stats()
+
+    @staticmethod
+    def serialize_seconds(route: str) -> float:
+        """Total time the app has spent serializing responses of ``route``."""
+        import metrics
+
+        row = metrics.REGISTRY.snapshot()['histograms'].get(
+            (metrics.STAGE_DURATION, (('route', route), ('stage', 'serialize'))))
+        return row[-2] if row else 0.0
+
+
+class HttpClient:
+    """Sends requests to a running server over one keep-alive connection per thread."""
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self._host = parsed.hostname
+        self._port = parsed.port or 80
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self._host, self._port, timeout=600)
+        return conn
+
+    def post(self, path: str, body: bytes, headers: Dict[str, str] = None) -> Tuple[int, int]:
+        conn = self._connection()
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/json', **(headers or {})})
+            response = conn.getresponse()
+            return response.status, len(response.read())
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """The server's prediction cache statistics, from /health."""
+        conn = self._connection()
+        try:
+            conn.request('GET', '/health')
+            response = conn.getresponse()
+            return json.loads(response.read()).get('prediction_cache')
+        except (OSError, http.client.HTTPException, ValueError):
+            conn.close()
+            self._local.conn = None
+            return None
+
+
+def summarize(latencies: List[float], elapsed: float, items_per_request: int) -> Dict[str, Any]:
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+            'mean': round(float(latencies_ms.mean()), 3),
+            'min': round(float(latencies_ms.min()), 3),
+            'max': round(float(latencies_ms.max()), 3)
+        },
+        'requests_per_sec': round(len(latencies) / elapsed, 2),
+        'items_per_sec': round(len(latencies) * items_per_request / elapsed, 2)
+    }
+
+
+def run_requests(send: Callable[[bytes], Tuple[int, int]], bodies: List[bytes], concurrency: int) -> Dict[str, Any]:
+    """Send every body, ``concurrency`` at a time, and time each request."""
+    latencies: List[float] = []
+    sizes: List[int] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(body: bytes):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status, size = send(body)
+        except Exception:
+            status, size = None, 0
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            sizes.append(size)
+            if status != 200:
+                errors += 1
+
+    started = time.perf_counter()
+    if concurrency <= 1:
+        for body in bodies:
+            timed(body)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, bodies))
+    return {'latencies': latencies, 'sizes': sizes, 'elapsed': time.perf_counter() - started, 'errors': errors}
+
+
+def benchmark_endpoint(client, endpoint: str, size: int, args, response_format: str = 'json') -> Dict[str, Any]:
+    items = generate_items(size, seed=args.seed, unknown_rate=args.unknown_rate)
+
+    if endpoint == '/predict':
+        # One item per request, cycling through the workload's distinct items
+        bodies = [json.dumps(items[i % size]).encode() for i in range(args.single_requests)]
+        items_per_request = 1
+    else:
+        body = json.dumps({'items': items}).encode()
+        bodies = [body] * args.repeat
+        items_per_request = size
+
+    query, headers = FORMATS[response_format]
+    path = endpoint + query
+    # Warm up so the first request's one-off costs don't skew the percentiles
+    client.post(path, bodies[0], headers)
+
+    serialized_before = client.serialize_seconds(endpoint) if isinstance(client, InProcessClient) else None
+    run = run_requests(lambda body: client.post(path, body, headers), bodies, args.concurrency)
+    result = {
+        'endpoint': endpoint,
+        'format': response_format,
+        'items': size,
+        'concurrency': args.concurrency,
+        'errors': run['errors'],
+        **summarize(run['latencies'], run['elapsed'], items_per_request),
+        'response_bytes': int(np.mean(run['sizes'])),
+        # Measured by the app's metrics, so only in-process
+        'serialize_ms': (round((client.serialize_seconds(endpoint) - serialized_before) / len(bodies) * 1000, 3)
+                         if serialized_before is not None else None),
+        'peak_rss_mb': peak_rss_mb(args.server_pid) if args.url else peak_rss_mb()
+    }
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict], baseline_path: str):
+    """Print latency and throughput changes relative to a previous run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['endpoint'], r.get('format', 'json'), r['items']): r for r in baseline.get('results', [])}
+
+    print(f"\nComparison against {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    print(f"{'endpoint':<22}{'format':<9}{'items':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>10}")
+    for result in results:
+        old = previous.get((result['endpoint'], result['format'], result['items']))
+        if old is None:
+            continue
+
+        def change(new_value, old_value):
+            if not old_value:
+                return 'n/a'
+            return f"{(new_value - old_value) / old_value * 100:+.1f}%"
+
+        print(f"{result['endpoint']:<22}{result['format']:<9}{result['items']:>8}"
+              f"{change(result['latency_ms']['p50'], old['latency_ms']['p50']):>10}"
+              f"{change(result['latency_ms']['p95'], old['latency_ms']['p95']):>10}"
+              f"{change(result['latency_ms']['p99'], old['latency_ms']['p99']):>10}"
+              f"{change(result['requests_per_sec'], old['requests_per_sec']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Inventory Management API')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process app')
+    parser.add_argument('--server-pid', type=int, help='PID of the server, to report its peak RSS in --url mode')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Workload sizes in items (default: 1 100 10000 100000)')
+    parser.add_argument('--endpoints', nargs='+', default=DEFAULT_ENDPOINTS, choices=DEFAULT_ENDPOINTS)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Requests per batch workload (default: 5)')
+    parser.add_argument('--single-requests', type=int, default=1000,
+                        help='/predict requests per workload (default: 1000)')
+    parser.add_argument('--formats', nargs='+', default=['json'], choices=list(FORMATS),
+                        help='Response formats of the batch endpoints (default: json)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Concurrent requests (default: 1)')
+    parser.add_argument('--unknown-rate', type=float, default=0.0,
+                        help='Fraction of items with a product ID unseen in training')
+    parser.add_argument('--cache', action='store_true',
+                        help='Keep the prediction cache of the in-process app on (default: off)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--app-log-level', default='WARNING',
+                        help='Log level for the in-process app (default: WARNING)')
+    parser.add_argument('--output', default='benchmark-results.json', help='Where to write the JSON results')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else InProcessClient(args.app_log_level, cache=args.cache)
+    cache = client.cache_stats()
+    if args.url and cache and cache['enabled'] and not args.cache and '/predict' in args.endpoints:
+        print("Warning: the server's prediction cache is on, so most /predict requests will be cache hits; "
+              "start it with PREDICTION_CACHE_SIZE=0 or pass --cache to acknowledge")
+
+    results = []
+    for size in sorted(args.sizes):
+        for endpoint in args.endpoints:
+            # /predict has a single response format
+            for response_format in (['json'] if endpoint == '/predict' else args.formats):
+                result = benchmark_endpoint(client, endpoint, size, args, response_format)
+                results.append(result)
+                latency = result['latency_ms']
+                serialize = f"  serialize={result['serialize_ms']:.2f}ms" if result['serialize_ms'] is not None else ''
+                print(f"{endpoint:<22}{response_format:<9}{size:>8} items  p50={latency['p50']:.2f}ms  "
+                      f"p95={latency['p95']:.2f}ms  p99={latency['p99']:.2f}ms  "
+                      f"{result['requests_per_sec']:.1f} req/s  {result['items_per_sec']:.0f} items/s  "
+                      f"{result['response_bytes']} bytes{serialize}  peak_rss={result['peak_rss_mb']}MB  "
+                      f"errors={result['errors']}")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'mode': 'http' if args.url else 'in-process',
+            'url': args.url,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            # Cache settings and hit counts over the run (None if the server didn't report them)
+            'prediction_cache': client.cache_stats(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
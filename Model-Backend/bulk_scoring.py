@@ -0,0 +1,172 @@
+"""
+Chunked bulk scoring for CSV and Parquet inventory snapshots.
+
+Input files are read and scored a fixed number of rows at a time, and the
+results are written out chunk by chunk as CSV or NDJSON, so memory stays
+bounded regardless of the file size.
+
+Usage:
+    python bulk_scoring.py snapshot.csv -o forecasts.csv
+    python bulk_scoring.py snapshot.parquet --output-format ndjson > forecasts.ndjson
+"""
+
+import argparse
+import logging
+import sys
+from typing import IO, Iterator, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+INPUT_COLUMNS = ['Store ID', 'Product ID', 'Inventory Level']
+OUTPUT_COLUMNS = ['row'] + INPUT_COLUMNS + ['demand_forecast', 'stock_ratio', 'error']
+INPUT_FORMATS = ('csv', 'parquet')
+OUTPUT_FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def detect_input_format(filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """Guess the input format from a file name or content type (default: CSV)."""
+    name = (filename or '').lower()
+    if name.endswith(('.parquet', '.pq')) or 'parquet' in (content_type or ''):
+        return 'parquet'
+    return 'csv'
+
+
+def iter_input_chunks(source: Union[str, IO], input_format: str = 'csv',
+                      chunk_size: int = DEFAULT_CHUNK_SIZE, skip_rows: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Yield the input columns of ``source`` as DataFrames of at most
+    ``chunk_size`` rows, indexed by row number in the file, starting after
+    the first ``skip_rows`` rows.
+    """
+    if input_format == 'csv':
+        reader = pd.read_csv(
+            source,
+            chunksize=chunk_size,
+            usecols=lambda col: col in INPUT_COLUMNS,
+            dtype={'Store ID': str, 'Product ID': str},
+            skiprows=range(1, skip_rows + 1) if skip_rows else None
+        )
+        for chunk in reader:
+            if skip_rows:
+                chunk.index += skip_rows
+            yield chunk
+    elif input_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet input requires pyarrow: pip install pyarrow")
+
+        parquet_file = pq.ParquetFile(source)
+        columns = [col for col in INPUT_COLUMNS if col in parquet_file.schema_arrow.names]
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            if offset + batch.num_rows <= skip_rows:
+                offset += batch.num_rows
+                continue
+            if offset < skip_rows:
+                batch = batch.slice(skip_rows - offset)
+                offset = skip_rows
+            chunk = batch.to_pandas()
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+    else:
+        raise ValueError(f"Unsupported input format: {input_format}")
+
+
+def stock_ratios(predicted: np.ndarray, inventory: np.ndarray) -> np.ndarray:
+    """Predicted demand over inventory, 0 where there is no inventory."""
+    return np.divide(predicted, inventory, out=np.zeros_like(predicted), where=inventory > 0)
+
+
+def score_chunk(predictor, chunk: pd.DataFrame) -> pd.DataFrame:
+    """Score one chunk, keeping every input row (failed rows carry an error)."""
+    scored, reasons = predictor.predict_demand_frame(chunk)
+
+    out = chunk.reindex(columns=INPUT_COLUMNS)
+    out.insert(0, 'row', out.index)
+    out['demand_forecast'] = np.nan
+    out['stock_ratio'] = np.nan
+    out['error'] = None
+
+    if len(scored) > 0:
+        predicted = scored['predicted_demand'].to_numpy()
+        ratios = stock_ratios(predicted, scored['Inventory Level'].to_numpy())
+        out.loc[scored.index, 'demand_forecast'] = np.round(predicted, 2)
+        out.loc[scored.index, 'stock_ratio'] = np.round(ratios, 2)
+    if reasons:
+        out.loc[list(reasons), 'error'] = pd.Series(reasons)
+    return out[OUTPUT_COLUMNS]
+
+
+def format_chunk(out: pd.DataFrame, output_format: str, header: bool) -> str:
+    if output_format == 'csv':
+        return out.to_csv(index=False, header=header)
+    if output_format == 'ndjson':
+        if out.empty:
+            return ''
+        text = out.to_json(orient='records', lines=True)
+        return text if text.endswith('\n') else text + '\n'
+    raise ValueError(f"Unsupported output format: {output_format}")
+
+
+def score_stream(predictor, chunks: Iterator[pd.DataFrame], output_format: str = 'csv') -> Iterator[str]:
+    """Score each chunk as it arrives and yield it in the output format."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    rows = 0
+    failed = 0
+    header = output_format == 'csv'
+    for chunk in chunks:
+        out = score_chunk(predictor, chunk)
+        rows += len(out)
+        failed += int(out['error'].notna().sum())
+        yield format_chunk(out, output_format, header=header)
+        header = False
+
+    if header:
+        # No chunks at all; still emit a header so the CSV is well-formed
+        yield ','.join(OUTPUT_COLUMNS) + '\n'
+    logger.info(f"Bulk scoring finished: {rows} rows, {failed} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a CSV or Parquet inventory snapshot in chunks')
+    parser.add_argument('input', help='Input CSV or Parquet file')
+    parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, help='Default: guessed from the file name')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS,
+                        help='Default: guessed from the output file name, else csv')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Rows scored per model call (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--model', help='Model artifact directory or .pkl (default: demand_model, else demand_model.pkl)')
+    args = parser.parse_args()
+
+    input_format = args.input_format or detect_input_format(args.input)
+    output_format = args.output_format or (
+        'ndjson' if args.output and args.output.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    )
+
+    from inventory_model import InventoryPredictor
+
+    predictor = InventoryPredictor(args.model)
+    chunks = iter_input_chunks(args.input, input_format, args.chunk_size)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        for text in score_stream(predictor, chunks, output_format):
+            out.write(text)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
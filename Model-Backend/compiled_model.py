@@ -0,0 +1,328 @@
+"""
+Compiled fast path for the demand forecasting pipeline.
+
+``Pipeline.predict`` goes through pandas, ``StandardScaler`` and the
+LGBMRegressor sklearn wrapper, whose validation dominates the cost of a
+single-row prediction. ``CompiledDemandModel`` pulls the fitted encoder
+lookups, the scaler's mean/scale and the LightGBM booster out of the pipeline
+once and predicts straight from a float64 NumPy array, either through the
+native booster or through ``TreeEnsemble``, a pure-NumPy evaluator built from
+the booster's tree dump.
+
+Usage (parity check and latency benchmark):
+    python compiled_model.py
+    python compiled_model.py --model models/v2/demand_model.pkl --sizes 1 100 10000
+"""
+
+import argparse
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+EVALUATORS = ('booster', 'numpy')
+FEATURE_COLUMNS = ['Store ID', 'Product ID', 'Inventory Level']
+
+# LightGBM treats |x| <= kZeroThreshold as zero for missing_type=Zero splits
+ZERO_THRESHOLD = 1e-35
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+MISSING_TYPES = {'None': MISSING_NONE, 'Zero': MISSING_ZERO, 'NaN': MISSING_NAN}
+
+
+class TreeEnsemble:
+    """
+    A LightGBM regression ensemble flattened into NumPy node arrays.
+
+    All trees share one node table. Leaves point back at themselves, so every
+    (row, tree) pair can be advanced together for ``depth`` steps and then
+    read off as a leaf value.
+    """
+
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'default_left', 'missing_type', 'value', 'roots')
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 default_left: np.ndarray, missing_type: np.ndarray, value: np.ndarray,
+                 roots: np.ndarray, depth: int):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.missing_type = missing_type
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+        self.has_missing_splits = bool((missing_type != MISSING_NONE).any())
+
+    @classmethod
+    def from_booster(cls, booster, num_iteration: Optional[int] = None) -> 'TreeEnsemble':
+        """Flatten a regression booster; raises NotImplementedError for anything else."""
+        dump = booster.dump_model(num_iteration=num_iteration)
+        if dump.get('objective', '').split()[0] != 'regression' or dump.get('num_tree_per_iteration') != 1:
+            raise NotImplementedError(f"Unsupported objective for the NumPy evaluator: {dump.get('objective')}")
+        if dump.get('average_output'):
+            raise NotImplementedError("Averaged (random forest) output is not supported by the NumPy evaluator")
+
+        nodes: Dict[str, List] = {key: [] for key in
+                                  ('feature', 'threshold', 'left', 'right', 'default_left', 'missing_type', 'value')}
+        roots = []
+        depth = 0
+
+        def add(node: Dict[str, Any], level: int) -> int:
+            nonlocal depth
+            index = len(nodes['feature'])
+            for values in nodes.values():
+                values.append(None)
+
+            if 'leaf_value' in node:
+                depth = max(depth, level)
+                nodes['feature'][index] = 0
+                nodes['threshold'][index] = 0.0
+                nodes['left'][index] = nodes['right'][index] = index
+                nodes['default_left'][index] = True
+                nodes['missing_type'][index] = MISSING_NONE
+                nodes['value'][index] = node['leaf_value']
+                return index
+
+            if node['decision_type'] != '<=':
+                raise NotImplementedError("Categorical splits are not supported by the NumPy evaluator")
+            nodes['feature'][index] = node['split_feature']
+            nodes['threshold'][index] = node['threshold']
+            nodes['default_left'][index] = node['default_left']
+            nodes['missing_type'][index] = MISSING_TYPES[node['missing_type']]
+            nodes['value'][index] = 0.0
+            nodes['left'][index] = add(node['left_child'], level + 1)
+            nodes['right'][index] = add(node['right_child'], level + 1)
+            return index
+
+        for tree in dump['tree_info']:
+            roots.append(add(tree['tree_structure'], 0))
+
+        return cls(
+            feature=np.asarray(nodes['feature'], dtype=np.intp),
+            threshold=np.asarray(nodes['threshold'], dtype=np.float64),
+            left=np.asarray(nodes['left'], dtype=np.intp),
+            right=np.asarray(nodes['right'], dtype=np.intp),
+            default_left=np.asarray(nodes['default_left'], dtype=bool),
+            missing_type=np.asarray(nodes['missing_type'], dtype=np.int8),
+            value=np.asarray(nodes['value'], dtype=np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            depth=depth
+        )
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Sum of the leaf values reached by each row of ``X`` in every tree."""
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+
+        for _ in range(self.depth):
+            x = X[rows, self.feature[node]]
+            go_left = x <= self.threshold[node]
+            if self.has_missing_splits or np.isnan(x).any():
+                go_left = self._route_missing(x, node, go_left)
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        return self.value[node].sum(axis=1)
+
+    def _route_missing(self, x: np.ndarray, node: np.ndarray, go_left: np.ndarray) -> np.ndarray:
+        # Mirrors LightGBM's NumericalDecision: NaN counts as 0.0 unless the
+        # split learned a NaN direction, and missing values take the default side
+        missing_type = self.missing_type[node]
+        nan = np.isnan(x)
+        x = np.where(nan & (missing_type != MISSING_NAN), 0.0, x)
+        go_left = np.where(nan & (missing_type != MISSING_NAN), x <= self.threshold[node], go_left)
+        missing = ((missing_type == MISSING_ZERO) & (np.abs(x) <= ZERO_THRESHOLD)) | \
+                  ((missing_type == MISSING_NAN) & nan)
+        return np.where(missing, self.default_left[node], go_left)
+
+
+class CompiledDemandModel:
+    """
+    Drop-in replacement for the demand pipeline's ``predict``.
+
+    ``evaluator`` picks how the trees are evaluated: the native LightGBM
+    booster (fastest), or the pure-NumPy ``TreeEnsemble``, which needs nothing
+    from LightGBM beyond the tree dump. A model loaded for the NumPy evaluator
+    from a saved artifact can come without a booster at all.
+    """
+
+    def __init__(self, store_lookup: Dict[str, int], product_lookup: Dict[str, int],
+                 mean: np.ndarray, scale: np.ndarray, booster=None, num_iteration: Optional[int] = None,
+                 evaluator: str = 'booster', trees: Optional[TreeEnsemble] = None):
+        if evaluator not in EVALUATORS:
+            raise ValueError(f"Unknown evaluator: {evaluator}")
+        if booster is None and (evaluator != 'numpy' or trees is None):
+            raise ValueError("A booster is required unless prebuilt trees are used with the numpy evaluator")
+        self.store_lookup = store_lookup
+        self.product_lookup = product_lookup
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.booster = booster
+        self.num_iteration = num_iteration
+        self.evaluator = evaluator
+        if evaluator == 'numpy' and trees is None:
+            trees = TreeEnsemble.from_booster(booster, num_iteration)
+        self.trees = trees if evaluator == 'numpy' else None
+        self._local = threading.local()
+
+    def with_evaluator(self, evaluator: str) -> 'CompiledDemandModel':
+        """The same model evaluated another way."""
+        if evaluator == self.evaluator:
+            return self
+        return CompiledDemandModel(
+            self.store_lookup, self.product_lookup, self.mean, self.scale, booster=self.booster,
+            num_iteration=self.num_iteration, evaluator=evaluator, trees=self.trees
+        )
+
+    @classmethod
+    def from_pipeline(cls, pipeline, evaluator: str = 'booster') -> 'CompiledDemandModel':
+        """
+        Extract the fitted pieces of a SimplePreprocessor + LGBMRegressor
+        pipeline. Raises TypeError for pipelines of any other shape.
+        """
+        steps = getattr(pipeline, 'named_steps', {})
+        preprocessor = steps.get('preprocessor')
+        regressor = steps.get('regressor')
+        if preprocessor is None or not hasattr(preprocessor, '_store_lookup') or \
+                not hasattr(regressor, 'booster_'):
+            raise TypeError("Expected a SimplePreprocessor + LGBMRegressor pipeline")
+        if not getattr(preprocessor, 'fitted', False):
+            raise ValueError("Preprocessor not fitted yet")
+
+        booster = regressor.booster_
+        best_iteration = getattr(booster, 'best_iteration', 0)
+        return cls(
+            store_lookup=dict(preprocessor._store_lookup),
+            product_lookup=dict(preprocessor._product_lookup),
+            mean=preprocessor.scaler.mean_,
+            scale=preprocessor.scaler.scale_,
+            booster=booster,
+            num_iteration=best_iteration if best_iteration > 0 else None,
+            evaluator=evaluator
+        )
+
+    def encode(self, stores, products, inventory, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Encode and scale the three input columns into a float64 feature matrix."""
+        if out is None:
+            out = np.empty((len(inventory), 3), dtype=np.float64)
+        store_lookup = self.store_lookup
+        product_lookup = self.product_lookup
+        # Unknown categories map to the first class seen during training
+        started = metrics.clock()
+        out[:, 0] = [store_lookup.get(str(s), 0) for s in stores]
+        out[:, 1] = [product_lookup.get(str(p), 0) for p in products]
+        out[:, 2] = inventory
+        started = metrics.lap('preprocess', started)
+        out -= self.mean
+        out /= self.scale
+        metrics.lap('scale', started)
+        return out
+
+    def predict_features(self, X: np.ndarray) -> np.ndarray:
+        """Predict from an already encoded and scaled feature matrix."""
+        started = metrics.clock()
+        if self.trees is not None:
+            predictions = self.trees.predict(X)
+        else:
+            predictions = self.booster.predict(X, num_iteration=self.num_iteration)
+        metrics.lap('predict', started)
+        return predictions
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        """Same contract as ``Pipeline.predict`` for the three input columns."""
+        X = self.encode(
+            df['Store ID'].to_numpy(), df['Product ID'].to_numpy(),
+            df['Inventory Level'].to_numpy(dtype=np.float64)
+        )
+        return self.predict_features(X)
+
+    def predict_one(self, store_id: str, product_id: str, inventory_level: float) -> float:
+        """Predict a single row without building a DataFrame."""
+        # One preallocated row per thread, so concurrent requests don't share it
+        X = getattr(self._local, 'row', None)
+        if X is None:
+            X = self._local.row = np.empty((1, 3), dtype=np.float64)
+        started = metrics.clock()
+        X[0, 0] = self.store_lookup.get(store_id, 0)
+        X[0, 1] = self.product_lookup.get(product_id, 0)
+        X[0, 2] = inventory_level
+        started = metrics.lap('preprocess', started)
+        X -= self.mean
+        X /= self.scale
+        metrics.lap('scale', started)
+        return float(self.predict_features(X)[0])
+
+    def probe_frame(self, inventory_levels: int = 8) -> pd.DataFrame:
+        """Every known store x product (plus unknowns) over a spread of inventory levels."""
+        stores = list(self.store_lookup) + ['__unknown__']
+        products = list(self.product_lookup) + ['__unknown__']
+        mean, scale = self.mean[2], self.scale[2]
+        levels = np.concatenate([[0.0], np.linspace(mean - 2 * scale, mean + 2 * scale, inventory_levels)])
+        grid = pd.MultiIndex.from_product([stores, products, np.maximum(levels, 0)], names=FEATURE_COLUMNS)
+        return grid.to_frame(index=False)
+
+    def check_parity(self, pipeline, df: Optional[pd.DataFrame] = None, rtol: float = 1e-6,
+                     atol: float = 1e-6) -> Tuple[bool, float]:
+        """Compare against ``pipeline.predict``; returns (ok, max abs difference)."""
+        df = self.probe_frame() if df is None else df
+        expected = pipeline.predict(df[FEATURE_COLUMNS])
+        actual = self.predict(df)
+        # Also exercise the single-row path, which the API uses for /predict
+        single = self.predict_one(str(df.iloc[0, 0]), str(df.iloc[0, 1]), float(df.iloc[0, 2]))
+        actual_single = np.array([single])
+        ok = bool(np.allclose(actual, expected, rtol=rtol, atol=atol) and
+                  np.allclose(actual_single, expected[:1], rtol=rtol, atol=atol))
+        return ok, float(np.max(np.abs(actual - expected))) if len(df) else 0.0
+
+
+def _time_per_call(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the compiled fast path against the pipeline and time it')
+    parser.add_argument('--model', default='demand_model.pkl', help='Model artifact (default: demand_model.pkl)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000],
+                        help='Rows per predict call (default: 1 100 10000)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    import joblib
+    # Registers __main__.SimplePreprocessor, which demand_model.pkl refers to
+    import inventory_model  # noqa: F401
+    from benchmark import generate_items
+
+    pipeline = joblib.load(args.model)
+    compiled = {name: CompiledDemandModel.from_pipeline(pipeline, evaluator=name) for name in ('booster', 'numpy')}
+
+    for name, model in compiled.items():
+        ok, max_diff = model.check_parity(pipeline)
+        print(f"parity[{name}]: {'ok' if ok else 'MISMATCH'} (max abs diff {max_diff:.3g})")
+
+    print(f"\n{'rows':>8}{'pipeline':>14}{'booster':>14}{'numpy':>14}   (microseconds per row)")
+    for size in args.sizes:
+        df = pd.DataFrame(generate_items(size, seed=args.seed))
+        repeat = max(3, min(2000, 20000 // size))
+        timings = [_time_per_call(lambda: pipeline.predict(df), repeat)]
+        for model in compiled.values():
+            if size == 1:
+                row = df.iloc[0]
+                timings.append(_time_per_call(
+                    lambda: model.predict_one(row['Store ID'], row['Product ID'], float(row['Inventory Level'])),
+                    repeat
+                ))
+            else:
+                timings.append(_time_per_call(lambda: model.predict(df), repeat))
+        print(f"{size:>8}" + ''.join(f"{t / size * 1e6:>14.2f}" for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""
+Reading on/off settings from the environment.
+
+Every flag (``FAST_STARTUP``, ``MICRO_BATCHING``, ``PROFILING``,
+``DRIFT_MONITOR``, ...) accepts the same values, whichever module reads it:
+``1``, ``true``, ``yes`` and ``on`` turn it on; ``0``, ``false``, ``no``,
+``off`` and the empty string turn it off (case-insensitive).
+"""
+
+import os
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off', '')
+
+
+def parse_flag(value: str, name: str = 'flag') -> bool:
+    """``value`` as a boolean; raises ValueError for anything unrecognised."""
+    normalized = value.strip().lower()
+    if normalized in TRUE_VALUES:
+        return True
+    if normalized in FALSE_VALUES:
+        return False
+    raise ValueError(f"{name} must be 1, true, yes or on, or 0, false, no or off; got {value!r}")
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    """The boolean environment variable ``name``, or ``default`` when unset."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return parse_flag(value, name)
@@ -0,0 +1,551 @@
+"""
+Streaming data-drift monitor for prediction traffic.
+
+Every row the server scores (``/predict``, ``/predict/batch``, analyses,
+bulk scoring) is summarized in fixed-size sketches, so memory stays
+constant however much traffic arrives:
+
+- ``Inventory Level`` and the predicted demand: a log-bucketed quantile
+  sketch (1% relative accuracy), DDSketch-style.
+- ``Store ID`` and ``Product ID``: a count-min sketch of the label counts,
+  Space-Saving heavy hitters, and the rate (and heavy hitters) of labels the
+  model wasn't trained on. ``SimplePreprocessor`` silently encodes those as
+  class 0, so they get a prediction without any error.
+
+Request threads only append to a buffer. A background thread folds the
+buffer into the sketches once ``flush_rows`` rows are waiting, with one
+vectorized update per batch.
+
+``GET /admin/drift`` compares the sketches against the model's training
+baseline:
+- Quantile bins give the population stability index (PSI) and the
+  Kolmogorov-Smirnov distance of the numeric features.
+- Label frequencies give the PSI of the IDs.
+
+The baseline is ``drift_baseline.json`` next to the model. ``train.py``
+writes it into new artifacts, and for an existing model it can be built
+from the training data::
+
+    python drift.py baseline retail_store_inventory.csv --model demand_model
+
+Without it, only the model's own statistics are compared: its known labels
+and the training mean and standard deviation of ``Inventory Level``, from
+the scaler.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compiled_model import CompiledDemandModel
+from config import env_flag
+
+logger = logging.getLogger(__name__)
+
+BASELINE_FILE = 'drift_baseline.json'
+FORMAT_VERSION = 1
+CATEGORY_COLUMNS = ('Store ID', 'Product ID')
+NUMERIC_COLUMNS = ('Inventory Level', 'predicted_demand')
+# Quantiles stored in a baseline; they are also the bins the PSI is computed over
+BASELINE_QUANTILES = (0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+REPORT_QUANTILES = (0.01, 0.1, 0.5, 0.9, 0.99)
+
+DEFAULT_FLUSH_ROWS = 1024
+# Buffered rows beyond this are dropped (and counted) if the flusher falls behind
+MAX_PENDING_ROWS = 1_000_000
+MIN_ROWS = 100
+PSI_WARNING, PSI_DRIFT = 0.1, 0.25
+UNKNOWN_WARNING, UNKNOWN_DRIFT = 0.01, 0.05
+# |live mean - training mean| in training standard deviations, without a baseline file
+MEAN_SHIFT_WARNING, MEAN_SHIFT_DRIFT = 0.25, 0.5
+STATUSES = ('no_baseline', 'insufficient_data', 'ok', 'warning', 'drift')
+# Bins with no mass in one of the distributions count as this fraction in the PSI
+_PSI_EPSILON = 1e-4
+_HASH_SEEDS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                        0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53], dtype=np.uint64)
+
+
+class QuantileSketch:
+    """
+    Counts of values in logarithmic buckets, ``gamma`` apart, between
+    ``min_value`` and ``max_value``. Any quantile is within
+    ``relative_accuracy`` of the true value. Values up to ``min_value``
+    (zero stock, zero demand) share one bucket.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 0.01, max_value: float = 1e7):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self._offset = math.ceil(math.log(min_value) / self._log_gamma)
+        size = math.ceil(math.log(max_value) / self._log_gamma) - self._offset + 1
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, values: np.ndarray) -> np.ndarray:
+        keys = np.ceil(np.log(values) / self._log_gamma).astype(np.int64) - self._offset
+        return np.clip(keys, 0, len(self.counts) - 1)
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        small = values <= self.min_value
+        self.zeros += int(small.sum())
+        self.counts += np.bincount(self._index(values[~small]), minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return max(self.min, 0.0)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank - self.zeros, side='right'))
+        value = 2 * self.gamma ** (index + self._offset) / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def cdf(self, points: Sequence[float]) -> np.ndarray:
+        """Fraction of the values at or below each of ``points``."""
+        points = np.asarray(points, dtype=np.float64)
+        if not self.count:
+            return np.full(len(points), np.nan)
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        above = points > self.min_value
+        below = np.zeros(len(points), dtype=np.int64)
+        below[above] = cumulative[self._index(points[above]) + 1]
+        below += np.where(points >= 0, self.zeros, 0)
+        return below / self.count
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'mean': _round(self.mean),
+            'min': _round(self.min) if self.count else None,
+            'max': _round(self.max) if self.count else None,
+            'quantiles': {f"p{round(q * 100):02d}": _round(self.quantile(q)) for q in REPORT_QUANTILES},
+        }
+
+
+class CountMinSketch:
+    """Approximate counts of labels, given as 64-bit hashes; never underestimates."""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        if width & (width - 1) or not 1 <= depth <= len(_HASH_SEEDS):
+            raise ValueError(f"width must be a power of two and depth at most {len(_HASH_SEEDS)}")
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._shift = np.uint64(64 - width.bit_length() + 1)
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        # Multiply-shift hashing: one odd multiplier per row, top bits as the column
+        return (hashes[None, :] * _HASH_SEEDS[:len(self.table), None]) >> self._shift
+
+    def add(self, hashes: np.ndarray, counts: np.ndarray):
+        for row, columns in zip(self.table, self._columns(hashes)):
+            np.add.at(row, columns.astype(np.intp), counts)
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        columns = self._columns(hashes).astype(np.intp)
+        return self.table[np.arange(len(self.table))[:, None], columns].min(axis=0)
+
+
+class HeavyHitters:
+    """
+    Space-Saving: the ``capacity`` most frequent labels. A label's count is
+    overestimated by at most its ``error``.
+    """
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = capacity
+        self.counters: Dict[str, List[int]] = {}
+
+    def add(self, labels: Sequence[str], counts: Sequence[int]):
+        counters = self.counters
+        for label, count in zip(labels, counts):
+            count = int(count)
+            entry = counters.get(label)
+            if entry is not None:
+                entry[0] += count
+            elif len(counters) < self.capacity:
+                counters[label] = [count, 0]
+            else:
+                # Replace the smallest counter; the newcomer inherits its count as error
+                victim = min(counters, key=lambda key: counters[key][0])
+                floor = counters.pop(victim)[0]
+                counters[label] = [floor + count, floor]
+
+    def top(self, n: int = 10) -> List[Dict[str, Any]]:
+        ranked = sorted(self.counters.items(), key=lambda entry: -entry[1][0])[:n]
+        return [{'label': label, 'count': count, 'error': error} for label, (count, error) in ranked]
+
+
+class CategoryStats:
+    """Sketches of one ID column."""
+
+    def __init__(self):
+        self.sketch = CountMinSketch()
+        self.heavy_hitters = HeavyHitters()
+        # Labels the model maps to class 0 without complaint
+        self.unknown = HeavyHitters()
+        self.count = 0
+        self.unknown_count = 0
+
+    def add(self, labels: pd.Series, lookup: Dict[str, int]):
+        counts = labels.value_counts(sort=True)
+        uniques = [str(label) for label in counts.index]
+        values = counts.to_numpy(dtype=np.int64)
+        self.sketch.add(_hash_labels(uniques), values)
+        self.heavy_hitters.add(uniques, values)
+        unknown = np.array([label not in lookup for label in uniques], dtype=bool)
+        if unknown.any():
+            self.unknown.add([label for label, flag in zip(uniques, unknown) if flag], values[unknown])
+        self.count += int(values.sum())
+        self.unknown_count += int(values[unknown].sum())
+
+    @property
+    def unknown_rate(self) -> Optional[float]:
+        return self.unknown_count / self.count if self.count else None
+
+
+def _hash_labels(labels: Sequence[str]) -> np.ndarray:
+    return pd.util.hash_array(np.asarray(labels, dtype=object))
+
+
+def _round(value: Optional[float], digits: int = 4) -> Optional[float]:
+    return None if value is None or not math.isfinite(value) else round(float(value), digits)
+
+
+def _psi(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Population stability index of two bin distributions."""
+    expected = np.clip(expected, _PSI_EPSILON, None)
+    actual = np.clip(actual, _PSI_EPSILON, None)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def _status(value: Optional[float], warning: float, drift: float) -> str:
+    if value is None:
+        return 'insufficient_data'
+    return 'drift' if value >= drift else 'warning' if value >= warning else 'ok'
+
+
+def _worst(statuses: Sequence[str]) -> str:
+    return max(statuses, key=STATUSES.index, default='insufficient_data')
+
+
+# Baselines
+
+def summarize(values: np.ndarray) -> Dict[str, Any]:
+    """Exact count, mean, standard deviation and ``BASELINE_QUANTILES`` of a training column."""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'quantiles': {'levels': list(BASELINE_QUANTILES),
+                      'values': np.quantile(values, BASELINE_QUANTILES).tolist()},
+    }
+
+
+def build_baseline(df: pd.DataFrame, predictions: np.ndarray, source: str = None) -> Dict[str, Any]:
+    """The drift baseline of training rows ``df`` and the model's (non-negative) predictions for them."""
+    return {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'source': source,
+        'rows': len(df),
+        'numeric': {
+            'Inventory Level': summarize(df['Inventory Level'].to_numpy(dtype=np.float64)),
+            'predicted_demand': summarize(predictions),
+        },
+        'categories': {
+            column: {str(label): float(share)
+                     for label, share in df[column].astype(str).value_counts(normalize=True).items()}
+            for column in CATEGORY_COLUMNS
+        },
+    }
+
+
+def baseline_path(model_path: str) -> str:
+    """Where the baseline of a model lives: inside an artifact directory, else beside the pickle."""
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, BASELINE_FILE)
+    return f"{os.path.splitext(model_path)[0]}.{BASELINE_FILE}"
+
+
+def write_baseline(baseline: Dict[str, Any], path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"Drift baseline format {baseline.get('format_version')} is newer than "
+                         f"supported ({FORMAT_VERSION})")
+    return baseline
+
+
+def model_baseline(predictor) -> Dict[str, Any]:
+    """What the model itself records about its training data: the scaler's moments of Inventory Level."""
+    runtime = predictor.runtime
+    if isinstance(runtime, CompiledDemandModel):
+        mean, scale = runtime.mean, runtime.scale
+    else:
+        scaler = runtime.named_steps['preprocessor'].scaler
+        mean, scale = scaler.mean_, scaler.scale_
+    return {
+        'format_version': FORMAT_VERSION,
+        'source': 'model',
+        'rows': None,
+        'numeric': {'Inventory Level': {'mean': float(mean[2]), 'std': float(scale[2])}},
+        'categories': {},
+    }
+
+
+# Comparisons
+
+def compare_numeric(sketch: QuantileSketch, baseline: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {'live': sketch.summary(), 'status': 'no_baseline'}
+    if baseline is None:
+        return result
+    if sketch.count < MIN_ROWS:
+        result['status'] = 'insufficient_data'
+        return result
+    quantiles = baseline.get('quantiles')
+    if quantiles:
+        # Bins between the baseline quantiles; repeated values (e.g. many zeros) merge into one edge
+        edges: Dict[float, float] = {}
+        for level, value in zip(quantiles['levels'], quantiles['values']):
+            edges[value] = max(level, edges.get(value, 0.0))
+        values = np.array(list(edges))
+        levels = np.array(list(edges.values()))
+        live = sketch.cdf(values)
+        psi = _psi(np.diff(np.concatenate([[0], levels, [1]])), np.diff(np.concatenate([[0], live, [1]])))
+        result.update(psi=_round(psi), ks=_round(float(np.max(np.abs(live - levels)))),
+                      status=_status(psi, PSI_WARNING, PSI_DRIFT))
+    elif baseline.get('std'):
+        shift = (sketch.mean - baseline['mean']) / baseline['std']
+        result.update(mean_shift=_round(shift), status=_status(abs(shift), MEAN_SHIFT_WARNING, MEAN_SHIFT_DRIFT))
+    result['baseline'] = {key: baseline[key] for key in ('mean', 'std', 'quantiles') if key in baseline}
+    return result
+
+
+def compare_categories(stats: CategoryStats, frequencies: Optional[Dict[str, float]]) -> Dict[str, Any]:
+    result: Dict[str, Any] = {
+        'count': stats.count,
+        'unknown_rate': _round(stats.unknown_rate, 6),
+        'unknown_count': stats.unknown_count,
+        'top_unknown': stats.unknown.top(),
+        'top': stats.heavy_hitters.top(),
+        'status': 'insufficient_data',
+    }
+    if stats.count < MIN_ROWS:
+        return result
+    statuses = [_status(stats.unknown_rate, UNKNOWN_WARNING, UNKNOWN_DRIFT)]
+    if frequencies:
+        # Baseline labels, plus one bin for everything else
+        estimates = stats.sketch.estimate(_hash_labels(list(frequencies))).astype(np.float64)
+        other = max(stats.count - estimates.sum(), 0)
+        live = np.append(estimates, other) / (estimates.sum() + other)
+        expected = np.array(list(frequencies.values()))
+        expected = np.append(expected, max(1 - expected.sum(), 0))
+        psi = _psi(expected, live)
+        result['psi'] = _round(psi)
+        statuses.append(_status(psi, PSI_WARNING, PSI_DRIFT))
+    result['status'] = _worst(statuses)
+    return result
+
+
+class DriftMonitor:
+    """Sketches of the rows a predictor scores, compared against its training baseline on request."""
+
+    def __init__(self, predictor, baseline: str = None, flush_rows: int = DEFAULT_FLUSH_ROWS):
+        self.predictor = predictor
+        # Baseline file; None looks next to the live model
+        self.baseline = baseline
+        self.flush_rows = flush_rows
+        # Guards the buffers; held only for an append or a swap
+        self._lock = threading.Lock()
+        self._rows: List[Tuple[str, str, float, float]] = []
+        self._frames: List[Tuple[pd.DataFrame, np.ndarray]] = []
+        self._pending = 0
+        self.dropped = 0
+        # Guards the sketches
+        self._sketch_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._baseline_cache: Tuple[Any, Optional[Dict[str, Any]]] = (None, None)
+        self.reset()
+
+    @classmethod
+    def from_env(cls, predictor) -> Optional['DriftMonitor']:
+        """A monitor unless ``$DRIFT_MONITOR`` is off; ``$DRIFT_BASELINE`` overrides the baseline file."""
+        if predictor is None or not env_flag('DRIFT_MONITOR', default=True):
+            return None
+        return cls(predictor, baseline=os.environ.get('DRIFT_BASELINE') or None)
+
+    def reset(self, model_version: str = None):
+        """Start a new window of sketches."""
+        with self._sketch_lock:
+            self.numeric = {column: QuantileSketch() for column in NUMERIC_COLUMNS}
+            self.categories = {column: CategoryStats() for column in CATEGORY_COLUMNS}
+            self.since = datetime.now()
+            self.model_version = model_version or self.predictor.model_version
+
+    # Request path: buffer only
+
+    def observe(self, key: Tuple[str, str, float], prediction: float):
+        """One scored row: the coerced (Store ID, Product ID, Inventory Level) and its prediction."""
+        with self._lock:
+            if self._pending >= MAX_PENDING_ROWS:
+                self.dropped += 1
+                return
+            self._rows.append((key[0], key[1], key[2], prediction))
+            self._pending += 1
+            pending = self._pending
+        if pending >= self.flush_rows:
+            self._schedule_flush()
+
+    def observe_frame(self, valid: pd.DataFrame, predictions: np.ndarray):
+        """Coerced input rows scored together, and their predictions."""
+        with self._lock:
+            if self._pending >= MAX_PENDING_ROWS:
+                self.dropped += len(valid)
+                return
+            self._frames.append((valid, predictions))
+            self._pending += len(valid)
+            pending = self._pending
+        if pending >= self.flush_rows:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Started lazily, and again after a fork (threads don't survive one)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='drift-monitor', daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Drift monitor flush failed: {str(e)}")
+
+    # Sketch updates
+
+    def flush(self):
+        """Fold the buffered rows into the sketches."""
+        with self._lock:
+            rows, frames = self._rows, self._frames
+            self._rows, self._frames, self._pending = [], [], 0
+        if rows:
+            stores, products, inventory, predictions = zip(*rows)
+            frames.append((pd.DataFrame({'Store ID': stores, 'Product ID': products, 'Inventory Level': inventory}),
+                           np.array(predictions, dtype=np.float64)))
+        if not frames or self.predictor.runtime is None:
+            return
+
+        lookups = self.predictor.category_lookups()
+        if self.predictor.model_version != self.model_version:
+            # Rows scored by a new model belong to a new window (and baseline)
+            self.reset(self.predictor.model_version)
+        with self._sketch_lock:
+            for df, predictions in frames:
+                self.numeric['Inventory Level'].add(df['Inventory Level'].to_numpy(dtype=np.float64))
+                self.numeric['predicted_demand'].add(predictions)
+                for column in CATEGORY_COLUMNS:
+                    self.categories[column].add(df[column], lookups[column])
+
+    def unknown_rate(self, column: str) -> Optional[float]:
+        """Share of ``column`` labels the model doesn't know, as of the last flush."""
+        return self.categories[column].unknown_rate
+
+    # Reports
+
+    def _baseline(self) -> Tuple[Dict[str, Any], Optional[str]]:
+        """The baseline and its path (None when it comes from the model), cached per file version."""
+        path = self.baseline or baseline_path(self.predictor.model_path)
+        try:
+            stamp = (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return model_baseline(self.predictor), None
+        if self._baseline_cache[0] != stamp:
+            self._baseline_cache = (stamp, load_baseline(path))
+        return self._baseline_cache[1], path
+
+    def report(self) -> Dict[str, Any]:
+        """Live sketches against the baseline, per feature and overall."""
+        self.flush()
+        baseline, path = self._baseline()
+        with self._sketch_lock:
+            features = {column: compare_numeric(sketch, baseline['numeric'].get(column))
+                        for column, sketch in self.numeric.items()}
+            features.update({column: compare_categories(stats, baseline['categories'].get(column))
+                             for column, stats in self.categories.items()})
+            rows = self.numeric['Inventory Level'].count
+            since = self.since
+        return {
+            'status': _worst([feature['status'] for feature in features.values()]),
+            'since': since.isoformat(),
+            'rows': rows,
+            'dropped_rows': self.dropped,
+            'model_version': self.model_version,
+            'baseline': {'path': path, 'source': baseline.get('source'), 'rows': baseline.get('rows'),
+                         'created_at': baseline.get('created_at')},
+            'features': features,
+            'thresholds': {'min_rows': MIN_ROWS, 'psi': [PSI_WARNING, PSI_DRIFT],
+                           'unknown_rate': [UNKNOWN_WARNING, UNKNOWN_DRIFT],
+                           'mean_shift': [MEAN_SHIFT_WARNING, MEAN_SHIFT_DRIFT]},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the drift baseline of a demand model from its training data")
+    parser.add_argument('command', choices=['baseline'])
+    parser.add_argument('inputs', nargs='+', help='CSV or Parquet training files')
+    parser.add_argument('--model', help='Model artifact directory or .pkl (default: as the server)')
+    parser.add_argument('-o', '--output', help='Baseline file to write (default: next to the model)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from inventory_model import InventoryPredictor
+    from train import load_training_data
+
+    predictor = InventoryPredictor(args.model)
+    df = load_training_data(args.inputs)
+    scored, reasons = predictor.predict_demand_frame(df)
+    baseline = build_baseline(scored, scored['predicted_demand'].to_numpy(), source=', '.join(args.inputs))
+    output = args.output or baseline_path(predictor.model_path)
+    write_baseline(baseline, output)
+    print(f"Wrote the baseline of {len(scored)} rows ({len(reasons)} rejected) to {output}")
+
+
+if __name__ == '__main__':
+    main()
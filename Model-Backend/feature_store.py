@@ -0,0 +1,275 @@
+"""
+In-memory time-series features per (store, product).
+
+Each pair keeps a ring buffer with one slot per calendar day for the last
+``horizon`` days of every tracked series (Units Sold, Inventory Level,
+Units Ordered). Features are named and defined as in
+``prepare_inventory_features`` (final.ipynb):
+
+    <series>_lag_<k>   value k days before the target date
+    <series>_ma_<w>    mean of the w days before the target date, ignoring
+                       missing days (like ``shift(1).rolling(w, min_periods=1)``)
+
+Whenever a pair receives data, its feature row for the following day is
+precomputed. A lookup for that date copies one row, O(1); any other date
+within the buffer is gathered from the ring. ``lookup_batch`` does the same
+for whole arrays of keys without a Python loop per feature.
+"""
+
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Input column for each series prefix used in feature names
+SERIES_COLUMNS = {
+    'units_sold': 'Units Sold',
+    'inventory': 'Inventory Level',
+    'units_ordered': 'Units Ordered',
+}
+FEATURE_PATTERN = re.compile(r'^(%s)_(lag|ma)_(\d+)$' % '|'.join(SERIES_COLUMNS))
+DEFAULT_FEATURES = [
+    f"{series}_{kind}_{n}"
+    for series in SERIES_COLUMNS
+    for kind, ns in (('lag', (1, 7, 28)), ('ma', (7, 28)))
+    for n in ns
+]
+# Day number used for pairs that have no data yet
+_NO_DAY = np.iinfo(np.int64).min // 2
+
+
+def parse_feature(name: str) -> Optional[Tuple[str, str, int]]:
+    """(series, 'lag' or 'ma', days) for a supported feature name, else None."""
+    match = FEATURE_PATTERN.match(name)
+    if match is None or int(match.group(3)) < 1:
+        return None
+    return match.group(1), match.group(2), int(match.group(3))
+
+
+def day_numbers(dates) -> np.ndarray:
+    """Days since the epoch for an array of dates (NaT becomes _NO_DAY)."""
+    values = pd.to_datetime(pd.Series(dates), errors='coerce')
+    days = values.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    days[values.isna().to_numpy()] = _NO_DAY
+    return days
+
+
+def _month_partition(relative_path: str) -> str:
+    return relative_path.replace('\\', '/').split('/')[0]
+
+
+class FeatureStore:
+    """Ring buffers of recent history and precomputed lag / rolling-mean features."""
+
+    def __init__(self, feature_names: Sequence[str] = None, initial_pairs: int = 1024):
+        names = list(dict.fromkeys(feature_names or DEFAULT_FEATURES))
+        parsed = [parse_feature(name) for name in names]
+        unsupported = [name for name, spec in zip(names, parsed) if spec is None]
+        if unsupported:
+            raise ValueError(f"Unsupported features: {', '.join(unsupported)}")
+
+        self.feature_names = names
+        self.series = [series for series in SERIES_COLUMNS if any(spec[0] == series for spec in parsed)]
+        self.horizon = max(spec[2] for spec in parsed)
+        self._specs = [(self.series.index(series), kind, n) for series, kind, n in parsed]
+        self._max_window = max([n for _, kind, n in self._specs if kind == 'ma'], default=0)
+
+        self._index: Dict[Tuple[str, str], int] = {}
+        self._values = np.full((initial_pairs, len(self.series), self.horizon), np.nan, dtype=np.float32)
+        self._last_day = np.full(initial_pairs, _NO_DAY, dtype=np.int64)
+        # Features for the day after each pair's latest data
+        self._next = np.full((initial_pairs, len(names)), np.nan, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def supports(cls, name: str) -> bool:
+        return parse_feature(name) is not None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def pairs(self) -> Tuple[List[str], List[str], np.ndarray]:
+        """Store IDs, Product IDs and latest day number of every tracked pair."""
+        with self._lock:
+            keys = list(self._index)
+            rows = np.fromiter(self._index.values(), dtype=np.int64, count=len(keys))
+            last_day = self._last_day[rows].copy()
+        return [store for store, _ in keys], [product for _, product in keys], last_day
+
+    def _grow(self, size: int):
+        capacity = len(self._last_day)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        extra = new_capacity - capacity
+        self._values = np.concatenate(
+            [self._values, np.full((extra,) + self._values.shape[1:], np.nan, dtype=np.float32)])
+        self._last_day = np.concatenate([self._last_day, np.full(extra, _NO_DAY, dtype=np.int64)])
+        self._next = np.concatenate([self._next, np.full((extra, self._next.shape[1]), np.nan, dtype=np.float32)])
+
+    def _rows(self, stores: Sequence[str], products: Sequence[str], create: bool = False) -> np.ndarray:
+        index = self._index
+        if not create:
+            return np.fromiter((index.get(key, -1) for key in zip(stores, products)), dtype=np.int64,
+                               count=len(stores))
+        rows = np.empty(len(stores), dtype=np.int64)
+        for i, key in enumerate(zip(stores, products)):
+            row = index.get(key)
+            if row is None:
+                row = index[key] = len(index)
+            rows[i] = row
+        self._grow(len(index))
+        return rows
+
+    def update(self, df: pd.DataFrame) -> int:
+        """
+        Add observations (``Date``, ``Store ID``, ``Product ID`` and the
+        series columns; missing series are stored as gaps). Observations
+        older than the buffer are ignored. Returns the number of pairs updated.
+        """
+        if len(df) == 0:
+            return 0
+        days = day_numbers(df['Date'])
+        valid = days != _NO_DAY
+        if not valid.all():
+            df, days = df[valid], days[valid]
+        values = np.column_stack([
+            pd.to_numeric(df[SERIES_COLUMNS[series]], errors='coerce').to_numpy(dtype=np.float32)
+            if SERIES_COLUMNS[series] in df.columns else np.full(len(df), np.nan, dtype=np.float32)
+            for series in self.series
+        ])
+
+        with self._lock:
+            rows = self._rows(df['Store ID'].astype(str).tolist(), df['Product ID'].astype(str).tolist(),
+                              create=True)
+            # Group observations by pair, oldest first (stable, so the last
+            # observation of a day wins)
+            order = np.lexsort((days, rows))
+            rows, days, values = rows[order], days[order], values[order]
+            touched, starts = np.unique(rows, return_index=True)
+            ends = np.append(starts[1:], len(rows))
+
+            horizon = self.horizon
+            for row, start, end in zip(touched.tolist(), starts.tolist(), ends.tolist()):
+                last = self._last_day[row]
+                newest = days[end - 1]
+                if newest > last:
+                    # Blank the slots of the days we skip over (at most the whole ring)
+                    cleared = np.arange(max(last + 1, newest - horizon + 1), newest + 1)
+                    self._values[row][:, cleared % horizon] = np.nan
+                    last = self._last_day[row] = newest
+                keep = days[start:end] > last - horizon
+                pair_days = days[start:end][keep]
+                self._values[row][:, pair_days % horizon] = values[start:end][keep].T
+
+            self._next[touched] = self._compute(touched, self._last_day[touched] + 1)
+        return len(touched)
+
+    def _compute(self, rows: np.ndarray, target_days: np.ndarray) -> np.ndarray:
+        """Feature rows for ``rows`` as of ``target_days`` (rows of -1 get NaN)."""
+        n = len(rows)
+        out = np.full((n, len(self.feature_names)), np.nan, dtype=np.float32)
+        known = rows >= 0
+        if not known.any():
+            return out
+        rows = np.where(known, rows, 0)
+        last = np.where(known, self._last_day[rows], _NO_DAY)
+
+        def gather(offsets: np.ndarray) -> np.ndarray:
+            # Values ``offsets`` (n, k) days before each target: (n, k, series)
+            day = target_days[:, None] - offsets
+            in_buffer = (day <= last[:, None]) & (day > last[:, None] - self.horizon)
+            gathered = self._values[rows[:, None], :, np.mod(day, self.horizon)]
+            return np.where(in_buffer[..., None], gathered, np.nan)
+
+        for column, (series, kind, days) in enumerate(self._specs):
+            if kind == 'lag':
+                out[:, column] = gather(np.full((n, 1), days))[:, 0, series]
+
+        if self._max_window:
+            window = gather(np.broadcast_to(np.arange(1, self._max_window + 1), (n, self._max_window)))
+            present = ~np.isnan(window)
+            sums = np.cumsum(np.where(present, window, 0), axis=1, dtype=np.float64)
+            counts = np.cumsum(present, axis=1)
+            for column, (series, kind, days) in enumerate(self._specs):
+                if kind == 'ma':
+                    count = counts[:, days - 1, series]
+                    # A window reaching past the start of the buffer would be a partial mean
+                    complete = target_days - days > last - self.horizon
+                    out[:, column] = np.divide(sums[:, days - 1, series], count,
+                                               out=np.full(n, np.nan), where=(count > 0) & complete)
+
+        out[~known] = np.nan
+        return out
+
+    def lookup(self, store_id: str, product_id: str, date=None) -> np.ndarray:
+        """Feature row (in ``feature_names`` order) for one pair; NaN where unknown."""
+        day = day_numbers([date])[0] if date is not None else None
+        # update() may be growing the arrays or rewriting this pair's rows
+        with self._lock:
+            row = self._index.get((str(store_id), str(product_id)))
+            if row is None:
+                return np.full(len(self.feature_names), np.nan, dtype=np.float32)
+            if day is None or day == self._last_day[row] + 1:
+                return self._next[row].copy()
+            return self._compute(np.array([row]), np.array([day]))[0]
+
+    def lookup_batch(self, stores: Sequence[str], products: Sequence[str], dates=None) -> np.ndarray:
+        """
+        Feature rows for arrays of pairs (and optionally dates; default: the
+        day after each pair's latest data). Shape (n, len(feature_names)).
+        """
+        stores = [str(store) for store in stores]
+        products = [str(product) for product in products]
+        days = day_numbers(dates) if dates is not None else None
+        out = np.full((len(stores), len(self.feature_names)), np.nan, dtype=np.float32)
+        # update() may be growing the arrays or rewriting rows
+        with self._lock:
+            rows = self._rows(stores, products)
+            known = rows >= 0
+            if days is None:
+                out[known] = self._next[rows[known]]
+                return out
+
+            fresh = known & (days == np.where(known, self._last_day[np.maximum(rows, 0)], _NO_DAY) + 1)
+            out[fresh] = self._next[rows[fresh]]
+            other = known & ~fresh & (days != _NO_DAY)
+            if other.any():
+                out[other] = self._compute(rows[other], days[other])
+        return out
+
+    def frame(self, stores: Sequence[str], products: Sequence[str], dates=None, index=None) -> pd.DataFrame:
+        """``lookup_batch`` as a DataFrame with ``feature_names`` columns."""
+        return pd.DataFrame(self.lookup_batch(stores, products, dates), columns=self.feature_names, index=index)
+
+    def load_parquet(self, paths: List[str]) -> int:
+        """Update from Parquet files such as those written by ingestion.py."""
+        columns = ['Date', 'Store ID', 'Product ID'] + [SERIES_COLUMNS[series] for series in self.series]
+        updated = 0
+        for path in paths:
+            updated += self.update(pd.read_parquet(path, columns=columns))
+        return updated
+
+    def load_recent(self, ingestion_store) -> int:
+        """
+        Fill the buffers from an ingestion store, reading only the month
+        partitions that can still fall inside the buffer.
+        """
+        files = [relative for batch in ingestion_store.manifest()['batches'] for relative in batch['files']]
+        months = sorted({_month_partition(relative) for relative in files})
+        if not months:
+            return 0
+        latest = pd.Period(months[-1].split('=', 1)[1], freq='M')
+        # The latest data can be at the end of its month, so go back far
+        # enough from the month's start
+        oldest = (latest.to_timestamp() - pd.Timedelta(days=self.horizon)).to_period('M')
+        wanted = {f"month={period}" for period in pd.period_range(oldest, latest, freq='M')}
+        paths = [ingestion_store.file_path(relative) for relative in files if _month_partition(relative) in wanted]
+        updated = self.load_parquet(paths)
+        logger.info(f"Feature store loaded {len(paths)} partitions ({len(self)} pairs)")
+        return updated
@@ -0,0 +1,408 @@
+"""
+Precomputed multi-day demand forecasts.
+
+A nightly job scores every known store/product pair for the next N days and
+writes the results to a forecast table, a directory of memory-mapped arrays::
+
+    forecasts/
+        manifest.json       # start date, days, model version, build time
+        keys.npy            # sorted "<store>\\x1f<product>" keys, one per row
+        demand.npy          # float32 (pairs, days) demand forecasts
+        inventory.npy       # float32 (pairs, days) projected opening inventory
+
+The server answers (store, product, date range) queries from the table with
+a binary search over ``keys`` and a slice of the forecast rows, and only runs
+the model for pairs or dates the table doesn't cover.
+
+The demand model sees store, product and inventory level only, so days
+after the first are scored from a projected inventory: each day opens with
+the previous day's inventory minus its forecast demand, plus the pair's
+recent average ``Units Ordered`` (from the feature store). Pairs without
+order history keep their inventory level.
+
+Usage:
+    python forecast_table.py build --days 28
+    python forecast_table.py build --input retail_store_inventory.csv --start 2024-01-01
+    python forecast_table.py info
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compiled_model import CompiledDemandModel
+from feature_store import _NO_DAY, FeatureStore, day_numbers
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_DAYS = 28
+MAX_QUERY_DAYS = 90
+# Next-day feature-store values used to start the projection
+INVENTORY_FEATURE = 'inventory_lag_1'
+REPLENISHMENT_FEATURE = 'units_ordered_ma_7'
+KEY_SEPARATOR = '\x1f'
+
+
+def default_table_path() -> str:
+    return os.environ.get('FORECAST_TABLE_DIR', 'forecasts')
+
+
+def pair_keys(stores: Sequence[str], products: Sequence[str]) -> np.ndarray:
+    return np.array([f"{store}{KEY_SEPARATOR}{product}" for store, product in zip(stores, products)], dtype=str)
+
+
+def _day_string(day: int) -> str:
+    return str(np.datetime64(int(day), 'D'))
+
+
+def project_demand(runtime, stores: Sequence[str], products: Sequence[str], inventory: np.ndarray,
+                   replenishment: np.ndarray, days: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Demand forecasts and opening inventory for ``days`` consecutive days,
+    starting from ``inventory``. One model call per day for all pairs.
+    NaN ``replenishment`` holds the inventory level.
+    """
+    n = len(inventory)
+    inventory = np.asarray(inventory, dtype=np.float64)
+    replenishment = np.asarray(replenishment, dtype=np.float64)
+    demand = np.empty((n, days), dtype=np.float32)
+    opening = np.empty((n, days), dtype=np.float32)
+    if n == 0:
+        return demand, opening
+
+    if isinstance(runtime, CompiledDemandModel):
+        # Encode the categories once; only the inventory column changes
+        X = runtime.encode(stores, products, inventory)
+
+        def predict(level: np.ndarray) -> np.ndarray:
+            X[:, 2] = (level - runtime.mean[2]) / runtime.scale[2]
+            return runtime.predict_features(X)
+    else:
+        df = pd.DataFrame({'Store ID': list(stores), 'Product ID': list(products), 'Inventory Level': inventory})
+
+        def predict(level: np.ndarray) -> np.ndarray:
+            df['Inventory Level'] = level
+            return runtime.predict(df)
+
+    level = inventory
+    for day in range(days):
+        # Ensure predictions are not negative
+        predicted = np.maximum(predict(level), 0)
+        opening[:, day] = level
+        demand[:, day] = predicted
+        restock = np.where(np.isnan(replenishment), predicted, replenishment)
+        level = np.maximum(level - predicted, 0) + restock
+    return demand, opening
+
+
+def write_table(path: str, stores: Sequence[str], products: Sequence[str], start_day: int,
+                demand: np.ndarray, inventory: np.ndarray, model_version: Optional[str]) -> Dict[str, Any]:
+    """Write a forecast table to ``path``, replacing any existing one."""
+    keys = pair_keys(stores, products)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    if len(keys) > 1 and (keys[1:] == keys[:-1]).any():
+        raise ValueError("Duplicate store/product pairs")
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'model_version': model_version,
+        'start_date': _day_string(start_day),
+        'days': int(demand.shape[1]),
+        'pairs': int(len(keys)),
+    }
+    # Build next to the target and swap directories, so readers never see a
+    # half-written table (open memory maps keep the old files alive)
+    path = os.path.normpath(path)
+    tmp_path, old_path = f"{path}.tmp", f"{path}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'keys.npy'), keys, allow_pickle=False)
+    np.save(os.path.join(tmp_path, 'demand.npy'), np.ascontiguousarray(demand[order], dtype=np.float32),
+            allow_pickle=False)
+    np.save(os.path.join(tmp_path, 'inventory.npy'), np.ascontiguousarray(inventory[order], dtype=np.float32),
+            allow_pickle=False)
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def build_table(path: str, predictor, feature_store: FeatureStore, days: int = DEFAULT_DAYS,
+                start=None) -> Dict[str, Any]:
+    """
+    Score every pair in ``feature_store`` for ``days`` days from ``start``
+    (default: the day after the latest data) and write the table to ``path``.
+    Pairs without a known inventory level are left out.
+    """
+    if days < 1:
+        raise ValueError("days must be >= 1")
+    runtime = predictor.runtime
+    if runtime is None:
+        raise ValueError("Model not loaded")
+
+    stores, products, last_day = feature_store.pairs()
+    if not stores:
+        raise ValueError("The feature store has no store/product history")
+    start_day = int(last_day.max()) + 1 if start is None else int(day_numbers([start])[0])
+    if start_day == _NO_DAY:
+        raise ValueError(f"Invalid start date: {start!r}")
+
+    names = feature_store.feature_names
+    features = feature_store.lookup_batch(stores, products)
+    inventory = features[:, names.index(INVENTORY_FEATURE)].astype(np.float64)
+    replenishment = (features[:, names.index(REPLENISHMENT_FEATURE)].astype(np.float64)
+                     if REPLENISHMENT_FEATURE in names else np.full(len(stores), np.nan))
+    known = ~np.isnan(inventory)
+    stores = [store for store, ok in zip(stores, known) if ok]
+    products = [product for product, ok in zip(products, known) if ok]
+
+    demand, opening = project_demand(runtime, stores, products, inventory[known], replenishment[known], days)
+    manifest = write_table(path, stores, products, start_day, demand, opening, predictor.model_version)
+    logger.info(f"Wrote forecast table for {manifest['pairs']} pairs x {days} days from "
+                f"{manifest['start_date']} to {path}")
+    return manifest
+
+
+class ForecastTable:
+    """A forecast table opened read-only with memory-mapped arrays."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version', 0) > FORMAT_VERSION:
+            raise ValueError(f"Forecast table format {self.manifest.get('format_version')} is newer than "
+                             f"supported ({FORMAT_VERSION})")
+        self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r', allow_pickle=False)
+        self.demand = np.load(os.path.join(path, 'demand.npy'), mmap_mode='r', allow_pickle=False)
+        self.inventory = np.load(os.path.join(path, 'inventory.npy'), mmap_mode='r', allow_pickle=False)
+        self.start_day = int(day_numbers([self.manifest['start_date']])[0])
+        self.days = self.manifest['days']
+        self.model_version = self.manifest.get('model_version')
+
+    @property
+    def end_day(self) -> int:
+        return self.start_day + self.days - 1
+
+    def rows(self, stores: Sequence[str], products: Sequence[str]) -> np.ndarray:
+        """Row of each pair in the table, -1 for pairs it doesn't have."""
+        if len(self.keys) == 0:
+            return np.full(len(stores), -1, dtype=np.int64)
+        query = pair_keys(stores, products)
+        rows = np.searchsorted(self.keys, query)
+        clipped = np.minimum(rows, len(self.keys) - 1)
+        return np.where((rows < len(self.keys)) & (self.keys[clipped] == query), clipped, -1)
+
+    def covers(self, start_day: int, end_day: int) -> bool:
+        return self.start_day <= start_day and end_day <= self.end_day
+
+    def read(self, rows: np.ndarray, start_day: int, end_day: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Demand and opening inventory of ``rows`` for the days in [start_day, end_day]."""
+        columns = slice(start_day - self.start_day, end_day - self.start_day + 1)
+        return self.demand[rows, columns], self.inventory[rows, columns]
+
+
+class Forecaster:
+    """
+    Multi-day forecasts served from the current forecast table, with live
+    projections for whatever it doesn't cover. The table is reopened when the
+    nightly job replaces it.
+    """
+
+    def __init__(self, predictor, path: str = None, feature_store: FeatureStore = None):
+        self.predictor = predictor
+        self.path = path or default_table_path()
+        self.feature_store = feature_store
+        self._table: Optional[ForecastTable] = None
+        self._table_stamp = None
+        self._lock = threading.Lock()
+
+    def table(self) -> Optional[ForecastTable]:
+        """The current table (None if there is none), reopened if it changed on disk."""
+        try:
+            stat = os.stat(os.path.join(self.path, MANIFEST_FILE))
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            return None
+        if stamp != self._table_stamp:
+            with self._lock:
+                if stamp != self._table_stamp:
+                    try:
+                        self._table = ForecastTable(self.path)
+                        logger.info(f"Opened forecast table {self.path} ({self._table.manifest['pairs']} pairs "
+                                    f"from {self._table.manifest['start_date']})")
+                    except Exception as e:
+                        # Mid-swap or corrupt; keep serving the previous table
+                        logger.error(f"Failed to open forecast table {self.path}: {str(e)}")
+                        return self._table
+                    self._table_stamp = stamp
+        return self._table
+
+    def resolve_range(self, start_date=None, end_date=None) -> Tuple[int, int]:
+        """Day numbers of the requested range; defaults to the table's dates (or a week from today)."""
+        table = self.table()
+        if start_date is None:
+            start_day = table.start_day if table is not None else int(day_numbers([datetime.now().date()])[0])
+        else:
+            start_day = int(day_numbers([start_date])[0])
+            if start_day == _NO_DAY:
+                raise ValueError(f"Invalid start_date: {start_date!r}")
+        if end_date is None:
+            end_day = table.end_day if table is not None and table.covers(start_day, start_day) else start_day + 6
+        else:
+            end_day = int(day_numbers([end_date])[0])
+            if end_day == _NO_DAY:
+                raise ValueError(f"Invalid end_date: {end_date!r}")
+        if end_day < start_day:
+            raise ValueError("end_date must not be before start_date")
+        if end_day - start_day + 1 > MAX_QUERY_DAYS:
+            raise ValueError(f"A forecast covers at most {MAX_QUERY_DAYS} days")
+        return start_day, end_day
+
+    def forecast(self, items: List[Any], start_date=None, end_date=None) -> Tuple[Dict[str, Any], List[Dict]]:
+        """
+        Daily forecasts for ``items`` over a date range. Raises ValueError for
+        an invalid range.
+
+        Returns ``dates``, the matching ``demand`` and ``inventory`` matrices
+        (one row per forecast item), the item ``index``, ``store_id``,
+        ``product_id`` and ``source`` ("table" or "live") arrays and the
+        ``table`` in use; plus the per-item errors.
+        """
+        start_day, end_day = self.resolve_range(start_date, end_date)
+        days = end_day - start_day + 1
+        table = self.table()
+
+        df, reasons = self.predictor._frame_items(items, columns=['Store ID', 'Product ID', 'Inventory Level'])
+        for column in ('Store ID', 'Product ID'):
+            for i in df.index[df[column].isna()]:
+                reasons.setdefault(i, f"Missing required column: {column}")
+        df = df.loc[~df.index.isin(list(reasons))]
+        stores = df['Store ID'].astype(str).tolist()
+        products = df['Product ID'].astype(str).tolist()
+
+        if table is not None and table.covers(start_day, end_day):
+            rows = table.rows(stores, products)
+        else:
+            rows = np.full(len(df), -1, dtype=np.int64)
+        cached = rows >= 0
+
+        demand = np.empty((len(df), days), dtype=np.float32)
+        inventory = np.empty((len(df), days), dtype=np.float32)
+        if cached.any():
+            demand[cached], inventory[cached] = table.read(rows[cached], start_day, end_day)
+
+        live = ~cached
+        if live.any():
+            # Unseen pairs (or dates outside the table) need a starting inventory level
+            live_df, live_reasons = self.predictor.prepare_batch_frame(df.loc[live])
+            for i, reason in live_reasons.items():
+                reasons[i] = (f"{reason} (no precomputed forecast for this pair and range)"
+                              if reason == 'Missing required column: Inventory Level' else reason)
+            live &= ~df.index.isin(list(live_reasons))
+            if live.any():
+                replenishment = np.full(len(live_df), np.nan)
+                store = self.feature_store
+                if store is not None and REPLENISHMENT_FEATURE in store.feature_names:
+                    replenishment = store.lookup_batch(
+                        live_df['Store ID'].tolist(), live_df['Product ID'].tolist()
+                    )[:, store.feature_names.index(REPLENISHMENT_FEATURE)].astype(np.float64)
+                runtime = self.predictor.runtime
+                if runtime is None:
+                    raise ValueError("Model not loaded")
+                demand[live], inventory[live] = project_demand(
+                    runtime, live_df['Store ID'].tolist(), live_df['Product ID'].tolist(),
+                    live_df['Inventory Level'].to_numpy(), replenishment, days)
+
+        served = cached | live
+        result = {
+            'dates': [_day_string(day) for day in range(start_day, end_day + 1)],
+            'index': df.index.to_numpy()[served],
+            'store_id': np.array(stores, dtype=object)[served],
+            'product_id': np.array(products, dtype=object)[served],
+            'source': np.where(cached, 'table', 'live')[served],
+            'demand': demand[served],
+            'inventory': inventory[served],
+            'table': table,
+        }
+        errors = self.predictor._item_errors(items, reasons)
+        logger.info(f"Forecast made: {int(cached.sum())} from the table, {int(live.sum())} live, "
+                    f"{len(errors)} rejected")
+        return result, errors
+
+
+def _history(paths: List[str], ingestion_dir: Optional[str]) -> FeatureStore:
+    store = FeatureStore([INVENTORY_FEATURE, REPLENISHMENT_FEATURE])
+    if paths:
+        for path in paths:
+            columns = ['Date', 'Store ID', 'Product ID', 'Inventory Level', 'Units Ordered']
+            if path.endswith('.parquet'):
+                store.update(pd.read_parquet(path, columns=columns))
+            else:
+                store.update(pd.read_csv(path, usecols=columns))
+    else:
+        from ingestion import IngestionStore
+        store.load_recent(IngestionStore(ingestion_dir))
+    return store
+
+
+def _predictor(model_path: Optional[str]):
+    from inventory_model import InventoryPredictor
+    from model_registry import ModelRegistry
+    from prediction_cache import PredictionCache
+
+    cache = PredictionCache(max_size=0)
+    if model_path:
+        return InventoryPredictor(model_path, cache=cache)
+    registry = ModelRegistry(os.environ.get('MODEL_REGISTRY_DIR', 'models'))
+    version = registry.get_active_version()
+    if version:
+        return InventoryPredictor(registry.artifact_path(version), cache=cache, model_version=version)
+    return InventoryPredictor(cache=cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precomputed multi-day demand forecasts')
+    parser.add_argument('-o', '--output-dir', default=default_table_path(),
+                        help='Forecast table directory (default: $FORECAST_TABLE_DIR or forecasts)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Score every known store/product pair for the next N days')
+    build.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    build.add_argument('--start', help='First forecast date (default: the day after the latest data)')
+    build.add_argument('--input', nargs='+', help='CSV or Parquet history (default: the ingestion store)')
+    build.add_argument('--ingestion-dir', help='Ingestion store (default: $INGESTION_DIR or ingested)')
+    build.add_argument('--model', help='Model artifact directory or .pkl (default: the active registry '
+                                       'version, else demand_model)')
+    subparsers.add_parser('info', help='Show the current table\'s manifest')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'build':
+        manifest = build_table(args.output_dir, _predictor(args.model), _history(args.input, args.ingestion_dir),
+                               days=args.days, start=args.start)
+        print(json.dumps(manifest, indent=2))
+    else:
+        print(json.dumps(ForecastTable(args.output_dir).manifest, indent=2))
+
+
+if __name__ == '__main__':
+    main()
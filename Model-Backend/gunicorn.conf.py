@@ -0,0 +1,87 @@
+"""
+Gunicorn settings for serving the Inventory Management API in production.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden through the environment variables below.
+"""
+
+import gc
+import multiprocessing
+import os
+
+from config import env_flag
+
+# LightGBM uses OpenMP for prediction. With several workers and threads per
+# worker, one OpenMP thread per predict call avoids oversubscribing the CPU.
+# This must be set before the model is imported.
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Load app.py (and demand_model.pkl) once in the master before forking, so
+# the LightGBM booster and encoder pages are shared copy-on-write. With
+# FAST_STARTUP each worker loads its own models in a background thread (which
+# wouldn't survive the fork) and answers /health with "warming" until then.
+FAST_STARTUP = env_flag('FAST_STARTUP')
+preload_app = not FAST_STARTUP
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+# On SIGTERM, workers stop accepting connections and get this long to finish
+# in-flight requests before being killed.
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Snapshots left by the workers of a previous run would be merged into /metrics
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.startswith('metrics-'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def when_ready(server):
+    # Move everything allocated while loading the model into the permanent
+    # generation so the garbage collector doesn't touch (and copy) those
+    # pages in every worker.
+    gc.freeze()
+    loading = "models load in each worker" if FAST_STARTUP else "model preloaded"
+    server.log.info(f"Starting {workers} workers x {threads} threads; {loading}")
+
+
+def post_fork(server, worker):
+    # Threads don't survive fork, so restart the registry watcher per worker
+    from app import model_activator
+
+    poll_seconds = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 0))
+    if model_activator is not None and poll_seconds > 0:
+        model_activator.watch(poll_seconds)
+
+    # Pick up analysis jobs queued before a restart or by other workers
+    from app import analysis_jobs
+    if os.path.exists(analysis_jobs.database_path):
+        analysis_jobs.start()
+
+    # Share this worker's metrics so /metrics on any worker covers them all
+    if os.environ.get('METRICS_DIR'):
+        import metrics
+        metrics.REGISTRY.start_snapshots(os.environ['METRICS_DIR'],
+                                         float(os.environ.get('METRICS_SNAPSHOT_SECONDS', 5)))
+
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} exited")
+
+
+def on_exit(server):
+    server.log.info("Inventory Management API shut down")
@@ -0,0 +1,448 @@
+"""
+Incremental ingestion of inventory CSV uploads into partitioned Parquet.
+
+Uploads (e.g. the files the Node backend's /api/upload-csv drops into
+backend/uploads/) are parsed in chunks with compact dtypes and appended to a
+columnar store::
+
+    ingested/
+        month=2024-01/store=S001/part-00007.parquet
+        _manifest.json      # one entry per ingested file (batch), in order
+        _keys.npy           # sorted 64-bit keys of every ingested row
+        _cursors.json       # last batch each downstream consumer has read
+
+Rows are identified by (Date, Store ID, Product ID). A row whose key is
+already in the store is dropped, and so is an upload whose checksum matches
+an earlier one, so re-sending or re-watching the same data is harmless.
+Consumers such as scoring or retraining ask for the files of the batches
+they haven't read yet instead of re-reading every CSV.
+
+Usage:
+    python ingestion.py ingest retail_store_inventory.csv
+    python ingestion.py watch ../backend/uploads
+    python ingestion.py pending scoring
+    python ingestion.py ack scoring 12
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from batch_score import partition_name
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 100000
+MANIFEST_FILE = '_manifest.json'
+KEYS_FILE = '_keys.npy'
+CURSORS_FILE = '_cursors.json'
+LOCK_FILE = '_lock'
+INCOMING_DIR = '_incoming'
+
+# Columns of retail_store_inventory.csv and the dtypes they are stored with
+SCHEMA = {
+    'Date': 'datetime64[ms]',
+    'Store ID': 'category',
+    'Product ID': 'category',
+    'Category': 'category',
+    'Region': 'category',
+    'Inventory Level': 'Int32',
+    'Units Sold': 'Int32',
+    'Units Ordered': 'Int32',
+    'Demand Forecast': 'float32',
+    'Price': 'float32',
+    'Discount': 'float32',
+    'Weather Condition': 'category',
+    'Holiday/Promotion': 'Int8',
+    'Competitor Pricing': 'float32',
+    'Seasonality': 'category',
+}
+REQUIRED_COLUMNS = ['Date', 'Store ID', 'Product ID', 'Inventory Level']
+KEY_COLUMNS = ['Date', 'Store ID', 'Product ID']
+CATEGORY_COLUMNS = [col for col, dtype in SCHEMA.items() if dtype == 'category']
+INTEGER_RANGES = {'Int32': (-2 ** 31, 2 ** 31 - 1), 'Int8': (-128, 127)}
+MAX_REJECTED_EXAMPLES = 20
+
+
+def arrow_schema():
+    import pyarrow as pa
+
+    types = {
+        'datetime64[ms]': pa.timestamp('ms'),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'Int32': pa.int32(),
+        'Int8': pa.int8(),
+        'float32': pa.float32(),
+    }
+    return pa.schema([(col, types[dtype]) for col, dtype in SCHEMA.items()])
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _string_hashes(values: pd.Series) -> np.ndarray:
+    """Stable 64-bit hashes of a categorical column (one digest per distinct value)."""
+    categories = values.cat.categories
+    digests = np.array([
+        int.from_bytes(hashlib.blake2b(str(label).encode(), digest_size=8).digest(), 'little')
+        for label in categories
+    ], dtype=np.uint64)
+    return digests[values.cat.codes.to_numpy()]
+
+
+def row_keys(df: pd.DataFrame) -> np.ndarray:
+    """
+    64-bit keys of (Date, Store ID, Product ID). Built from blake2b digests,
+    so they stay the same across processes and library versions.
+    """
+    days = df['Date'].to_numpy(dtype='datetime64[D]').astype(np.int64).astype(np.uint64)
+    store = _string_hashes(df['Store ID'])
+    product = _string_hashes(df['Product ID'])
+    # uint64 arithmetic wraps, which is what we want for mixing
+    return (store * np.uint64(0x9E3779B97F4A7C15)) ^ (product * np.uint64(0xC2B2AE3D27D4EB4F)) ^ \
+        (days * np.uint64(0x165667B19E3779F9))
+
+
+def _display(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def coerce_chunk(chunk: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Any, str]]:
+    """
+    Convert a raw chunk to ``SCHEMA`` dtypes. Returns the valid rows and the
+    reasons for rejecting the rest, keyed by row number.
+    """
+    reasons: Dict[Any, str] = {}
+    out = {}
+    for col, dtype in SCHEMA.items():
+        raw = chunk[col] if col in chunk.columns else pd.Series(np.nan, index=chunk.index)
+        if dtype == 'category':
+            values = raw.astype('string').str.strip().replace('', pd.NA)
+            out[col] = values
+            continue
+
+        if col == 'Date':
+            values = pd.to_datetime(raw, errors='coerce')
+        else:
+            values = pd.to_numeric(raw, errors='coerce')
+        for i in chunk.index[values.isna() & raw.notna()]:
+            reasons.setdefault(i, f"Invalid {col}: {_display(raw[i])!r}")
+        if dtype in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[dtype]
+            bad = values.notna() & ((values % 1 != 0) | (values < low) | (values > high))
+            for i in chunk.index[bad]:
+                reasons.setdefault(i, f"Invalid {col}: {_display(raw[i])!r}")
+            values = values.where(~bad)
+        out[col] = values
+
+    for col in REQUIRED_COLUMNS:
+        for i in chunk.index[out[col].isna()]:
+            reasons.setdefault(i, f"Missing {col}")
+
+    valid = ~chunk.index.isin(list(reasons))
+    df = pd.DataFrame({col: values[valid] for col, values in out.items()})
+    for col, dtype in SCHEMA.items():
+        df[col] = df[col].astype(dtype)
+    return df, reasons
+
+
+def iter_csv_chunks(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Raw chunks of the ``SCHEMA`` columns of a CSV, indexed by data row number."""
+    reader = pd.read_csv(
+        path,
+        chunksize=chunk_size,
+        usecols=lambda col: col in SCHEMA,
+        # Read categories as text; numbers are parsed (and checked) in coerce_chunk
+        dtype={col: str for col in CATEGORY_COLUMNS + ['Date']}
+    )
+    for chunk in reader:
+        yield chunk
+
+
+class IngestionStore:
+    """An append-only, deduplicated Parquet store of inventory rows."""
+
+    def __init__(self, root: str = None):
+        self.root = root or os.environ.get('INGESTION_DIR', 'ingested')
+        self._lock = threading.Lock()
+        self._keys: Optional[np.ndarray] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def file_path(self, relative: str) -> str:
+        """Path of a data file listed in a manifest batch's ``files``."""
+        return self._path(relative)
+
+    @contextmanager
+    def locked(self):
+        """Serialise writers in this process and, where supported, across processes."""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # Another process may have ingested since we last looked
+                    self._keys = None
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_json(self, name: str, default):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def _write_json(self, name: str, data):
+        tmp_path = self._path(name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self._path(name))
+
+    def manifest(self) -> Dict[str, Any]:
+        manifest = self._read_json(MANIFEST_FILE, {'format_version': FORMAT_VERSION, 'batches': []})
+        if manifest.get('format_version', 0) > FORMAT_VERSION:
+            raise ValueError(f"Ingestion store format {manifest['format_version']} is newer than supported")
+        return manifest
+
+    def keys(self) -> np.ndarray:
+        if self._keys is None:
+            path = self._path(KEYS_FILE)
+            self._keys = np.load(path, allow_pickle=False) if os.path.exists(path) else np.empty(0, np.uint64)
+        return self._keys
+
+    def _save_keys(self, keys: np.ndarray):
+        tmp_path = self._path(KEYS_FILE + '.tmp.npy')
+        np.save(tmp_path, keys, allow_pickle=False)
+        os.replace(tmp_path, self._path(KEYS_FILE))
+        self._keys = keys
+
+    def find_batch(self, sha256: str) -> Optional[Dict[str, Any]]:
+        for batch in self.manifest()['batches']:
+            if batch['sha256'] == sha256:
+                return batch
+        return None
+
+    def ingest(self, path: str, source: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+        """
+        Append the new rows of the CSV at ``path``. Returns the batch summary
+        (or the earlier batch, with ``skipped`` set, if the file was already
+        ingested). Raises ValueError if the file can't be parsed.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Ingestion writes Parquet and requires pyarrow: pip install pyarrow")
+
+        source = source or os.path.basename(path)
+        sha256 = file_sha256(path)
+        with self.locked():
+            previous = self.find_batch(sha256)
+            if previous is not None:
+                logger.info(f"{source} matches batch {previous['batch']}; skipping")
+                return dict(previous, skipped=True)
+
+            manifest = self.manifest()
+            batch_number = manifest['batches'][-1]['batch'] + 1 if manifest['batches'] else 1
+            part_name = f"part-{batch_number:05d}.parquet"
+            schema = arrow_schema()
+            start = time.perf_counter()
+
+            seen = self.keys()
+            batch_keys: List[np.ndarray] = []
+            writers: Dict[str, Any] = {}
+            # Store ID of each partition, so a name collision can't merge two stores
+            partition_stores: Dict[str, str] = {}
+            rows_read = rows_written = duplicates = 0
+            rejected: Dict[str, int] = {}
+            examples: List[Dict[str, Any]] = []
+            try:
+                for chunk in iter_csv_chunks(path, chunk_size):
+                    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+                    if missing:
+                        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+                    rows_read += len(chunk)
+                    df, reasons = coerce_chunk(chunk)
+                    for i, reason in reasons.items():
+                        kind = reason.split(':')[0]
+                        rejected[kind] = rejected.get(kind, 0) + 1
+                        if len(examples) < MAX_REJECTED_EXAMPLES:
+                            examples.append({'row': int(i), 'error': reason})
+
+                    keys = row_keys(df)
+                    new = ~pd.Series(keys).duplicated().to_numpy() & ~np.isin(keys, seen)
+                    if batch_keys:
+                        new &= ~np.isin(keys, np.concatenate(batch_keys))
+                    duplicates += int((~new).sum())
+                    df = df[new]
+                    batch_keys.append(keys[new])
+
+                    month = df['Date'].dt.year * 100 + df['Date'].dt.month
+                    for (month_key, store_id), group in df.groupby([month, df['Store ID']], observed=True, sort=False):
+                        relative = os.path.join(f"month={month_key // 100:04d}-{month_key % 100:02d}",
+                                                partition_name(store_id), part_name)
+                        if partition_stores.setdefault(relative, store_id) != store_id:
+                            raise ValueError(f"Store IDs {partition_stores[relative]!r} and {store_id!r} "
+                                             f"map to the same partition: {relative}")
+                        if relative not in writers:
+                            os.makedirs(os.path.dirname(self._path(relative)), exist_ok=True)
+                            writers[relative] = pq.ParquetWriter(self._path(relative) + '.tmp', schema)
+                        writers[relative].write_table(pa.Table.from_pandas(group, schema=schema, preserve_index=False))
+                    rows_written += len(df)
+            except Exception:
+                for relative, writer in writers.items():
+                    writer.close()
+                    os.remove(self._path(relative) + '.tmp')
+                raise
+
+            for relative, writer in writers.items():
+                writer.close()
+                os.replace(self._path(relative) + '.tmp', self._path(relative))
+
+            # The data files are in place; the keys and manifest make them visible
+            if rows_written:
+                self._save_keys(np.union1d(seen, np.concatenate(batch_keys)))
+            batch = {
+                'batch': batch_number,
+                'source': source,
+                'sha256': sha256,
+                'ingested_at': datetime.now().isoformat(),
+                'rows_read': rows_read,
+                'rows_ingested': rows_written,
+                'duplicates': duplicates,
+                'rejected': sum(rejected.values()),
+                'rejected_by_reason': rejected,
+                'rejected_examples': examples,
+                'files': sorted(writers),
+                'seconds': round(time.perf_counter() - start, 3)
+            }
+            manifest['batches'].append(batch)
+            self._write_json(MANIFEST_FILE, manifest)
+
+        logger.info(f"Ingested {source} as batch {batch_number}: {rows_written} new rows, "
+                    f"{duplicates} duplicates, {batch['rejected']} rejected")
+        return batch
+
+    def ingest_upload(self, stream: IO[bytes], source: str) -> Dict[str, Any]:
+        """Spool an uploaded file under ``_incoming/`` and ingest it."""
+        incoming = self._path(INCOMING_DIR)
+        os.makedirs(incoming, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=incoming, suffix='.csv', delete=False) as f:
+            shutil.copyfileobj(stream, f)
+        try:
+            return self.ingest(f.name, source=source)
+        finally:
+            os.remove(f.name)
+
+    def pending_files(self, consumer: str) -> Tuple[List[str], int]:
+        """
+        Files of the batches ``consumer`` hasn't acknowledged yet, and the
+        number of the last of those batches (pass it to ``acknowledge``).
+        """
+        cursor = self._read_json(CURSORS_FILE, {}).get(consumer, 0)
+        batches = [batch for batch in self.manifest()['batches'] if batch['batch'] > cursor]
+        files = [self.file_path(relative) for batch in batches for relative in batch['files']]
+        return files, batches[-1]['batch'] if batches else cursor
+
+    def acknowledge(self, consumer: str, through_batch: int):
+        """Mark every batch up to ``through_batch`` as read by ``consumer``."""
+        with self.locked():
+            cursors = self._read_json(CURSORS_FILE, {})
+            cursors[consumer] = max(int(through_batch), cursors.get(consumer, 0))
+            self._write_json(CURSORS_FILE, cursors)
+
+    def watch(self, directory: str, interval_seconds: float = 5.0, settle_seconds: float = 2.0,
+              once: bool = False):
+        """
+        Ingest every file that appears in ``directory``. A file is picked up
+        once it hasn't changed for ``settle_seconds`` (so half-written uploads
+        are left alone); files that fail to parse are logged and not retried
+        until they change.
+        """
+        attempted = set()
+        while True:
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if name.startswith('.') or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                signature = (path, stat.st_size, stat.st_mtime)
+                if signature in attempted or time.time() - stat.st_mtime < settle_seconds:
+                    continue
+                attempted.add(signature)
+                try:
+                    self.ingest(path)
+                except Exception as e:
+                    logger.error(f"Failed to ingest {path}: {str(e)}")
+            if once:
+                return
+            time.sleep(interval_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest inventory CSVs into partitioned Parquet')
+    parser.add_argument('--store', help='Ingestion directory (default: $INGESTION_DIR or ./ingested)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Ingest CSV files')
+    ingest_parser.add_argument('files', nargs='+')
+    ingest_parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    watch_parser = subparsers.add_parser('watch', help='Ingest new files as they appear in a directory')
+    watch_parser.add_argument('directory', help='e.g. ../backend/uploads')
+    watch_parser.add_argument('--interval', type=float, default=5.0, help='Seconds between scans')
+    watch_parser.add_argument('--once', action='store_true', help='Scan once and exit')
+
+    pending_parser = subparsers.add_parser('pending', help="List files a consumer hasn't read yet")
+    pending_parser.add_argument('consumer')
+
+    ack_parser = subparsers.add_parser('ack', help='Mark batches as read by a consumer')
+    ack_parser.add_argument('consumer')
+    ack_parser.add_argument('through_batch', type=int)
+
+    args = parser.parse_args()
+    store = IngestionStore(args.store)
+    if args.command == 'ingest':
+        for path in args.files:
+            print(json.dumps(store.ingest(path, chunk_size=args.chunk_size), indent=2))
+    elif args.command == 'watch':
+        store.watch(args.directory, args.interval, once=args.once)
+    elif args.command == 'pending':
+        files, through_batch = store.pending_files(args.consumer)
+        print(json.dumps({'through_batch': through_batch, 'files': files}, indent=2))
+    elif args.command == 'ack':
+        store.acknowledge(args.consumer, args.through_batch)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    main()
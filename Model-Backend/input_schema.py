@@ -0,0 +1,217 @@
+"""
+Declarative validation of prediction inputs.
+
+A ``Schema`` lists its fields once, with their type and bounds. Whole
+batches are validated and coerced with column operations: every rule
+produces a mask over all rows, each failing row keeps the reason of the
+first rule it broke, and the valid rows come back coerced and ready for
+one model call. Single items go through the same rules in plain Python,
+so ``/predict`` and ``/predict/batch`` reject the same inputs with the same
+messages.
+
+    valid, failed, reasons = DEMAND_SCHEMA.validate(df)
+    store_id, product_id, inventory_level = DEMAND_SCHEMA.coerce(item)
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+STRING = 'string'
+NUMBER = 'number'
+# Element kinds (pandas.api.types.infer_dtype) that need no per-value type check
+_NUMERIC_KINDS = {'integer', 'floating', 'mixed-integer-float', 'decimal', 'empty'}
+_STRING_KINDS = {'string', 'empty'}
+# Scalars accepted for a string field (numeric IDs are converted with str())
+_STRING_SCALARS = (str, int, float, np.integer, np.floating)
+
+
+class Field:
+    """One input column: its type, whether it is required, and its bounds."""
+
+    def __init__(self, name: str, kind: str, required: bool = True,
+                 min_value: Optional[float] = None, max_value: Optional[float] = None):
+        if kind not in (STRING, NUMBER):
+            raise ValueError(f"Unknown field kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.required = required
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def __repr__(self) -> str:
+        return f"Field({self.name!r}, {self.kind!r})"
+
+    def invalid(self, value: Any, detail: str = None) -> str:
+        if isinstance(value, np.generic):
+            value = value.item()
+        message = f"Invalid {self.name}: {value!r}"
+        return f"{message} ({detail})" if detail else message
+
+    def missing(self) -> str:
+        return f"Missing required column: {self.name}"
+
+    def out_of_range(self, value: float) -> Optional[str]:
+        """The reason ``value`` is outside the bounds, else None."""
+        if self.min_value is not None and value < self.min_value:
+            return f"must be at least {self.min_value:g}"
+        if self.max_value is not None and value > self.max_value:
+            return f"must be at most {self.max_value:g}"
+        return None
+
+
+def _is_missing(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _id_text(value: Any) -> str:
+    # A batch with a missing ID promotes integer IDs to float; 1.0 is still ID '1'
+    if isinstance(value, (float, np.floating)) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Schema:
+    def __init__(self, fields: Sequence[Field]):
+        self.fields = list(fields)
+        self.columns = [field.name for field in self.fields]
+        self.required = [field.name for field in self.fields if field.required]
+
+    # Batches
+
+    def validate(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray, Dict[Any, str]]:
+        """
+        Validate and coerce every row of ``df`` (other columns are ignored).
+
+        Returns the valid rows (keeping ``df``'s index) restricted to the
+        schema's columns and coerced, a boolean mask of the failed rows
+        aligned with ``df``, and the failure reason of each failed row keyed
+        by index label.
+        """
+        df = df.reindex(columns=self.columns)
+        n = len(df)
+        failed = np.zeros(n, dtype=bool)
+        reason = np.empty(n, dtype=object)
+        coerced: Dict[str, Any] = {}
+
+        def fail(mask: np.ndarray, message):
+            # Only the first rule a row breaks is reported
+            new = mask & ~failed
+            if not new.any():
+                return
+            reason[new] = message(np.flatnonzero(new)) if callable(message) else message
+            failed[new] = True
+
+        for field in self.fields:
+            values = df[field.name]
+            missing = values.isna().to_numpy()
+            if field.required:
+                fail(missing, field.missing())
+            if field.kind == NUMBER:
+                coerced[field.name] = self._validate_numbers(field, values, missing, fail)
+            else:
+                coerced[field.name] = self._validate_strings(field, values, missing, fail)
+
+        valid = ~failed
+        out = pd.DataFrame({name: column[valid] for name, column in coerced.items()},
+                           index=df.index[valid], columns=self.columns)
+        reasons = dict(zip(df.index[failed], reason[failed]))
+        return out, failed, reasons
+
+    @staticmethod
+    def _validate_numbers(field: Field, values: pd.Series, missing: np.ndarray, fail) -> np.ndarray:
+        raw = values.to_numpy()
+        if pd.api.types.is_bool_dtype(values.dtype):
+            # true / false are not quantities
+            fail(~missing, lambda rows: [field.invalid(raw[i]) for i in rows])
+            return np.full(len(values), np.nan)
+
+        if pd.api.types.is_numeric_dtype(values.dtype):
+            numbers = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            numbers = np.array(pd.to_numeric(values, errors='coerce'), dtype=np.float64)
+            if kind not in _NUMERIC_KINDS and kind != 'string':
+                # Mixed types: booleans parse as 1 / 0, so only those rows need a look
+                candidates = np.flatnonzero((numbers == 0) | (numbers == 1))
+                is_bool = [i for i in candidates if isinstance(raw[i], (bool, np.bool_))]
+                numbers[is_bool] = np.nan
+            fail(np.isnan(numbers) & ~missing, lambda rows: [field.invalid(raw[i]) for i in rows])
+
+        fail(np.isinf(numbers), lambda rows: [field.invalid(raw[i]) for i in rows])
+        with np.errstate(invalid='ignore'):
+            out_of_range = np.zeros(len(numbers), dtype=bool)
+            if field.min_value is not None:
+                out_of_range |= numbers < field.min_value
+            if field.max_value is not None:
+                out_of_range |= numbers > field.max_value
+            fail(out_of_range, lambda rows: [field.invalid(raw[i], field.out_of_range(numbers[i])) for i in rows])
+        return numbers
+
+    @staticmethod
+    def _validate_strings(field: Field, values: pd.Series, missing: np.ndarray, fail):
+        if pd.api.types.infer_dtype(values, skipna=True) in _STRING_KINDS:
+            strings = values
+        else:
+            # Numeric IDs are fine, objects, lists and booleans are not
+            raw = values.to_numpy(dtype=object, na_value=None)
+            wrong_type = np.fromiter(
+                (not isinstance(value, _STRING_SCALARS) or isinstance(value, (bool, np.bool_)) for value in raw),
+                dtype=bool, count=len(raw))
+            fail(wrong_type & ~missing, lambda rows: [field.invalid(raw[i]) for i in rows])
+            strings = pd.Series([None if value is None else _id_text(value) for value in raw],
+                                index=values.index, dtype=object)
+        fail((strings == '').to_numpy(dtype=bool, na_value=False), field.invalid('', 'must not be empty'))
+        return strings.array
+
+    # Single items
+
+    def coerce(self, item: Dict[str, Any]) -> Tuple:
+        """
+        The coerced values of one item, in field order. Raises ValueError
+        with the same message ``validate`` would give the item's row.
+        """
+        values: List[Any] = []
+        for field in self.fields:
+            value = item.get(field.name)
+            if _is_missing(value):
+                if field.required:
+                    raise ValueError(field.missing())
+                values.append(np.nan if field.kind == NUMBER else None)
+                continue
+
+            if field.kind == NUMBER:
+                if isinstance(value, (bool, np.bool_)):
+                    raise ValueError(field.invalid(value))
+                # float() also reads '1_000' and non-ASCII digits, which batches (pd.to_numeric) reject
+                if isinstance(value, str) and ('_' in value or not value.isascii()):
+                    raise ValueError(field.invalid(value))
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(field.invalid(value)) from None
+                if not math.isfinite(number):
+                    raise ValueError(field.invalid(value))
+                detail = field.out_of_range(number)
+                if detail:
+                    raise ValueError(field.invalid(value, detail))
+                values.append(number)
+            else:
+                if not isinstance(value, _STRING_SCALARS) or isinstance(value, (bool, np.bool_)):
+                    raise ValueError(field.invalid(value))
+                text = _id_text(value)
+                if text == '':
+                    raise ValueError(field.invalid('', 'must not be empty'))
+                values.append(text)
+        return tuple(values)
+
+
+# Inputs of the demand model
+DEMAND_SCHEMA = Schema([
+    Field('Store ID', STRING),
+    Field('Product ID', STRING),
+    # Negative levels (backorders) are scored as they are
+    Field('Inventory Level', NUMBER),
+])
@@ -0,0 +1,435 @@
+"""
+Demand model classes shared by the API, the command-line tools and workers.
+
+Kept free of Flask so batch workers, CLIs and tests can load and run the
+model without importing ``app``.
+"""
+
+import __main__
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from compiled_model import EVALUATORS, CompiledDemandModel
+from config import env_flag
+from input_schema import DEMAND_SCHEMA
+from micro_batching import MicroBatcher
+from model_artifacts import is_artifact, load_artifact
+from prediction_cache import PredictionCache
+
+logger = logging.getLogger(__name__)
+
+LEGACY_MODEL_PATH = 'demand_model.pkl'
+ARTIFACT_MODEL_PATH = 'demand_model'
+
+
+def default_model_path(inference_mode: str = None) -> str:
+    """
+    $MODEL_PATH, else the converted artifact if present, else the pickle.
+    Pipeline mode prefers the pickle, since artifacts hold no pipeline.
+    """
+    if os.environ.get('MODEL_PATH'):
+        return os.environ['MODEL_PATH']
+    inference_mode = inference_mode or os.environ.get('INFERENCE_MODE', 'booster')
+    if inference_mode == 'pipeline' and os.path.exists(LEGACY_MODEL_PATH):
+        return LEGACY_MODEL_PATH
+    return ARTIFACT_MODEL_PATH if is_artifact(ARTIFACT_MODEL_PATH) else LEGACY_MODEL_PATH
+
+
+def run_model(runtime, df: pd.DataFrame) -> np.ndarray:
+    """
+    ``runtime.predict(df)``. A pipeline is run step by step so the regressor
+    shows up as its own stage in the metrics.
+    """
+    if isinstance(runtime, CompiledDemandModel):
+        return runtime.predict(df)
+    X = df
+    for _, step in runtime.steps[:-1]:
+        X = step.transform(X)
+    started = metrics.clock()
+    predictions = runtime.steps[-1][1].predict(X)
+    metrics.lap('predict', started)
+    return predictions
+
+
+class SimplePreprocessor:
+    def __init__(self):
+        # Only needed when fitting a new model; unpickling and the compiled
+        # path never construct one, so keep scikit-learn off the import path
+        from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+        self.store_encoder = LabelEncoder()
+        self.product_encoder = LabelEncoder()
+        self.scaler = StandardScaler()
+        self.fitted = False
+        self._build_lookups()
+
+    def __getstate__(self):
+        # The lookup tables are derived from the encoders, so they are left out
+        # of the pickle to keep the artifact layout identical to older models.
+        state = self.__dict__.copy()
+        state.pop('_store_lookup', None)
+        state.pop('_product_lookup', None)
+        return state
+
+    def __setstate__(self, state):
+        # Models pickled before the lookup tables existed only carry the
+        # encoders, so rebuild the tables whenever a pipeline is unpickled.
+        self.__dict__.update(state)
+        self._build_lookups()
+
+    def _build_lookups(self):
+        """Build hash maps from category label to encoded class index."""
+        self._store_lookup = self._class_lookup(self.store_encoder)
+        self._product_lookup = self._class_lookup(self.product_encoder)
+
+    @staticmethod
+    def _class_lookup(encoder) -> Dict[str, int]:
+        classes = getattr(encoder, 'classes_', None)
+        if classes is None:
+            return {}
+        return {label: index for index, label in enumerate(classes.tolist())}
+
+    @staticmethod
+    def _encode(values: pd.Series, lookup: Dict[str, int]) -> np.ndarray:
+        # Unknown categories map to the first class seen during training
+        return values.astype(str).map(lookup).fillna(0).to_numpy(dtype=np.int64)
+
+    def fit(self, X, y=None):
+        # Encode categorical features
+        self.store_encoder.fit(X['Store ID'].astype(str))
+        self.product_encoder.fit(X['Product ID'].astype(str))
+        self._build_lookups()
+
+        # Create encoded dataframe for scaling
+        X_encoded = X.copy()
+        X_encoded['Store ID'] = self.store_encoder.transform(X['Store ID'].astype(str))
+        X_encoded['Product ID'] = self.product_encoder.transform(X['Product ID'].astype(str))
+
+        # Fit scaler on all features
+        self.scaler.fit(X_encoded)
+        self.fitted = True
+        return self
+
+    def transform(self, X):
+        if not self.fitted:
+            raise ValueError("Preprocessor not fitted yet")
+
+        started = metrics.clock()
+        X_encoded = X.copy()
+
+        # Map whole columns through the lookup tables in a single pass
+        X_encoded['Store ID'] = self._encode(X['Store ID'], self._store_lookup)
+        X_encoded['Product ID'] = self._encode(X['Product ID'], self._product_lookup)
+        started = metrics.lap('preprocess', started)
+
+        scaled = self.scaler.transform(X_encoded)
+        metrics.lap('scale', started)
+        return scaled
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).transform(X)
+
+# demand_model.pkl was pickled from a notebook, so it references
+# __main__.SimplePreprocessor. Make that resolvable when this module is
+# imported by a WSGI server or another script instead of run directly.
+if not hasattr(__main__, 'SimplePreprocessor'):
+    __main__.SimplePreprocessor = SimplePreprocessor
+
+class InventoryPredictor:
+    CANARY_INPUT = {'Store ID': 'S001', 'Product ID': 'P0001', 'Inventory Level': 100}
+
+    INFERENCE_MODES = ('pipeline',) + EVALUATORS
+
+    def __init__(self, model_path: str = None, cache: PredictionCache = None,
+                 model_version: str = None, inference_mode: str = None, batcher: MicroBatcher = None,
+                 load: bool = True):
+        """
+        Initialize the inventory predictor with the trained model. With
+        ``load=False`` the model is left for a later ``load_model()`` call.
+        """
+        self.inference_mode = inference_mode or os.environ.get('INFERENCE_MODE', 'booster')
+        if self.inference_mode not in self.INFERENCE_MODES:
+            raise ValueError(f"INFERENCE_MODE must be one of: {', '.join(self.INFERENCE_MODES)}")
+        self.model_path = model_path or default_model_path(self.inference_mode)
+        self.model = None
+        # What predictions actually run through: the compiled fast path, or
+        # the pipeline itself if compiling is disabled or fails its parity check
+        self.runtime = None
+        self.active_inference_mode = None
+        self.model_version = model_version
+        self.model_loaded_at = None
+        self.model_load_seconds = None
+        self.cache = cache if cache is not None else PredictionCache(
+            max_size=int(os.environ.get('PREDICTION_CACHE_SIZE', 10000)),
+            ttl_seconds=float(os.environ.get('PREDICTION_CACHE_TTL', 300))
+        )
+        # Coalesces concurrent single predictions into one model call
+        self.batcher = batcher
+        if batcher is None and env_flag('MICRO_BATCHING'):
+            self.batcher = MicroBatcher(
+                self._predict_rows,
+                max_batch_size=int(os.environ.get('MICRO_BATCH_MAX_SIZE', 64)),
+                max_wait_ms=float(os.environ.get('MICRO_BATCH_WAIT_MS', 2))
+            )
+        # Sketches of the served inputs and predictions (see drift.py); set by the server
+        self.drift = None
+        if load:
+            self.load_model()
+
+    def load_model(self):
+        """Load the trained demand forecasting model."""
+        try:
+            start = time.perf_counter()
+            model = self.read_model(self.model_path)
+            self.swap_model(
+                model,
+                version=self.model_version or os.path.basename(self.model_path),
+                load_seconds=time.perf_counter() - start
+            )
+            logger.info(f"Model loaded successfully from {self.model_path}")
+        except Exception as e:
+            logger.error(f"Error loading model: {str(e)}")
+            raise e
+
+    def read_model(self, model_path: str):
+        """Load a model artifact without touching the live model."""
+        if not os.path.exists(model_path):
+            logger.error(f"Model file not found: {model_path}")
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        if is_artifact(model_path):
+            evaluator = self.inference_mode
+            if evaluator == 'pipeline':
+                # /health reports the mode actually in use
+                logger.warning(f"INFERENCE_MODE=pipeline needs a pickled pipeline, but {model_path} "
+                               f"is an artifact; using the booster")
+                evaluator = 'booster'
+            return load_artifact(model_path, evaluator=evaluator)
+
+        # Legacy pickled pipeline; only this path needs joblib and scikit-learn
+        import joblib
+        return joblib.load(model_path)
+
+    def warm_up(self, model) -> float:
+        """Run a canary prediction through ``model`` and return its output."""
+        df = self.prepare_input_data(self.CANARY_INPUT)
+        prediction = float(model.predict(df)[0])
+        if not np.isfinite(prediction):
+            raise ValueError(f"Canary prediction is not finite: {prediction}")
+        return prediction
+
+    def compile_model(self, model) -> Tuple[Any, str]:
+        """
+        Build the fast-path runtime for ``model``. Falls back to the pipeline
+        when it can't be compiled or doesn't match ``model.predict``.
+        """
+        if isinstance(model, CompiledDemandModel):
+            # Artifacts are stored compiled; they were verified on conversion
+            return model, model.evaluator
+        if self.inference_mode == 'pipeline':
+            return model, 'pipeline'
+        try:
+            compiled = CompiledDemandModel.from_pipeline(model, evaluator=self.inference_mode)
+            ok, max_diff = compiled.check_parity(model)
+            if not ok:
+                raise ValueError(f"compiled predictions differ from the pipeline by up to {max_diff}")
+            return compiled, self.inference_mode
+        except Exception as e:
+            logger.warning(f"Compiled inference unavailable, using the pipeline: {str(e)}")
+            return model, 'pipeline'
+
+    def swap_model(self, model, version: str, model_path: str = None, load_seconds: float = None):
+        """Atomically replace the live model; in-flight requests keep the old one."""
+        reloading = self.model is not None
+        runtime, mode = self.compile_model(model)
+        self.model = model
+        self.runtime = runtime
+        self.active_inference_mode = mode
+        if model_path is not None:
+            self.model_path = model_path
+        self.model_version = version
+        self.model_loaded_at = datetime.now()
+        self.model_load_seconds = load_seconds
+        # Cached predictions belong to the previous model
+        if reloading:
+            self.cache.clear()
+
+    def category_lookups(self, runtime=None) -> Dict[str, Dict[str, int]]:
+        """Class index of every Store and Product ID ``runtime`` (default: the live model) was trained on."""
+        runtime = runtime if runtime is not None else self.runtime
+        if isinstance(runtime, CompiledDemandModel):
+            return {'Store ID': runtime.store_lookup, 'Product ID': runtime.product_lookup}
+        preprocessor = runtime.named_steps['preprocessor']
+        return {'Store ID': preprocessor._store_lookup, 'Product ID': preprocessor._product_lookup}
+
+    def prepare_input_data(self, input_data: Dict) -> pd.DataFrame:
+        """
+        Prepare input data for prediction based on your model's expected features.
+        Based on your notebook, the simplified model expects:
+        ['Store ID', 'Product ID', 'Inventory Level']
+        """
+        try:
+            # Validate and coerce with the same rules as batches
+            row = DEMAND_SCHEMA.coerce(input_data)
+            return pd.DataFrame([row], columns=DEMAND_SCHEMA.columns)
+            
+        except Exception as e:
+            logger.error(f"Error preparing input data: {str(e)}")
+            raise e
+    
+    @staticmethod
+    def _cache_key(input_data: Dict) -> Tuple[str, str, float]:
+        """The coerced (Store ID, Product ID, Inventory Level); raises ValueError for invalid input."""
+        return DEMAND_SCHEMA.coerce(input_data)
+
+    def predict_demand(self, input_data: Dict) -> float:
+        """Predict demand for given input parameters."""
+        try:
+            # Read the generation before the model so a result computed by a
+            # model that gets swapped out mid-request is never cached
+            generation = self.cache.generation
+            runtime = self.runtime
+            if runtime is None:
+                raise ValueError("Model not loaded")
+
+            # Validated and coerced; invalid input raises ValueError here
+            with metrics.stage('prepare'):
+                key = self._cache_key(input_data)
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug(f"Prediction served from cache: {cached}")
+                if self.drift is not None:
+                    self.drift.observe(key, cached)
+                return cached
+
+            if self.batcher is not None:
+                # Scored together with other requests arriving at the same time
+                prediction = self.batcher.submit(key, group=runtime)
+            elif isinstance(runtime, CompiledDemandModel):
+                # Fast path: the key is already the coerced input row
+                prediction = runtime.predict_one(*key)
+            else:
+                # Make prediction
+                prediction = run_model(runtime, pd.DataFrame([key], columns=DEMAND_SCHEMA.columns))[0]
+
+            # Ensure prediction is not negative
+            prediction = float(max(0, prediction))
+
+            self.cache.put(key, prediction, generation)
+            if self.drift is not None:
+                self.drift.observe(key, prediction)
+
+            logger.info(f"Prediction made: {prediction}")
+            return prediction
+            
+        except Exception as e:
+            logger.error(f"Error making prediction: {str(e)}")
+            raise e
+
+    @staticmethod
+    def _predict_rows(runtime, rows: List[Tuple[str, str, float]]) -> np.ndarray:
+        """Score already coerced (Store ID, Product ID, Inventory Level) rows."""
+        stores, products, inventory = zip(*rows)
+        if isinstance(runtime, CompiledDemandModel):
+            return runtime.predict_features(runtime.encode(stores, products, inventory))
+        return run_model(runtime, pd.DataFrame({
+            'Store ID': stores, 'Product ID': products, 'Inventory Level': inventory
+        }))
+
+    def prepare_batch_frame(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Any, str]]:
+        """
+        Validate and coerce a DataFrame of inputs against ``DEMAND_SCHEMA``.
+
+        Returns the valid rows (keeping ``df``'s index) restricted to the
+        required columns, and a dict of failure reasons keyed by index label.
+        """
+        valid, _, reasons = DEMAND_SCHEMA.validate(df)
+        return valid, reasons
+
+    def prepare_batch_data(self, items: List[Any]) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        Validate and coerce a list of input items column by column.
+
+        Returns a DataFrame of the valid rows, indexed by their position in
+        ``items``, together with a list of per-item errors for the rest.
+        """
+        df, reasons = self._frame_items(items)
+        df, frame_reasons = self.prepare_batch_frame(df)
+        reasons.update(frame_reasons)
+        return df, self._item_errors(items, reasons)
+
+    @staticmethod
+    def _frame_items(items: List[Any], columns: List[str] = None) -> Tuple[pd.DataFrame, Dict[int, str]]:
+        """Frame ``columns`` of the JSON objects in ``items``, indexed by their position."""
+        required_columns = columns or DEMAND_SCHEMA.columns
+        reasons: Dict[int, str] = {}
+
+        records = []
+        positions = []
+        for i, item in enumerate(items):
+            if isinstance(item, dict):
+                records.append(item)
+                positions.append(i)
+            else:
+                reasons[i] = "Item must be a JSON object"
+
+        df = pd.DataFrame.from_records(records, index=positions, columns=required_columns)
+        return df, reasons
+
+    @staticmethod
+    def _item_errors(items: List[Any], reasons: Dict[int, str]) -> List[Dict]:
+        return [
+            {'index': int(i), 'item': items[i], 'error': reasons[i]}
+            for i in sorted(reasons)
+        ]
+
+    def predict_demand_frame(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Any, str]]:
+        """
+        Predict demand for every valid row of ``df`` with a single model call.
+
+        Returns the valid rows with a ``predicted_demand`` column added, and
+        the failure reasons for the rest keyed by index label.
+        """
+        # Hold one reference so a concurrent model swap can't split the batch
+        runtime = self.runtime
+        if runtime is None:
+            raise ValueError("Model not loaded")
+
+        with metrics.stage('prepare'):
+            valid, reasons = self.prepare_batch_frame(df)
+
+        if len(valid) > 0:
+            # Ensure predictions are not negative
+            predictions = np.maximum(run_model(runtime, valid), 0)
+        else:
+            predictions = np.empty(0, dtype=float)
+        if self.drift is not None and len(valid) > 0:
+            self.drift.observe_frame(valid, predictions)
+
+        return valid.assign(predicted_demand=predictions.astype(float)), reasons
+
+    def predict_demand_batch(self, items: List[Any]) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        Predict demand for many items with a single model call.
+
+        Returns the valid rows (indexed by their position in ``items``) with a
+        ``predicted_demand`` column added, and the per-item validation errors.
+        """
+        try:
+            df, reasons = self._frame_items(items)
+            scored, frame_reasons = self.predict_demand_frame(df)
+            reasons.update(frame_reasons)
+            errors = self._item_errors(items, reasons)
+
+            logger.info(f"Batch prediction made: {len(scored)} scored, {len(errors)} rejected")
+            return scored, errors
+
+        except Exception as e:
+            logger.error(f"Error making batch prediction: {str(e)}")
+            raise e
@@ -0,0 +1,364 @@
+"""
+Request and stage metrics in the Prometheus text format.
+
+Counters and latency histograms are aggregated per thread: every thread
+writes only to its own shard, so recording takes no lock, and a scrape of
+``/metrics`` sums the shards. Inside a request, code marks where its time
+goes with::
+
+    started = metrics.clock()
+    ...                                  # e.g. encode the categories
+    started = metrics.lap('preprocess', started)
+
+or ``with metrics.stage('prepare'): ...``. Stages are recorded per route in
+``inventory_api_stage_duration_seconds``; outside a request (CLIs, batch
+workers, background threads) ``lap`` only reads the clock.
+
+Under Gunicorn every worker process has its own metrics. With
+``$METRICS_DIR`` set, each worker also writes a snapshot there every few
+seconds, and ``/metrics`` merges the snapshots of all workers.
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; fine-grained at the low end, where single predictions land
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUESTS_TOTAL = 'inventory_api_requests_total'
+REQUEST_DURATION = 'inventory_api_request_duration_seconds'
+STAGE_DURATION = 'inventory_api_stage_duration_seconds'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SNAPSHOT_PREFIX = 'metrics-'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+clock = time.perf_counter
+
+
+class _Shard:
+    """One thread's counters and histograms. Only that thread writes to it."""
+    __slots__ = ('counters', 'histograms', 'stages')
+
+    def __init__(self):
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # Per-bucket (not cumulative) counts, then the sum and the count
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        # The same rows as the stage histograms, keyed by (route, stage) for lap()
+        self.stages: Dict[Tuple[str, str], List[float]] = {}
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards: List[_Shard] = []
+        self._shards_lock = threading.Lock()
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._gauges: Dict[str, Callable[[], Optional[float]]] = {}
+        self.snapshot_dir: Optional[str] = None
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._descriptions[name] = (kind, help_text)
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], Optional[float]]):
+        """A value read at scrape time (None leaves it out)."""
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = callback
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, labels: Labels, amount: float = 1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: Labels, value: float):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        row = histograms.get(key)
+        if row is None:
+            row = histograms[key] = [0] * (len(self.buckets) + 3)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    # Route of the request the current thread is serving (None outside requests)
+
+    @property
+    def route(self) -> Optional[str]:
+        return getattr(self._local, 'route', None)
+
+    @route.setter
+    def route(self, route: Optional[str]):
+        if route is not None:
+            self._shard()
+        self._local.route = route
+
+    def lap(self, stage: str, started: float) -> float:
+        """Record the time since ``started`` as ``stage`` of the current route; returns the clock."""
+        now = clock()
+        local = self._local
+        route = getattr(local, 'route', None)
+        if route is not None:
+            shard = local.shard
+            row = shard.stages.get((route, stage))
+            if row is None:
+                row = shard.stages[(route, stage)] = [0] * (len(self.buckets) + 3)
+                shard.histograms[(STAGE_DURATION, (('route', route), ('stage', stage)))] = row
+            elapsed = now - started
+            row[bisect.bisect_left(self.buckets, elapsed)] += 1
+            row[-2] += elapsed
+            row[-1] += 1
+        return now
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, Labels], Any]]:
+        """This process's counters and histograms, summed over threads."""
+        counters: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # list() copies under the GIL, so a thread adding a key can't break the iteration
+            for key, value in list(shard.counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, row in list(shard.histograms.items()):
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = list(row)
+                else:
+                    for i, value in enumerate(row):
+                        total[i] += value
+        return {'counters': counters, 'histograms': histograms}
+
+    def _gauge_values(self) -> Dict[str, float]:
+        values = {}
+        for name, callback in self._gauges.items():
+            try:
+                value = callback()
+            except Exception as e:
+                logger.debug(f"Gauge {name} failed: {str(e)}")
+                continue
+            if value is not None:
+                values[name] = float(value)
+        return values
+
+    # Multi-process mode
+
+    def write_snapshot(self):
+        """Write this process's metrics to ``snapshot_dir`` for the other workers' scrapes."""
+        snapshot = self.snapshot()
+        data = {
+            'pid': os.getpid(),
+            'counters': [[name, list(labels), value] for (name, labels), value in snapshot['counters'].items()],
+            'histograms': [[name, list(labels), row] for (name, labels), row in snapshot['histograms'].items()],
+            'gauges': self._gauge_values(),
+        }
+        path = os.path.join(self.snapshot_dir, f"{SNAPSHOT_PREFIX}{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def start_snapshots(self, directory: str, interval_seconds: float = 5.0):
+        """Write a snapshot every ``interval_seconds`` from a daemon thread (call once per worker)."""
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_dir = directory
+
+        def flush():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.write_snapshot()
+                except Exception as e:
+                    logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+        threading.Thread(target=flush, name='metrics-snapshot', daemon=True).start()
+
+    def _other_processes(self) -> List[Dict[str, Any]]:
+        if not self.snapshot_dir or not os.path.isdir(self.snapshot_dir):
+            return []
+        snapshots = []
+        for name in os.listdir(self.snapshot_dir):
+            if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.snapshot_dir, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get('pid') != os.getpid():
+                snapshots.append(data)
+        return snapshots
+
+    # Exposition
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        snapshot = self.snapshot()
+        counters, histograms = snapshot['counters'], snapshot['histograms']
+        gauges: Dict[Tuple[str, Labels], float] = {}
+        others = self._other_processes()
+        pid_label = (('pid', str(os.getpid())),) if others else ()
+        for name, value in self._gauge_values().items():
+            gauges[(name, pid_label)] = value
+
+        for data in others:
+            for name, labels, value in data['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, row in data['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.get(key)
+                if total is None or len(total) != len(row):
+                    histograms[key] = list(row)
+                else:
+                    for i, value in enumerate(row):
+                        total[i] += value
+            # Counters of exited workers still count; their gauges don't
+            if _alive(data['pid']):
+                for name, value in data['gauges'].items():
+                    gauges[(name, (('pid', str(data['pid'])),))] = value
+
+        lines: List[str] = []
+        by_name: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(counters.items()):
+            by_name.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), value in sorted(gauges.items()):
+            by_name.setdefault(name, []).append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), row in sorted(histograms.items()):
+            samples = by_name.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), row):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append(f"{name}_bucket{_labels(labels + (('le', le),))} {_number(cumulative)}")
+            samples.append(f"{name}_sum{_labels(labels)} {repr(float(row[-2]))}")
+            samples.append(f"{name}_count{_labels(labels)} {_number(row[-1])}")
+
+        for name in sorted(by_name):
+            kind, help_text = self._descriptions.get(name, ('untyped', ''))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(by_name[name])
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in labels) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current resident set size (Linux), else None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe(REQUESTS_TOTAL, 'counter', 'HTTP requests by route, method and status')
+REGISTRY.describe(REQUEST_DURATION, 'histogram', 'HTTP request latency by route')
+REGISTRY.describe(STAGE_DURATION, 'histogram',
+                  'Time spent per request stage (parse, prepare, preprocess, scale, predict, serialize) by route')
+REGISTRY.gauge('inventory_api_process_resident_memory_bytes', 'Resident memory of the serving process',
+               resident_memory_bytes)
+
+
+def lap(stage: str, started: float) -> float:
+    return REGISTRY.lap(stage, started)
+
+
+class stage:
+    """``with stage('prepare'):`` records the block as a stage of the current request."""
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        REGISTRY.lap(self.name, self.started)
+        return False
+
+
+def instrument(app, registry: MetricsRegistry = REGISTRY):
+    """Count and time every request of a Flask app and time its JSON parsing and serialization."""
+    from flask import request
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def loads(self, s, **kwargs):
+            started = clock()
+            try:
+                return super().loads(s, **kwargs)
+            finally:
+                registry.lap('parse', started)
+
+        def dumps(self, obj, **kwargs):
+            started = clock()
+            try:
+                return super().dumps(obj, **kwargs)
+            finally:
+                registry.lap('serialize', started)
+
+    provider = TimedJSONProvider(app)
+    # Keep the app's JSON settings (e.g. sort_keys)
+    provider.__dict__.update({key: value for key, value in vars(app.json).items() if key != '_app'})
+    app.json = provider
+
+    @app.before_request
+    def _start_request():
+        registry.route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        registry._local.request_started = clock()
+
+    @app.after_request
+    def _finish_request(response):
+        route = registry.route
+        if route is not None:
+            registry.inc(REQUESTS_TOTAL, (('route', route), ('method', request.method),
+                                          ('status', str(response.status_code))))
+            registry.observe(REQUEST_DURATION, (('route', route),), clock() - registry._local.request_started)
+        return response
+
+    @app.teardown_request
+    def _end_request(error):
+        # Work the thread does after the request isn't attributed to it
+        registry.route = None
@@ -0,0 +1,168 @@
+"""
+Micro-batching for concurrent single-row predictions.
+
+Requests hand their row to ``MicroBatcher.submit`` and block. A dedicated
+inference thread collects the rows that arrive within a short window (or
+until the batch is full), scores them with one vectorised model call and
+wakes every waiting request with its own result.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+
+class Histogram:
+    """Counts of observed values per bucket, for JSON stats."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self._counts[i] += 1
+        self._count += 1
+        self._sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        bounds = [bound for bound in self.bounds] + ['+Inf']
+        return {
+            'buckets': [{'le': bound, 'count': count} for bound, count in zip(bounds, self._counts)],
+            'count': self._count,
+            'sum': self._sum,
+            'mean': round(self._sum / self._count, 3) if self._count else None
+        }
+
+
+def power_of_two_bounds(limit: int) -> List[int]:
+    bounds = [1]
+    while bounds[-1] < limit:
+        bounds.append(bounds[-1] * 2)
+    return bounds
+
+
+class _Pending:
+    __slots__ = ('group', 'row', 'done', 'result', 'error')
+
+    def __init__(self, group: Any, row: Any):
+        self.group = group
+        self.row = row
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent ``submit`` calls into batches.
+
+    ``predict_fn(group, rows)`` scores a list of rows and returns one result
+    per row. Rows are only batched with rows submitted for the same ``group``
+    (the predictor passes its current model, so a hot swap never mixes two
+    models in one call).
+    """
+
+    def __init__(self, predict_fn: Callable[[Any, List[Any]], Sequence[Any]], max_batch_size: int = 64,
+                 max_wait_ms: float = 2.0, timeout_seconds: float = 30.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait_seconds = max(0.0, float(max_wait_ms)) / 1000
+        self.timeout_seconds = timeout_seconds
+        self._queue: "deque[_Pending]" = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self._batch_sizes = Histogram(power_of_two_bounds(self.max_batch_size))
+        self._queue_depths = Histogram(power_of_two_bounds(max(self.max_batch_size * 4, 256)))
+        self._batches = 0
+        self._rows = 0
+        self._failed_batches = 0
+        self._predict_seconds = 0.0
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork (threads don't survive one)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, row: Any, group: Hashable = None) -> Any:
+        """Queue ``row`` for the next batch and wait for its result."""
+        pending = _Pending(group, row)
+        with self._cond:
+            self._ensure_started()
+            self._queue.append(pending)
+            self._queue_depths.observe(len(self._queue))
+            self._cond.notify()
+
+        if not pending.done.wait(self.timeout_seconds):
+            raise TimeoutError(f"Prediction not scheduled within {self.timeout_seconds}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self) -> List[_Pending]:
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            # The window starts with the oldest waiting row
+            deadline = time.monotonic() + self.max_wait_seconds
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            groups: Dict[int, List[_Pending]] = {}
+            for pending in batch:
+                groups.setdefault(id(pending.group), []).append(pending)
+
+            start = time.perf_counter()
+            for members in groups.values():
+                try:
+                    results = self.predict_fn(members[0].group, [pending.row for pending in members])
+                    for pending, result in zip(members, results):
+                        pending.result = result
+                except BaseException as e:
+                    self._failed_batches += 1
+                    for pending in members:
+                        pending.error = e
+                finally:
+                    for pending in members:
+                        pending.done.set()
+
+            self._predict_seconds += time.perf_counter() - start
+            self._batches += 1
+            self._rows += len(batch)
+            self._batch_sizes.observe(len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            queue_depth = len(self._queue)
+        return {
+            'enabled': True,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_seconds * 1000,
+            'queue_depth': queue_depth,
+            'batches': self._batches,
+            'rows': self._rows,
+            'failed_batches': self._failed_batches,
+            'mean_batch_size': round(self._rows / self._batches, 3) if self._batches else None,
+            'predict_seconds': round(self._predict_seconds, 6),
+            'batch_size_histogram': self._batch_sizes.snapshot(),
+            'queue_depth_histogram': self._queue_depths.snapshot()
+        }
@@ -0,0 +1,286 @@
+"""
+Pickle-free model artifacts.
+
+An artifact is a directory::
+
+    demand_model/
+        manifest.json       # kind, format version, encoder classes / feature names
+        booster.txt         # LightGBM native text model
+        scaler_mean.npy     # StandardScaler parameters
+        scaler_scale.npy
+        trees/*.npy         # flattened trees for the NumPy evaluator (demand models)
+
+Loading never unpickles anything (arrays are read with allow_pickle=False),
+the arrays are memory-mapped, and neither scikit-learn nor ``app`` has to be
+imported. A demand model loaded for the NumPy evaluator doesn't even need
+LightGBM.
+
+Usage:
+    python model_artifacts.py convert demand_model.pkl sales_model.pkl
+    python model_artifacts.py convert demand_model.pkl -o models/v2/demand_model
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from compiled_model import CompiledDemandModel, TreeEnsemble
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+BOOSTER_FILE = 'booster.txt'
+TREES_DIR = 'trees'
+KIND_DEMAND = 'demand'
+KIND_SCALED_REGRESSOR = 'scaled_regressor'
+
+
+def is_artifact(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+class ScaledRegressor:
+    """A StandardScaler + LightGBM regressor pipeline (the layout of sales_model.pkl)."""
+
+    def __init__(self, feature_names: List[str], mean: np.ndarray, scale: np.ndarray, booster,
+                 num_iteration: Optional[int] = None):
+        self.feature_names = list(feature_names)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.booster = booster
+        self.num_iteration = num_iteration
+
+    @classmethod
+    def from_pipeline(cls, pipeline) -> 'ScaledRegressor':
+        steps = getattr(pipeline, 'named_steps', {})
+        scaler = steps.get('scaler')
+        regressor = steps.get('regressor')
+        if scaler is None or not hasattr(scaler, 'mean_') or not hasattr(regressor, 'booster_'):
+            raise TypeError("Expected a StandardScaler + LGBMRegressor pipeline")
+
+        n_features = scaler.n_features_in_
+        feature_names = getattr(scaler, 'feature_names_in_', None)
+        booster = regressor.booster_
+        best_iteration = getattr(booster, 'best_iteration', 0)
+        return cls(
+            feature_names=list(feature_names) if feature_names is not None else [f"x{i}" for i in range(n_features)],
+            mean=scaler.mean_ if scaler.with_mean else np.zeros(n_features),
+            scale=scaler.scale_ if scaler.with_std else np.ones(n_features),
+            booster=booster,
+            num_iteration=best_iteration if best_iteration > 0 else None
+        )
+
+    def predict(self, X) -> np.ndarray:
+        """Predict from a DataFrame with ``feature_names`` columns or an array in that order."""
+        if isinstance(X, pd.DataFrame):
+            missing = [col for col in self.feature_names if col not in X.columns]
+            if missing:
+                raise ValueError(f"Missing required features: {', '.join(missing)}")
+            X = X[self.feature_names]
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError(f"Expected {len(self.feature_names)} features, got shape {X.shape}")
+        started = metrics.clock()
+        X = (X - self.mean) / self.scale
+        started = metrics.lap('scale', started)
+        predictions = self.booster.predict(X, num_iteration=self.num_iteration)
+        metrics.lap('predict', started)
+        return predictions
+
+
+def _classes(lookup: Dict[str, int]) -> List[str]:
+    return [label for label, _ in sorted(lookup.items(), key=lambda item: item[1])]
+
+
+def _save_array(path: str, values: np.ndarray):
+    np.save(path, np.ascontiguousarray(values), allow_pickle=False)
+
+
+def _load_array(path: str, mmap: bool) -> np.ndarray:
+    return np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+
+
+def _write_artifact(model, path: str, source: Optional[str]) -> Dict[str, Any]:
+    import lightgbm
+
+    os.makedirs(path)
+    model.booster.save_model(os.path.join(path, BOOSTER_FILE), num_iteration=model.num_iteration)
+    _save_array(os.path.join(path, 'scaler_mean.npy'), model.mean)
+    _save_array(os.path.join(path, 'scaler_scale.npy'), model.scale)
+
+    manifest: Dict[str, Any] = {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(),
+        'source': source,
+        'lightgbm_version': lightgbm.__version__,
+        'booster': BOOSTER_FILE,
+        # The booster file is already cut to num_iteration
+        'num_iteration': None
+    }
+    if isinstance(model, CompiledDemandModel):
+        trees = model.trees or TreeEnsemble.from_booster(model.booster, model.num_iteration)
+        os.makedirs(os.path.join(path, TREES_DIR))
+        for name in TreeEnsemble.ARRAYS:
+            _save_array(os.path.join(path, TREES_DIR, f"{name}.npy"), getattr(trees, name))
+        manifest.update({
+            'kind': KIND_DEMAND,
+            'store_classes': _classes(model.store_lookup),
+            'product_classes': _classes(model.product_lookup),
+            'tree_depth': trees.depth
+        })
+    else:
+        manifest.update({
+            'kind': KIND_SCALED_REGRESSOR,
+            'feature_names': model.feature_names
+        })
+
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def export_model(model, path: str, source: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write ``model`` (a demand or sales pipeline, or an already compiled
+    model) as an artifact directory at ``path``, replacing any existing one.
+    """
+    if not isinstance(model, (CompiledDemandModel, ScaledRegressor)):
+        try:
+            model = CompiledDemandModel.from_pipeline(model)
+        except TypeError:
+            model = ScaledRegressor.from_pipeline(model)
+
+    # Build the whole directory next to the target so readers never see a
+    # half-written artifact
+    path = os.path.normpath(path)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    manifest = _write_artifact(model, tmp_path, source)
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    logger.info(f"Wrote {manifest['kind']} artifact to {path}")
+    return manifest
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version', 0) > FORMAT_VERSION:
+        raise ValueError(f"Artifact format {manifest.get('format_version')} is newer than supported ({FORMAT_VERSION})")
+    return manifest
+
+
+def load_artifact(path: str, evaluator: str = 'booster', mmap: bool = True):
+    """
+    Load an artifact directory as a CompiledDemandModel or ScaledRegressor.
+    ``mmap`` memory-maps the arrays instead of reading them into memory.
+    """
+    manifest = read_manifest(path)
+    mean = _load_array(os.path.join(path, 'scaler_mean.npy'), mmap)
+    scale = _load_array(os.path.join(path, 'scaler_scale.npy'), mmap)
+
+    booster = None
+    if manifest['kind'] != KIND_DEMAND or evaluator != 'numpy':
+        import lightgbm
+        booster = lightgbm.Booster(model_file=os.path.join(path, manifest['booster']))
+
+    if manifest['kind'] == KIND_DEMAND:
+        trees = None
+        if evaluator == 'numpy':
+            arrays = {name: _load_array(os.path.join(path, TREES_DIR, f"{name}.npy"), mmap)
+                      for name in TreeEnsemble.ARRAYS}
+            trees = TreeEnsemble(depth=manifest['tree_depth'], **arrays)
+        return CompiledDemandModel(
+            store_lookup={label: index for index, label in enumerate(manifest['store_classes'])},
+            product_lookup={label: index for index, label in enumerate(manifest['product_classes'])},
+            mean=mean, scale=scale, booster=booster, num_iteration=manifest['num_iteration'],
+            evaluator=evaluator, trees=trees
+        )
+    if manifest['kind'] == KIND_SCALED_REGRESSOR:
+        return ScaledRegressor(manifest['feature_names'], mean, scale, booster, manifest['num_iteration'])
+    raise ValueError(f"Unknown artifact kind: {manifest['kind']}")
+
+
+def verify_artifact(pipeline, path: str, rows: int = 2000, seed: int = 0) -> float:
+    """
+    Check every way of loading the artifact against ``pipeline.predict``.
+    Returns the largest absolute difference; raises ValueError on mismatch.
+    """
+    manifest = read_manifest(path)
+    if manifest['kind'] == KIND_DEMAND:
+        max_diff = 0.0
+        for evaluator in ('booster', 'numpy'):
+            ok, diff = load_artifact(path, evaluator=evaluator).check_parity(pipeline)
+            if not ok:
+                raise ValueError(f"{path} ({evaluator}) differs from the pipeline by up to {diff}")
+            max_diff = max(max_diff, diff)
+        return max_diff
+
+    model = load_artifact(path)
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(model.mean + model.scale * rng.standard_normal((rows, len(model.feature_names))),
+                     columns=model.feature_names)
+    expected = pipeline.predict(X)
+    actual = model.predict(X)
+    max_diff = float(np.max(np.abs(actual - expected)))
+    if not np.allclose(actual, expected, rtol=1e-6, atol=1e-6):
+        raise ValueError(f"{path} differs from the pipeline by up to {max_diff}")
+    return max_diff
+
+
+def convert(pkl_path: str, output_path: Optional[str] = None) -> str:
+    """Convert a joblib pipeline to an artifact directory and verify it."""
+    import joblib
+    # Registers __main__.SimplePreprocessor, which demand_model.pkl refers to
+    import inventory_model  # noqa: F401
+
+    output_path = output_path or os.path.splitext(pkl_path)[0]
+    start = time.perf_counter()
+    pipeline = joblib.load(pkl_path)
+    pickle_seconds = time.perf_counter() - start
+
+    export_model(pipeline, output_path, source=os.path.basename(pkl_path))
+    max_diff = verify_artifact(pipeline, output_path)
+
+    start = time.perf_counter()
+    load_artifact(output_path)
+    artifact_seconds = time.perf_counter() - start
+    print(f"{pkl_path} -> {output_path}: max abs diff {max_diff:.3g}, "
+          f"load {pickle_seconds * 1000:.1f} ms (joblib) vs {artifact_seconds * 1000:.1f} ms (artifact)")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert pickled models to pickle-free artifacts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='Convert .pkl pipelines to artifact directories')
+    convert_parser.add_argument('models', nargs='+', help='Pickled pipelines, e.g. demand_model.pkl sales_model.pkl')
+    convert_parser.add_argument('-o', '--output', help='Artifact directory (single model only; default: name without .pkl)')
+
+    args = parser.parse_args()
+    if args.command == 'convert':
+        if args.output and len(args.models) > 1:
+            parser.error('--output can only be used with a single model')
+        for pkl_path in args.models:
+            convert(pkl_path, args.output)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,262 @@
+"""
+Versioned model registry with background (hot) activation.
+
+Registry layout::
+
+    models/
+        ACTIVE                    # name of the active version
+        v1/demand_model.pkl       # legacy pickled pipeline
+        v2/demand_model/          # artifact directory (see model_artifacts.py)
+
+Usage:
+    python model_registry.py list
+    python model_registry.py register v2 path/to/demand_model
+    python model_registry.py register v2 path/to/demand_model.pkl
+"""
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from model_artifacts import is_artifact
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_NAME = 'demand_model.pkl'
+ARTIFACT_DIR_NAME = 'demand_model'
+ACTIVE_FILE = 'ACTIVE'
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+class ModelRegistry:
+    """Directory of versioned model artifacts plus a pointer to the active one."""
+
+    def __init__(self, root: str = 'models'):
+        self.root = root
+
+    @staticmethod
+    def validate_version(version: Any) -> str:
+        if not isinstance(version, str) or not VERSION_PATTERN.match(version):
+            raise ValueError(f"Invalid model version: {version!r}")
+        return version
+
+    def artifact_path(self, version: str) -> str:
+        """The version's artifact directory if it has one, else its pickle."""
+        version_dir = os.path.join(self.root, self.validate_version(version))
+        artifact_dir = os.path.join(version_dir, ARTIFACT_DIR_NAME)
+        if is_artifact(artifact_dir):
+            return artifact_dir
+        return os.path.join(version_dir, ARTIFACT_NAME)
+
+    def has_version(self, version: str) -> bool:
+        try:
+            path = self.artifact_path(version)
+        except ValueError:
+            return False
+        return is_artifact(path) or os.path.isfile(path)
+
+    @staticmethod
+    def _size_bytes(path: str) -> int:
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(folder, name))
+                   for folder, _, names in os.walk(path) for name in names)
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        """List every version that has an artifact, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        versions = []
+        for name in os.listdir(self.root):
+            if not self.has_version(name):
+                continue
+            path = self.artifact_path(name)
+            stat = os.stat(path)
+            versions.append({
+                'version': name,
+                'path': path,
+                'format': 'artifact' if is_artifact(path) else 'pickle',
+                'size_bytes': self._size_bytes(path),
+                'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+            })
+        return sorted(versions, key=lambda v: v['modified'])
+
+    def register(self, version: str, source_path: str, overwrite: bool = False) -> str:
+        """Copy a pickle or artifact directory into the registry under ``version``."""
+        if self.has_version(version) and not overwrite:
+            raise FileExistsError(f"Model version already registered: {version}")
+        version_dir = os.path.join(self.root, self.validate_version(version))
+        os.makedirs(version_dir, exist_ok=True)
+
+        # Copy next to the target first so readers never see a partial file
+        if is_artifact(source_path):
+            target = os.path.join(version_dir, ARTIFACT_DIR_NAME)
+            tmp_path = f"{target}.tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.copytree(source_path, tmp_path)
+            shutil.rmtree(target, ignore_errors=True)
+        else:
+            target = os.path.join(version_dir, ARTIFACT_NAME)
+            tmp_path = f"{target}.tmp"
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, target)
+        logger.info(f"Registered model version {version} from {source_path}")
+        return target
+
+    def get_active_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version if self.has_version(version) else None
+
+    def set_active_version(self, version: str):
+        self.validate_version(version)
+        os.makedirs(self.root, exist_ok=True)
+        active_path = os.path.join(self.root, ACTIVE_FILE)
+        tmp_path = f"{active_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, active_path)
+
+
+class ModelActivator:
+    """
+    Loads and warms a registry version in a background thread, then swaps it
+    into the live predictor. Requests keep using the current model until the
+    new one has passed its canary prediction.
+    """
+
+    def __init__(self, predictor, registry: ModelRegistry):
+        self.predictor = predictor
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._status: Dict[str, Any] = {'state': 'idle'}
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def busy(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._status)
+
+    def _set_status(self, **status):
+        with self._lock:
+            self._status = status
+
+    def activate(self, version: str, persist: bool = True, wait: bool = False) -> Dict[str, Any]:
+        """
+        Start activating ``version``. Raises FileNotFoundError for unknown
+        versions and RuntimeError if another activation is still running.
+        """
+        if not self.registry.has_version(version):
+            raise FileNotFoundError(f"Model version not found: {version}")
+        with self._lock:
+            if self.busy:
+                raise RuntimeError(f"Activation of {self._status.get('version')} already in progress")
+            self._status = {
+                'state': 'loading',
+                'version': version,
+                'started_at': datetime.now().isoformat()
+            }
+            self._thread = threading.Thread(
+                target=self._activate, args=(version, persist),
+                name=f"model-activate-{version}", daemon=True
+            )
+            self._thread.start()
+        if wait:
+            self._thread.join()
+        return self.status()
+
+    def _activate(self, version: str, persist: bool):
+        started_at = self.status().get('started_at')
+        try:
+            path = self.registry.artifact_path(version)
+            start = time.perf_counter()
+            model = self.predictor.read_model(path)
+            load_seconds = time.perf_counter() - start
+
+            self._set_status(state='warming', version=version, started_at=started_at)
+            canary = self.predictor.warm_up(model)
+
+            self.predictor.swap_model(model, version=version, model_path=path, load_seconds=load_seconds)
+            if persist:
+                self.registry.set_active_version(version)
+
+            self._set_status(
+                state='active', version=version, started_at=started_at,
+                finished_at=datetime.now().isoformat(),
+                load_seconds=round(load_seconds, 4), canary_prediction=canary
+            )
+            logger.info(f"Activated model version {version} (loaded in {load_seconds:.3f}s)")
+        except Exception as e:
+            self._set_status(
+                state='failed', version=version, started_at=started_at,
+                finished_at=datetime.now().isoformat(), error=str(e)
+            )
+            logger.error(f"Failed to activate model version {version}: {str(e)}")
+
+    def watch(self, interval_seconds: float):
+        """
+        Poll the registry's ACTIVE pointer and activate it when it changes.
+        Lets every worker process follow an activation made through any one.
+        Safe to call again after a fork, which leaves the old thread dead.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    version = self.registry.get_active_version()
+                    last = self.status()
+                    already_failed = last.get('state') == 'failed' and last.get('version') == version
+                    if (version and version != self.predictor.model_version
+                            and not self.busy and not already_failed):
+                        self.activate(version, persist=False)
+                except Exception as e:
+                    logger.error(f"Model registry poll failed: {str(e)}")
+
+        self._watcher = threading.Thread(target=poll, name='model-registry-watch', daemon=True)
+        self._watcher.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the versioned model registry')
+    parser.add_argument('--root', default=os.environ.get('MODEL_REGISTRY_DIR', 'models'),
+                        help='Registry directory (default: $MODEL_REGISTRY_DIR or ./models)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help='List registered versions')
+
+    register_parser = subparsers.add_parser('register', help='Add a model artifact to the registry')
+    register_parser.add_argument('version')
+    register_parser.add_argument('path')
+    register_parser.add_argument('--overwrite', action='store_true')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root)
+
+    if args.command == 'list':
+        active = registry.get_active_version()
+        for entry in registry.list_versions():
+            marker = '*' if entry['version'] == active else ' '
+            print(f"{marker} {entry['version']}\t{entry['modified']}\t{entry['size_bytes']} bytes")
+    elif args.command == 'register':
+        print(registry.register(args.version, args.path, overwrite=args.overwrite))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
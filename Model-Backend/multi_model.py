@@ -0,0 +1,270 @@
+"""
+Serving the demand and sales models side by side.
+
+``MultiModelPredictor`` wraps the live ``InventoryPredictor`` (demand) and the
+sales model (``sales_model/`` or ``sales_model.pkl``, a StandardScaler +
+LGBMRegressor over the 69 features built by ``prepare_inventory_features`` in
+final.ipynb). Both models read their category codes from one shared
+``EncodingTables`` instance, and a combined request is parsed once and
+scored with one vectorised call per model.
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compiled_model import CompiledDemandModel
+from feature_store import FeatureStore
+from inventory_model import InventoryPredictor
+from model_artifacts import ScaledRegressor, is_artifact, load_artifact
+
+logger = logging.getLogger(__name__)
+
+LEGACY_SALES_MODEL_PATH = 'sales_model.pkl'
+ARTIFACT_SALES_MODEL_PATH = 'sales_model'
+
+# LabelEncoder classes (sorted labels) of the categorical columns in
+# retail_store_inventory.csv, as encoded by prepare_inventory_features
+CATEGORY_CLASSES = {
+    'Category': ['Clothing', 'Electronics', 'Furniture', 'Groceries', 'Toys'],
+    'Region': ['East', 'North', 'South', 'West'],
+    'Weather Condition': ['Cloudy', 'Rainy', 'Snowy', 'Sunny'],
+    'Seasonality': ['Autumn', 'Spring', 'Summer', 'Winter'],
+}
+DATE_FEATURES = ['day_of_week', 'month', 'day_of_month', 'quarter', 'weekofyear', 'year',
+                 'is_weekend', 'is_month_start', 'is_month_end']
+NUMERIC_FEATURES = ['Price', 'Discount', 'Competitor Pricing', 'Inventory Level', 'Units Ordered']
+# Inputs every sales forecast needs (Store ID, Product ID and Inventory Level
+# are already required by the demand model)
+SALES_REQUIRED_COLUMNS = ['Date'] + list(CATEGORY_CLASSES) + ['Price', 'Discount', 'Competitor Pricing',
+                                                              'Units Ordered']
+# History features (lags, moving averages, group averages) are optional.
+# Missing ones come from the feature store when it has the pair's history,
+# and are otherwise left as NaN, which the scaled model treats as the
+# training mean.
+HISTORY_FEATURES = (
+    [f"{series}_lag_{window}" for series in ('units_sold', 'inventory', 'units_ordered')
+     for window in (1, 3, 5, 7, 11, 14, 21, 30)] +
+    [f"{series}_ma_{window}" for series in ('units_sold', 'inventory', 'units_ordered')
+     for window in (3, 5, 7, 11, 14, 21, 30)] +
+    ['category_avg_units_sold', 'region_avg_units_sold']
+)
+COMBINED_INPUT_COLUMNS = ['Store ID', 'Product ID', 'Inventory Level'] + \
+    [col for col in SALES_REQUIRED_COLUMNS if col != 'Inventory Level'] + HISTORY_FEATURES
+
+
+def default_sales_model_path() -> str:
+    """$SALES_MODEL_PATH, else the converted artifact if present, else the pickle."""
+    if os.environ.get('SALES_MODEL_PATH'):
+        return os.environ['SALES_MODEL_PATH']
+    return ARTIFACT_SALES_MODEL_PATH if is_artifact(ARTIFACT_SALES_MODEL_PATH) else LEGACY_SALES_MODEL_PATH
+
+
+def load_sales_model(path: str) -> ScaledRegressor:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Sales model not found: {path}")
+    if is_artifact(path):
+        return load_artifact(path)
+    import joblib
+    return ScaledRegressor.from_pipeline(joblib.load(path))
+
+
+def _lookup(classes: Sequence[str]) -> Dict[str, int]:
+    return {label: index for index, label in enumerate(classes)}
+
+
+def _combined_table(n_first: int, n_second: int) -> np.ndarray:
+    """
+    Codes of the label-encoded "<first code>_<second code>" strings that
+    final.ipynb builds for Category_Region and Product_Store, as a 2-D table.
+    LabelEncoder sorts the strings, so e.g. "10_0" comes before "2_0".
+    """
+    labels = sorted(f"{a}_{b}" for a in range(n_first) for b in range(n_second))
+    codes = _lookup(labels)
+    table = np.empty((n_first, n_second), dtype=np.float64)
+    for a in range(n_first):
+        for b in range(n_second):
+            table[a, b] = codes[f"{a}_{b}"]
+    return table
+
+
+class EncodingTables:
+    """
+    Category label -> code tables shared by the demand and sales models.
+
+    The Store ID and Product ID lookups are the demand model's own dicts,
+    not copies.
+    """
+
+    def __init__(self, store_lookup: Dict[str, int], product_lookup: Dict[str, int],
+                 categories: Dict[str, List[str]] = None):
+        categories = categories or CATEGORY_CLASSES
+        self.lookups: Dict[str, Dict[str, int]] = {'Store ID': store_lookup, 'Product ID': product_lookup}
+        for column, classes in categories.items():
+            self.lookups[column] = _lookup(classes)
+        self.category_region = _combined_table(len(categories['Category']), len(categories['Region']))
+        self.product_store = _combined_table(len(product_lookup), len(store_lookup))
+
+    @classmethod
+    def from_demand_runtime(cls, runtime) -> 'EncodingTables':
+        if isinstance(runtime, CompiledDemandModel):
+            return cls(runtime.store_lookup, runtime.product_lookup)
+        preprocessor = runtime.named_steps['preprocessor']
+        return cls(preprocessor._store_lookup, preprocessor._product_lookup)
+
+    def encode(self, column: str, values: pd.Series) -> np.ndarray:
+        """Codes for ``values``; unknown labels become NaN."""
+        return values.astype(str).map(self.lookups[column]).to_numpy(dtype=np.float64, na_value=np.nan)
+
+    @staticmethod
+    def combine(table: np.ndarray, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        known = ~(np.isnan(first) | np.isnan(second))
+        out = np.full(len(first), np.nan)
+        out[known] = table[first[known].astype(np.intp), second[known].astype(np.intp)]
+        return out
+
+
+class MultiModelPredictor:
+    """Demand and sales forecasts from one parse of the input."""
+
+    def __init__(self, demand: InventoryPredictor, sales_model_path: str = None,
+                 feature_store: FeatureStore = None):
+        self.demand = demand
+        self.feature_store = feature_store
+        # (store, our HISTORY_FEATURES positions, the store's positions)
+        self._store_columns = None
+        self.sales_model_path = sales_model_path or default_sales_model_path()
+        self.sales_model = load_sales_model(self.sales_model_path)
+        unknown = [name for name in self.sales_model.feature_names
+                   if name not in DATE_FEATURES + NUMERIC_FEATURES + HISTORY_FEATURES
+                   and name not in ('Store ID', 'Product ID', 'Category_Region', 'Product_Store')
+                   and name not in CATEGORY_CLASSES]
+        if unknown:
+            raise ValueError(f"Sales model expects features this server can't build: {', '.join(unknown)}")
+        self._tables: Optional[EncodingTables] = None
+        self._tables_runtime = None
+        logger.info(f"Sales model loaded successfully from {self.sales_model_path}")
+
+    def tables_for(self, runtime) -> EncodingTables:
+        """The encoding tables for the given demand runtime (rebuilt after a model swap)."""
+        tables = self._tables
+        if tables is None or self._tables_runtime is not runtime:
+            tables = EncodingTables.from_demand_runtime(runtime)
+            self._tables, self._tables_runtime = tables, runtime
+        return tables
+
+    def history_features(self, df: pd.DataFrame, date: pd.Series) -> np.ndarray:
+        """
+        ``HISTORY_FEATURES`` for ``df`` as one matrix: the values sent with
+        the items, with gaps filled from the feature store.
+        """
+        history = df[HISTORY_FEATURES]
+        try:
+            values = history.to_numpy(dtype=np.float64, copy=True)
+        except (TypeError, ValueError):
+            # Some value isn't a number; coerce column by column
+            values = history.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+        store = self.feature_store
+        if store is not None and len(df):
+            columns = self._store_columns
+            if columns is None or columns[0] is not store:
+                names = [name for name in HISTORY_FEATURES if name in store.feature_names]
+                columns = self._store_columns = (
+                    store,
+                    np.array([HISTORY_FEATURES.index(name) for name in names], dtype=np.intp),
+                    np.array([store.feature_names.index(name) for name in names], dtype=np.intp)
+                )
+            _, ours, theirs = columns
+            stored = store.lookup_batch(df['Store ID'].tolist(), df['Product ID'].tolist(), date)[:, theirs]
+            sent = values[:, ours]
+            # Values sent with the item win over the stored history
+            np.copyto(sent, stored, where=np.isnan(sent))
+            values[:, ours] = sent
+        return values
+
+    def sales_features(self, df: pd.DataFrame, tables: EncodingTables) -> Tuple[np.ndarray, Dict[Any, str]]:
+        """
+        Build the sales model's feature matrix for ``df`` (rows in ``df``'s
+        order) and the reasons rows can't get a sales forecast.
+        """
+        df = df.reindex(columns=COMBINED_INPUT_COLUMNS)
+        reasons: Dict[Any, str] = {}
+        for col in SALES_REQUIRED_COLUMNS:
+            for i in df.index[df[col].isna()]:
+                reasons.setdefault(i, f"Missing sales field: {col}")
+
+        features: Dict[str, np.ndarray] = {}
+        date = pd.to_datetime(df['Date'], errors='coerce')
+        for i in df.index[date.isna() & df['Date'].notna()]:
+            reasons.setdefault(i, f"Invalid Date: {df.at[i, 'Date']!r}")
+        day_of_week = date.dt.dayofweek
+        features.update({
+            'day_of_week': day_of_week,
+            'month': date.dt.month,
+            'day_of_month': date.dt.day,
+            'quarter': date.dt.quarter,
+            'weekofyear': date.dt.isocalendar().week.astype('Float64'),
+            'year': date.dt.year,
+            'is_weekend': day_of_week.isin([5, 6]).astype(float),
+            'is_month_start': date.dt.is_month_start.astype(float),
+            'is_month_end': date.dt.is_month_end.astype(float),
+        })
+
+        for column in tables.lookups:
+            features[column] = tables.encode(column, df[column])
+        features['Category_Region'] = tables.combine(
+            tables.category_region, features['Category'], features['Region'])
+        features['Product_Store'] = tables.combine(
+            tables.product_store, features['Product ID'], features['Store ID'])
+
+        for column in NUMERIC_FEATURES:
+            values = pd.to_numeric(df[column], errors='coerce')
+            for i in df.index[values.isna() & df[column].notna()]:
+                reasons.setdefault(i, f"Invalid {column}: {df.at[i, column]!r}")
+            features[column] = values
+
+        history = self.history_features(df, date)
+        for j, column in enumerate(HISTORY_FEATURES):
+            features[column] = history[:, j]
+
+        X = np.column_stack([
+            np.asarray(features[name], dtype=np.float64) for name in self.sales_model.feature_names
+        ]) if len(df) else np.empty((0, len(self.sales_model.feature_names)))
+        return X, reasons
+
+    def predict_combined(self, items: List[Any]) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        Demand and sales forecasts for ``items``.
+
+        Returns the rows with a demand forecast (indexed by position in
+        ``items``) with ``predicted_demand``, ``predicted_sales`` and
+        ``sales_error`` columns, and the per-item errors for the rest.
+        """
+        runtime = self.demand.runtime
+        if runtime is None:
+            raise ValueError("Model not loaded")
+        tables = self.tables_for(runtime)
+
+        df, reasons = self.demand._frame_items(items, columns=COMBINED_INPUT_COLUMNS)
+        scored, demand_reasons = self.demand.predict_demand_frame(df)
+        reasons.update(demand_reasons)
+
+        X, sales_reasons = self.sales_features(df.loc[scored.index], tables)
+        has_sales = ~scored.index.isin(list(sales_reasons))
+        sales = np.full(len(scored), np.nan)
+        if has_sales.any():
+            # Ensure predictions are not negative
+            sales[has_sales] = np.maximum(self.sales_model.predict(X[has_sales]), 0)
+
+        scored = scored.assign(
+            predicted_sales=sales,
+            sales_error=[sales_reasons.get(i) for i in scored.index]
+        )
+        errors = self.demand._item_errors(items, reasons)
+        logger.info(f"Combined prediction made: {int(has_sales.sum())} with sales, "
+                    f"{len(scored)} with demand, {len(errors)} rejected")
+        return scored, errors
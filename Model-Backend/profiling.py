@@ -0,0 +1,282 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+While profiling is on, a background thread samples the Python stack of
+every thread serving a request every few milliseconds. When a request
+ends, its samples are kept if it was picked by ``sample_rate`` or took at
+least ``threshold_ms``; otherwise they are dropped. The last ``capacity``
+kept profiles stay in memory with their route, latency and item count.
+
+Profiles are exported as collapsed stacks (``frame;frame;frame count``
+per line), which flamegraph.pl, inferno and speedscope read directly::
+
+    curl -H "X-Admin-Token: $ADMIN_TOKEN" localhost:5000/admin/profiling/flamegraph > stacks.txt
+    flamegraph.pl stacks.txt > flamegraph.svg
+
+Nothing is sampled while profiling is off. Configure it with
+``$PROFILING``, ``$PROFILE_SAMPLE_RATE``, ``$PROFILE_THRESHOLD_MS``,
+``$PROFILE_INTERVAL_MS`` and ``$PROFILE_RING_SIZE``, or at runtime through
+``POST /admin/profiling``. Each process has its own profiler, so a runtime
+change only reaches the worker that served it.
+"""
+
+import collections
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from config import env_flag
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_MS = 5.0
+DEFAULT_CAPACITY = 50
+MIN_INTERVAL_MS = 1.0
+MAX_CAPACITY = 1000
+COLLAPSED_CONTENT_TYPE = 'text/plain; charset=utf-8'
+
+
+class _ActiveRequest:
+    __slots__ = ('route', 'method', 'started', 'started_at', 'sampled', 'status', 'stacks')
+
+    def __init__(self, route: str, method: str, sampled: bool):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self.sampled = sampled
+        self.status: Optional[int] = None
+        self.stacks: collections.Counter = collections.Counter()
+
+
+class RequestProfiler:
+    """Stack samples of in-flight requests and a ring of the profiles worth keeping."""
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, threshold_ms: Optional[float] = None,
+                 interval_ms: float = DEFAULT_INTERVAL_MS, capacity: int = DEFAULT_CAPACITY):
+        self._lock = threading.Lock()
+        self._active: Dict[int, _ActiveRequest] = {}
+        # Set while at least one request is being profiled
+        self._busy = threading.Event()
+        self._ids = itertools.count(1)
+        self._labels: Dict[Any, str] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.profiles: collections.deque = collections.deque(maxlen=DEFAULT_CAPACITY)
+        self.dropped = 0
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.threshold_ms: Optional[float] = None
+        self.interval_ms = DEFAULT_INTERVAL_MS
+        self.configure(enabled=enabled, sample_rate=sample_rate, threshold_ms=threshold_ms,
+                       interval_ms=interval_ms, capacity=capacity)
+
+    @classmethod
+    def from_env(cls) -> 'RequestProfiler':
+        threshold = os.environ.get('PROFILE_THRESHOLD_MS')
+        return cls(enabled=env_flag('PROFILING'),
+                   sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+                   threshold_ms=float(threshold) if threshold else None,
+                   interval_ms=float(os.environ.get('PROFILE_INTERVAL_MS', DEFAULT_INTERVAL_MS)),
+                   capacity=int(os.environ.get('PROFILE_RING_SIZE', DEFAULT_CAPACITY)))
+
+    def configure(self, enabled: bool = None, sample_rate: float = None, threshold_ms: Optional[float] = ...,
+                  interval_ms: float = None, capacity: int = None) -> Dict[str, Any]:
+        """Change the settings given (``threshold_ms=None`` turns the threshold off); returns them all."""
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if threshold_ms is not ... and threshold_ms is not None and threshold_ms < 0:
+            raise ValueError("threshold_ms must not be negative")
+        if interval_ms is not None and interval_ms < MIN_INTERVAL_MS:
+            raise ValueError(f"interval_ms must be at least {MIN_INTERVAL_MS:g}")
+        if capacity is not None and not 1 <= capacity <= MAX_CAPACITY:
+            raise ValueError(f"capacity must be between 1 and {MAX_CAPACITY}")
+
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = float(sample_rate)
+            if threshold_ms is not ...:
+                self.threshold_ms = float(threshold_ms) if threshold_ms is not None else None
+            if interval_ms is not None:
+                self.interval_ms = float(interval_ms)
+            if capacity is not None and capacity != self.profiles.maxlen:
+                self.profiles = collections.deque(self.profiles, maxlen=capacity)
+            if enabled is not None:
+                self.enabled = bool(enabled)
+        if self.enabled:
+            self._ensure_sampler()
+        return self.settings()
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'threshold_ms': self.threshold_ms,
+            'interval_ms': self.interval_ms,
+            'capacity': self.profiles.maxlen,
+            'profiles': len(self.profiles),
+            'dropped': self.dropped,
+        }
+
+    # Request hooks
+
+    def start(self, route: str, method: str):
+        """Begin profiling the current thread's request (no-op while disabled)."""
+        if not self.enabled:
+            return
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.threshold_ms is None:
+            return
+        # The sampler doesn't survive a fork (e.g. into a preloaded Gunicorn worker)
+        if self._thread is None or not self._thread.is_alive():
+            self._ensure_sampler()
+        with self._lock:
+            self._active[threading.get_ident()] = _ActiveRequest(route, method, sampled)
+            self._busy.set()
+
+    def set_status(self, status: int):
+        active = self._active.get(threading.get_ident())
+        if active is not None:
+            active.status = status
+
+    def finish(self, items: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """End the current thread's request; returns its profile if it was kept."""
+        if not self._active:
+            return None
+        with self._lock:
+            active = self._active.pop(threading.get_ident(), None)
+            if not self._active:
+                self._busy.clear()
+        if active is None:
+            return None
+
+        duration_ms = (time.perf_counter() - active.started) * 1000
+        slow = self.threshold_ms is not None and duration_ms >= self.threshold_ms
+        if not (slow or active.sampled):
+            return None
+        profile = {
+            'id': next(self._ids),
+            'route': active.route,
+            'method': active.method,
+            'status': active.status,
+            'reason': 'slow' if slow else 'sampled',
+            'started_at': active.started_at.isoformat(),
+            'duration_ms': round(duration_ms, 3),
+            'items': items,
+            'samples': sum(active.stacks.values()),
+            'stacks': active.stacks,
+        }
+        with self._lock:
+            if len(self.profiles) == self.profiles.maxlen:
+                self.dropped += 1
+            self.profiles.append(profile)
+        return profile
+
+    # Sampling
+
+    def _ensure_sampler(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval_ms / 1000)
+            if self.enabled and self._active:
+                self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, active in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                active.stacks[self._collapse(frame)] += 1
+
+    def _collapse(self, frame) -> str:
+        """Root-first ``;``-separated frame labels of a stack."""
+        labels = self._labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                name = getattr(code, 'co_qualname', code.co_name)
+                label = labels[code] = (f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                                        .replace(';', ':'))
+            stack.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    # Export
+
+    def summaries(self, route: str = None) -> List[Dict[str, Any]]:
+        """The kept profiles without their stacks, newest first."""
+        with self._lock:
+            profiles = list(self.profiles)
+        return [{key: value for key, value in profile.items() if key != 'stacks'}
+                for profile in reversed(profiles) if route is None or profile['route'] == route]
+
+    def get(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return next((profile for profile in self.profiles if profile['id'] == profile_id), None)
+
+    def collapsed(self, profile_id: int = None, route: str = None) -> Optional[str]:
+        """
+        Collapsed stacks of one profile, or of all kept profiles (optionally
+        of one route) merged. None when ``profile_id`` is not in the ring.
+        """
+        if profile_id is not None:
+            profile = self.get(profile_id)
+            if profile is None:
+                return None
+            profiles = [profile]
+        else:
+            with self._lock:
+                profiles = [profile for profile in self.profiles if route is None or profile['route'] == route]
+        merged: collections.Counter = collections.Counter()
+        for profile in profiles:
+            merged.update(profile['stacks'])
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(merged.items()))
+
+    def clear(self):
+        with self._lock:
+            self.profiles.clear()
+            self.dropped = 0
+
+    def instrument(self, app):
+        """Profile the requests of a Flask app."""
+        from flask import request
+
+        @app.before_request
+        def _start_profile():
+            if self.enabled:
+                self.start(request.url_rule.rule if request.url_rule is not None else '<unmatched>', request.method)
+
+        @app.after_request
+        def _profile_status(response):
+            if self._active:
+                self.set_status(response.status_code)
+            return response
+
+        @app.teardown_request
+        def _finish_profile(error):
+            if self._active and threading.get_ident() in self._active:
+                self.finish(_item_count(request))
+
+
+def _item_count(request) -> Optional[int]:
+    """Items in a JSON request body ({"items": [...]}, one object or a list); None otherwise."""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        items = data.get('items')
+        return len(items) if isinstance(items, list) else 1
+    if isinstance(data, list):
+        return len(data)
+    return None
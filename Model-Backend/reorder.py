@@ -0,0 +1,226 @@
+"""
+Reorder quantities from demand forecasts.
+
+``ReorderEngine`` turns the demand model's daily forecasts into a
+periodic-review (order-up-to) replenishment plan. Every store/product pair
+is computed in the same NumPy pass:
+
+    protection period  P  = lead time + review period           (days)
+    safety stock       SS = z(service level) * sqrt(P * sd^2 + d^2 * sd_L^2)
+    reorder point      s  = d * lead time + SS
+    order-up-to level  S  = d * P + SS
+    order quantity     Q  = S - (inventory + on order), rounded up to the
+                            pack size and the minimum order quantity
+
+where ``d`` is the forecast daily demand, ``sd`` its daily standard deviation
+(``demand_std``, or ``demand_cv * d`` when no history is available) and
+``sd_L`` the lead time's standard deviation in days.
+"""
+
+import logging
+from statistics import NormalDist
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from inventory_model import InventoryPredictor
+
+logger = logging.getLogger(__name__)
+
+# Policy fields with their defaults. Each can be set per request (``policy``)
+# and overridden per item.
+DEFAULT_POLICY = {
+    'lead_time_days': 7.0,
+    'review_period_days': 1.0,
+    'service_level': 0.95,
+    'demand_cv': 0.3,
+    'demand_std': float('nan'),
+    'lead_time_std_days': 0.0,
+    'on_order': 0.0,
+    'pack_size': 1.0,
+    'min_order_quantity': 0.0,
+}
+POLICY_FIELDS = list(DEFAULT_POLICY)
+DEMAND_COLUMNS = ['Store ID', 'Product ID', 'Inventory Level']
+
+
+def _check_policy(values: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Masks of the rows whose policy values are out of range, by message."""
+    return {
+        'lead_time_days must be >= 0': values['lead_time_days'] < 0,
+        'review_period_days must be >= 0': values['review_period_days'] < 0,
+        'service_level must be between 0 and 1 (exclusive)':
+            (values['service_level'] <= 0) | (values['service_level'] >= 1),
+        'demand_cv must be >= 0': values['demand_cv'] < 0,
+        'demand_std must be >= 0': values['demand_std'] < 0,
+        'lead_time_std_days must be >= 0': values['lead_time_std_days'] < 0,
+        'on_order must be >= 0': values['on_order'] < 0,
+        'pack_size must be > 0': values['pack_size'] <= 0,
+        'min_order_quantity must be >= 0': values['min_order_quantity'] < 0,
+    }
+
+
+def resolve_policy(policy: Dict[str, Any] = None) -> Dict[str, float]:
+    """Request-level policy merged over the defaults; raises ValueError if invalid."""
+    policy = policy or {}
+    if not isinstance(policy, dict):
+        raise ValueError("policy must be a JSON object")
+    unknown = [key for key in policy if key not in DEFAULT_POLICY]
+    if unknown:
+        raise ValueError(f"Unknown policy fields: {', '.join(unknown)}")
+
+    resolved = dict(DEFAULT_POLICY)
+    for key, value in policy.items():
+        if value is None:
+            continue
+        try:
+            resolved[key] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {key}: {value!r}")
+
+    values = {key: np.array([value]) for key, value in resolved.items()}
+    for message, bad in _check_policy(values).items():
+        if bad[0]:
+            raise ValueError(message)
+    return resolved
+
+
+def z_scores(service_level: np.ndarray) -> np.ndarray:
+    """Standard normal quantiles of ``service_level`` (computed once per distinct level)."""
+    levels, inverse = np.unique(service_level, return_inverse=True)
+    normal = NormalDist()
+    return np.array([normal.inv_cdf(level) for level in levels])[inverse.reshape(-1)]
+
+
+def compute_reorder_plan(demand: np.ndarray, inventory: np.ndarray,
+                         **policy: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Safety stock and order quantities for arrays of daily demand and current
+    inventory. ``policy`` holds one array (or scalar) per ``POLICY_FIELDS``
+    entry; missing fields take their defaults.
+    """
+    demand = np.asarray(demand, dtype=np.float64)
+    inventory = np.asarray(inventory, dtype=np.float64)
+    n = len(demand)
+    values = {
+        key: np.broadcast_to(np.asarray(policy.get(key, default), dtype=np.float64), n)
+        for key, default in DEFAULT_POLICY.items()
+    }
+    lead_time = values['lead_time_days']
+    protection = lead_time + values['review_period_days']
+
+    demand_std = np.where(np.isnan(values['demand_std']), values['demand_cv'] * demand, values['demand_std'])
+    sigma = np.sqrt(protection * demand_std ** 2 + (demand * values['lead_time_std_days']) ** 2)
+    safety_stock = z_scores(values['service_level']) * sigma
+    # A service level below 50% would give negative safety stock
+    safety_stock = np.maximum(safety_stock, 0)
+
+    reorder_point = demand * lead_time + safety_stock
+    order_up_to = demand * protection + safety_stock
+    position = inventory + values['on_order']
+
+    shortfall = np.maximum(order_up_to - position, 0)
+    pack_size = values['pack_size']
+    # Tolerance so float noise never adds a whole extra pack
+    order_quantity = np.ceil(shortfall / pack_size - 1e-9) * pack_size
+    min_order = np.ceil(values['min_order_quantity'] / pack_size - 1e-9) * pack_size
+    order_quantity = np.where(order_quantity > 0, np.maximum(order_quantity, min_order), 0.0)
+
+    days_of_cover = np.divide(position, demand, out=np.full(n, np.nan), where=demand > 0)
+    return {
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'order_up_to_level': order_up_to,
+        'inventory_position': position,
+        'order_quantity': order_quantity,
+        'below_reorder_point': position <= reorder_point,
+        'days_of_cover': days_of_cover,
+    }
+
+
+class ReorderEngine:
+    """Replenishment plans for many store/product pairs from one demand model call."""
+
+    def __init__(self, predictor: InventoryPredictor):
+        self.predictor = predictor
+
+    def policy_frame(self, df: pd.DataFrame, defaults: Dict[str, float]) -> Tuple[pd.DataFrame, Dict[Any, str]]:
+        """
+        Per-item policy values (item overrides over ``defaults``) and the
+        reasons rows have invalid ones.
+        """
+        reasons: Dict[Any, str] = {}
+        values = {}
+        for key in POLICY_FIELDS:
+            raw = df[key] if key in df.columns else pd.Series(np.nan, index=df.index)
+            parsed = pd.to_numeric(raw, errors='coerce')
+            for i in df.index[parsed.isna() & raw.notna()]:
+                reasons.setdefault(i, f"Invalid {key}: {raw[i]!r}")
+            values[key] = parsed.fillna(defaults[key]).to_numpy(dtype=np.float64)
+
+        for message, bad in _check_policy(values).items():
+            for i in df.index[bad]:
+                reasons.setdefault(i, message)
+        return pd.DataFrame(values, index=df.index), reasons
+
+    def plan(self, items: List[Any], policy: Dict[str, Any] = None) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        Reorder plan for ``items``.
+
+        Returns the planned rows (indexed by position in ``items``) with the
+        demand forecast and the ``compute_reorder_plan`` columns, and the
+        per-item errors for the rest. Raises ValueError for an invalid
+        request-level ``policy``.
+        """
+        defaults = resolve_policy(policy)
+        df, reasons = self.predictor._frame_items(items, columns=DEMAND_COLUMNS + POLICY_FIELDS)
+
+        policies, policy_reasons = self.policy_frame(df, defaults)
+        reasons.update(policy_reasons)
+        valid = ~df.index.isin(list(reasons))
+
+        scored, demand_reasons = self.predictor.predict_demand_frame(df.loc[valid, DEMAND_COLUMNS])
+        reasons.update(demand_reasons)
+
+        policies = policies.loc[scored.index]
+        plan = compute_reorder_plan(
+            scored['predicted_demand'].to_numpy(), scored['Inventory Level'].to_numpy(),
+            **{key: policies[key].to_numpy() for key in POLICY_FIELDS}
+        )
+        planned = scored.assign(
+            lead_time_days=policies['lead_time_days'],
+            service_level=policies['service_level'],
+            **plan
+        )
+        errors = self.predictor._item_errors(items, reasons)
+        logger.info(f"Reorder plan made: {int((plan['order_quantity'] > 0).sum())} of {len(planned)} "
+                    f"items to order, {len(errors)} rejected")
+        return planned, errors
+
+
+def summarize_plan(planned: pd.DataFrame) -> Dict[str, Any]:
+    """Totals for the whole plan and per store."""
+    ordering = planned['order_quantity'] > 0
+    by_store = planned.assign(ordering=ordering).groupby('Store ID', sort=True).agg(
+        items=('order_quantity', 'size'),
+        items_to_order=('ordering', 'sum'),
+        order_quantity=('order_quantity', 'sum'),
+        safety_stock=('safety_stock', 'sum')
+    )
+    return {
+        'items_planned': len(planned),
+        'items_to_order': int(ordering.sum()),
+        'items_below_reorder_point': int(planned['below_reorder_point'].sum()),
+        'total_order_quantity': round(float(planned['order_quantity'].sum()), 2),
+        'total_safety_stock': round(float(planned['safety_stock'].sum()), 2),
+        'stores': {
+            str(store_id): {
+                'items': int(row['items']),
+                'items_to_order': int(row['items_to_order']),
+                'order_quantity': round(float(row['order_quantity']), 2),
+                'safety_stock': round(float(row['safety_stock']), 2)
+            }
+            for store_id, row in by_store.iterrows()
+        }
+    }
@@ -0,0 +1,156 @@
+"""
+Compact encodings for the batch endpoints.
+
+By default ``/predict/batch`` and ``/inventory/analysis`` return one JSON
+object per item (echoing its input). In compact mode they return columns
+instead: one array per field, no input echo, serialized without going
+through ``jsonify``. Compact mode is chosen with ``?compact=1`` or by
+asking for a binary format in the ``Accept`` header:
+
+    application/json                      columnar JSON (orjson when installed)
+    application/vnd.apache.arrow.stream   Arrow IPC stream
+    application/x-msgpack                 MessagePack (when msgpack is installed)
+
+In the Arrow format the item columns form the record batch, and everything
+else in the response (summary, errors, ...) is JSON in the schema metadata
+under ``response``. Missing values (e.g. ``days_of_stock`` of an item
+without forecast demand) are null in every format. A request whose
+``Accept`` header names a compact type but allows none of the types this
+installation can produce (e.g. only MessagePack without msgpack
+installed) is refused. Requests that don't ask for compact output get
+per-item JSON whatever their ``Accept`` header says.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import TRUE_VALUES
+
+try:
+    import orjson
+except ImportError:  # plain json; slower for large responses
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_TYPE = 'application/json'
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+MSGPACK_TYPE = 'application/x-msgpack'
+BINARY_TYPES = (ARROW_TYPE, MSGPACK_TYPE)
+ARROW_METADATA_KEY = b'response'
+
+Columns = Dict[str, Any]
+
+
+class NotAcceptable(ValueError):
+    """None of the content types a request accepts can be produced."""
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def available_types() -> List[str]:
+    """Compact content types this installation can produce, JSON first."""
+    types = [JSON_TYPE]
+    if _pyarrow() is not None:
+        types.append(ARROW_TYPE)
+    if msgpack is not None:
+        types.append(MSGPACK_TYPE)
+    return types
+
+
+def negotiate(request) -> Optional[str]:
+    """
+    The compact content type a request asks for, or None for the default
+    per-item JSON. ``*/*`` and plain JSON stay per-item unless ``compact``
+    is set. Raises NotAcceptable when compact output is asked for (with
+    ``compact`` or a binary type in ``Accept``) but none of the available
+    types satisfies the ``Accept`` header.
+    """
+    compact = request.args.get('compact', '').lower() in TRUE_VALUES
+    accept = request.accept_mimetypes
+    wants_binary = any(value in BINARY_TYPES and quality > 0 for value, quality in accept)
+    if not accept or not (compact or wants_binary):
+        # Per-item JSON, as for clients that never asked for compact output
+        return JSON_TYPE if compact else None
+    types = available_types()
+    best = accept.best_match(types)
+    if best is None:
+        raise NotAcceptable(f"Cannot produce any of the accepted types; available: {', '.join(types)}")
+    if best != JSON_TYPE:
+        return best
+    return JSON_TYPE if compact else None
+
+
+def round_column(values, decimals: int = 2) -> np.ndarray:
+    """Rounded float64 copy; NaN and infinities become NaN (null when encoded)."""
+    values = np.round(np.asarray(values, dtype=np.float64), decimals)
+    values[~np.isfinite(values)] = np.nan
+    return values
+
+
+def _plain(value: Any) -> Any:
+    """Columns as lists with None for NaN, for the encoders without NumPy support."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            return np.where(np.isnan(value), None, value.astype(object)).tolist()
+        return value.tolist()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def encode_json(payload: Dict[str, Any]) -> bytes:
+    if orjson is not None:
+        # NumPy arrays are serialized natively; NaN becomes null
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(_plain(payload), separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+def encode_msgpack(payload: Dict[str, Any]) -> bytes:
+    return msgpack.packb(_plain(payload), use_bin_type=True)
+
+
+def encode_arrow(payload: Dict[str, Any], table_key: str) -> bytes:
+    """``payload[table_key]`` (a dict of columns) as the record batch, the rest as metadata."""
+    pa = _pyarrow()
+    columns: Columns = payload[table_key]
+    arrays = []
+    for values in columns.values():
+        if isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+            arrays.append(pa.array(values, from_pandas=True))  # NaN -> null
+        else:
+            arrays.append(pa.array(values))
+    rest = {key: value for key, value in payload.items() if key != table_key}
+    schema = pa.schema([(name, array.type) for name, array in zip(columns, arrays)],
+                       metadata={ARROW_METADATA_KEY: encode_json(rest)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+    return sink.getvalue().to_pybytes()
+
+
+def encode(payload: Dict[str, Any], content_type: str, table_key: str) -> Tuple[bytes, str]:
+    """
+    Serialize a compact payload as ``content_type``. ``table_key`` names the
+    dict of item columns that becomes the Arrow record batch.
+    """
+    if content_type == ARROW_TYPE:
+        return encode_arrow(payload, table_key), ARROW_TYPE
+    if content_type == MSGPACK_TYPE:
+        return encode_msgpack(payload), MSGPACK_TYPE
+    return encode_json(payload), JSON_TYPE
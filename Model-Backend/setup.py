@@ -28,6 +28,9 @@ def install_requirements():
 
 def check_model_file():
     """Check if the model file exists"""
+    if os.path.exists(os.path.join("demand_model", "manifest.json")):
+        print("✅ demand_model/ artifact found")
+        return True
     if os.path.exists("demand_model.pkl"):
         print("✅ demand_model.pkl found")
         return True
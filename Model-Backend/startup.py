@@ -0,0 +1,126 @@
+"""
+Startup sequencing, warm-up and timing.
+
+By default app.py loads the models while it is imported, so the server only
+starts listening once it can predict. With ``FAST_STARTUP=1`` the import
+stops after the cheap setup: the models load in a background thread, and
+until they are loaded and warmed up ``/health`` reports ``warming`` (503)
+and the model endpoints answer 503 with ``Retry-After``.
+
+Either way the models are warmed up with a synthetic batch before the
+server reports ready, and the startup log reports how long the imports,
+the model load and the first (cold) predictions took.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+WARM_UP_ITEMS = 256
+
+
+class Startup:
+    """State and phase timings of the server's startup."""
+
+    def __init__(self, started: float):
+        # time.perf_counter() when the app module started importing
+        self.started = started
+        self.state = WARMING
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+        self._done = threading.Event()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as the startup phase ``name``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    def mark_imported(self):
+        self.timings['imports'] = time.perf_counter() - self.started
+
+    @property
+    def warming(self) -> bool:
+        return self.state == WARMING
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def run(self, steps: Callable[[], None], background: bool = False):
+        """Run the startup ``steps`` now, or in a daemon thread, then report the timings."""
+        def run_steps():
+            try:
+                steps()
+                self.state = READY
+            except Exception as e:
+                self.state = FAILED
+                self.error = str(e)
+                logger.error(f"Startup failed: {str(e)}")
+            self.ready_after = time.perf_counter() - self.started
+            self._done.set()
+            self.log()
+
+        if background:
+            threading.Thread(target=run_steps, name='startup', daemon=True).start()
+        else:
+            run_steps()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until startup has finished (either way); False on timeout."""
+        return self._done.wait(timeout)
+
+    def log(self):
+        phases = ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in self.timings.items())
+        logger.info(f"Startup {self.state} after {self.ready_after:.2f}s ({phases})")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'error': self.error,
+            'ready_after_seconds': round(self.ready_after, 3) if self.ready_after is not None else None,
+            'timings_ms': {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+        }
+
+
+def synthetic_items(predictor, count: int = WARM_UP_ITEMS) -> List[Dict[str, Any]]:
+    """``count`` valid items cycling through the model's known stores and products."""
+    lookups = predictor.category_lookups()
+    stores, products = list(lookups['Store ID']) or ['S001'], list(lookups['Product ID']) or ['P0001']
+    return [
+        {'Store ID': stores[i % len(stores)], 'Product ID': products[(i // len(stores)) % len(products)],
+         'Inventory Level': float(50 + (i * 37) % 450)}
+        for i in range(count)
+    ]
+
+
+def warm_up(predictor, startup: Startup, count: int = WARM_UP_ITEMS):
+    """
+    Send a synthetic batch and a single item through the predictor so the
+    first real requests don't pay for cold caches and lazy initialisation.
+    Records the cold and warm batch times and the cold single prediction.
+    """
+    items = synthetic_items(predictor, count)
+    with startup.phase('first_batch'):
+        scored, errors = predictor.predict_demand_batch(items)
+    if errors or len(scored) != len(items):
+        raise ValueError(f"Warm-up batch rejected {len(errors)} of {len(items)} items")
+    with startup.phase('warm_batch'):
+        predictor.predict_demand_batch(items)
+    # Past the prediction cache the batches filled
+    predictor.cache.clear()
+    with startup.phase('first_prediction'):
+        predictor.predict_demand(items[0])
+    # Synthetic results don't belong in the prediction cache
+    predictor.cache.clear()
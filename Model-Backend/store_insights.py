@@ -0,0 +1,240 @@
+"""
+Per-store inventory rollups kept in memory and updated incrementally.
+
+Every (store, product) pair keeps its latest inventory level and demand
+forecast. Each store also keeps its running totals, counts, a days-of-stock
+histogram and two heaps of critical and overstocked items. A batch of new
+inventory levels only touches the pairs it contains, and a store's insights
+are read in O(K log n) for its top K items, without rescoring the catalogue.
+
+The heaps use lazy deletion: an update pushes a new entry and leaves the old
+one behind. Reads skip entries whose version is no longer current, and a
+heap is rebuilt once stale entries outnumber live ones.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from inventory_model import InventoryPredictor
+
+logger = logging.getLogger(__name__)
+
+# Same thresholds as /inventory/analysis (stock ratio = demand / inventory)
+CRITICAL_STOCK_RATIO = 1.5
+OVERSTOCK_RATIO = 0.5
+DAYS_OF_STOCK_BOUNDS = [0.5, 1, 2, 3, 7, 14, 30, 60]
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 100
+
+
+class _Item:
+    __slots__ = ('inventory', 'demand', 'days_of_stock', 'bucket', 'status', 'version')
+
+    def __init__(self, inventory: float, demand: float, days_of_stock: float, bucket: int,
+                 status: Optional[str], version: int):
+        self.inventory = inventory
+        self.demand = demand
+        self.days_of_stock = days_of_stock
+        self.bucket = bucket
+        self.status = status
+        self.version = version
+
+
+class StoreRollup:
+    """Running aggregates for one store. Not thread-safe; StoreInsights locks around it."""
+
+    def __init__(self, store_id: str):
+        self.store_id = store_id
+        self.items: Dict[str, _Item] = {}
+        self.total_inventory = 0.0
+        self.total_demand = 0.0
+        self.status_counts = {'critical': 0, 'overstocked': 0}
+        self.days_of_stock_counts = [0] * (len(DAYS_OF_STOCK_BOUNDS) + 1)
+        # Critical items by fewest days of stock; overstocked by most
+        self._heaps: Dict[str, List[Tuple[float, float, int, str]]] = {'critical': [], 'overstocked': []}
+        self.updated_at: Optional[datetime] = None
+
+    def _remove(self, item: _Item):
+        self.total_inventory -= item.inventory
+        self.total_demand -= item.demand
+        self.days_of_stock_counts[item.bucket] -= 1
+        if item.status is not None:
+            self.status_counts[item.status] -= 1
+
+    def set(self, product_id: str, inventory: float, demand: float, days_of_stock: float,
+            bucket: int, status: Optional[str], version: int):
+        """Record the latest inventory level and forecast of ``product_id``."""
+        previous = self.items.get(product_id)
+        if previous is not None:
+            self._remove(previous)
+
+        self.items[product_id] = _Item(inventory, demand, days_of_stock, bucket, status, version)
+        self.total_inventory += inventory
+        self.total_demand += demand
+        self.days_of_stock_counts[bucket] += 1
+        if status is not None:
+            self.status_counts[status] += 1
+            key = days_of_stock if status == 'critical' else -days_of_stock
+            # Ties go to the item with more demand at stake
+            heap = self._heaps[status]
+            heapq.heappush(heap, (key, -demand, version, product_id))
+            if len(heap) > 2 * self.status_counts[status] + 64:
+                self._compact(status)
+
+    def _live(self, status: str, entry: Tuple[float, float, int, str]) -> bool:
+        item = self.items.get(entry[3])
+        return item is not None and item.version == entry[2] and item.status == status
+
+    def _compact(self, status: str):
+        heap = [entry for entry in self._heaps[status] if self._live(status, entry)]
+        heapq.heapify(heap)
+        self._heaps[status] = heap
+
+    def top(self, status: str, k: int) -> List[Tuple[str, _Item]]:
+        """The ``k`` most severe items with ``status``, most severe first."""
+        heap = self._heaps[status]
+        popped = []
+        top = []
+        while heap and len(top) < k:
+            entry = heapq.heappop(heap)
+            if self._live(status, entry):
+                popped.append(entry)
+                top.append((entry[3], self.items[entry[3]]))
+        # Stale entries stay dropped; live ones go back
+        for entry in popped:
+            heapq.heappush(heap, entry)
+        return top
+
+    def recompute_totals(self):
+        """Re-add the totals from scratch to shed accumulated float error."""
+        self.total_inventory = float(sum(item.inventory for item in self.items.values()))
+        self.total_demand = float(sum(item.demand for item in self.items.values()))
+
+
+def _item_summary(product_id: str, item: _Item) -> Dict[str, Any]:
+    return {
+        'product_id': product_id,
+        'current_inventory': item.inventory,
+        'predicted_demand': round(item.demand, 2),
+        'stock_ratio': round(item.demand / item.inventory, 2) if item.inventory > 0 else 0,
+        'days_of_stock': round(item.days_of_stock, 1) if np.isfinite(item.days_of_stock) else None
+    }
+
+
+def classify(inventory: np.ndarray, demand: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Days of stock, histogram bucket and status (None, 'critical' or
+    'overstocked') for arrays of inventory levels and demand forecasts.
+    """
+    days = np.divide(inventory, demand, out=np.where(inventory > 0, np.inf, 0.0), where=demand > 0)
+    buckets = np.searchsorted(DAYS_OF_STOCK_BOUNDS, days, side='left')
+    # days < 1 / 1.5 is stock ratio > 1.5; an empty shelf with demand is the
+    # most critical of all (its stock ratio is reported as 0)
+    status = np.full(len(days), None, dtype=object)
+    status[(demand > 0) & (days < 1 / CRITICAL_STOCK_RATIO)] = 'critical'
+    status[days > 1 / OVERSTOCK_RATIO] = 'overstocked'
+    return days, buckets, status
+
+
+class StoreInsights:
+    """Per-store rollups fed by scored inventory snapshots."""
+
+    def __init__(self, predictor: InventoryPredictor):
+        self.predictor = predictor
+        self.stores: Dict[str, StoreRollup] = {}
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+        # The model the stored forecasts came from
+        self._runtime = None
+        self.model_version: Optional[str] = None
+
+    def _apply(self, scored: pd.DataFrame, now: datetime):
+        inventory = scored['Inventory Level'].to_numpy(dtype=np.float64)
+        demand = scored['predicted_demand'].to_numpy(dtype=np.float64)
+        days, buckets, status = classify(inventory, demand)
+        touched = set()
+        for store_id, product_id, inv, dem, day, bucket, state in zip(
+                scored['Store ID'], scored['Product ID'], inventory.tolist(), demand.tolist(),
+                days.tolist(), buckets.tolist(), status):
+            rollup = self.stores.get(store_id)
+            if rollup is None:
+                rollup = self.stores[store_id] = StoreRollup(store_id)
+            rollup.set(product_id, inv, dem, day, bucket, state, next(self._versions))
+            touched.add(rollup)
+        for rollup in touched:
+            rollup.updated_at = now
+        return touched
+
+    def _rescore_all(self):
+        """Rescore every stored item after a model swap (one batch model call)."""
+        rows = [(store_id, product_id, item.inventory)
+                for store_id, rollup in self.stores.items() for product_id, item in rollup.items.items()]
+        if rows:
+            df = pd.DataFrame(rows, columns=['Store ID', 'Product ID', 'Inventory Level'])
+            scored, _ = self.predictor.predict_demand_frame(df)
+            self._apply(scored, datetime.now())
+            for rollup in self.stores.values():
+                rollup.recompute_totals()
+        logger.info(f"Store insights rescored {len(rows)} items for model {self.predictor.model_version}")
+
+    def update(self, items: List[Any]) -> Tuple[Dict[str, Any], List[Dict]]:
+        """
+        Score ``items`` (new inventory levels) and fold them into the
+        rollups. Returns a summary of the update and the per-item errors.
+        """
+        runtime = self.predictor.runtime
+        scored, errors = self.predictor.predict_demand_batch(items)
+        with self._lock:
+            if self._runtime is not None and runtime is not self._runtime:
+                self._rescore_all()
+            self._runtime = runtime
+            self.model_version = self.predictor.model_version
+            touched = self._apply(scored, datetime.now())
+        return {
+            'items_updated': len(scored),
+            'stores_updated': sorted(rollup.store_id for rollup in touched)
+        }, errors
+
+    def _totals(self, rollup: StoreRollup) -> Dict[str, Any]:
+        return {
+            'store_id': rollup.store_id,
+            'total_items': len(rollup.items),
+            'total_inventory': round(rollup.total_inventory, 2),
+            'total_predicted_demand': round(rollup.total_demand, 2),
+            'overall_stock_ratio': round(rollup.total_demand / rollup.total_inventory, 2)
+            if rollup.total_inventory > 0 else 0,
+            'critical_items_count': rollup.status_counts['critical'],
+            'overstocked_items_count': rollup.status_counts['overstocked'],
+            'updated_at': rollup.updated_at.isoformat() if rollup.updated_at else None
+        }
+
+    def insights(self, store_id: str, k: int = DEFAULT_TOP_K) -> Optional[Dict[str, Any]]:
+        """Totals, top-``k`` critical and overstocked items and the days-of-stock histogram for a store."""
+        with self._lock:
+            rollup = self.stores.get(store_id)
+            if rollup is None:
+                return None
+            insights = self._totals(rollup)
+            insights.update({
+                'critical_items': [_item_summary(*item) for item in rollup.top('critical', k)],
+                'overstocked_items': [_item_summary(*item) for item in rollup.top('overstocked', k)],
+                'days_of_stock_histogram': [
+                    {'le': bound, 'count': count}
+                    for bound, count in zip(DAYS_OF_STOCK_BOUNDS + ['+Inf'], rollup.days_of_stock_counts)
+                ],
+                'model_version': self.model_version,
+                'stale': self._runtime is not None and self._runtime is not self.predictor.runtime
+            })
+            return insights
+
+    def overview(self) -> List[Dict[str, Any]]:
+        """Totals for every store."""
+        with self._lock:
+            return [self._totals(self.stores[store_id]) for store_id in sorted(self.stores)]
@@ -0,0 +1,372 @@
+"""
+Retraining the demand model outside the notebook.
+
+Reproduces the demand pipeline of final.ipynb (SimplePreprocessor +
+LGBMRegressor on Store ID, Product ID and Inventory Level, predicting
+Demand Forecast) as a script:
+
+1. Load only the needed columns with compact dtypes (categorical IDs,
+   int32 inventory, float32 target), from CSV/Parquet files or the
+   ingestion store.
+2. Hold out the most recent ``test_fraction`` of dates for testing.
+3. Cross-validate hyperparameter candidates on time-ordered folds of the
+   rest, in parallel across worker processes, until the candidates or the
+   time budget run out. The notebook's configuration is always the first
+   candidate.
+4. Refit the best candidate on all training rows, report test metrics
+   against the notebook configuration, and export a model artifact that
+   ``InventoryPredictor`` loads directly.
+
+Wall time and peak memory are logged with the metrics and saved in the
+artifact's ``training.json``.
+
+Usage:
+    python train.py retail_store_inventory.csv -o demand_model_v2
+    python train.py --ingested --candidates 40 --time-budget 900 --register v2
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ingestion import SCHEMA
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory isn't reported
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ['Store ID', 'Product ID', 'Inventory Level']
+TARGET = 'Demand Forecast'
+TRAINING_FILE = 'training.json'
+# The configuration final.ipynb trained demand_model.pkl with
+NOTEBOOK_PARAMS = {
+    'learning_rate': 0.1,
+    'num_leaves': 20,
+    'max_depth': 4,
+    'min_child_samples': 50,
+    'n_estimators': 100,
+}
+SEARCH_SPACE = {
+    'learning_rate': [0.03, 0.05, 0.1, 0.2],
+    'num_leaves': [8, 15, 20, 31, 63],
+    'max_depth': [3, 4, 6, 8, -1],
+    'min_child_samples': [20, 50, 100, 200],
+    'n_estimators': [100, 200, 400],
+    'reg_lambda': [0.0, 1.0, 10.0],
+}
+
+# Set in each worker process by _init_worker
+_X: Optional[np.ndarray] = None
+_y: Optional[np.ndarray] = None
+
+
+def peak_memory_mb() -> Dict[str, Optional[float]]:
+    """Peak resident memory of this process and of its finished workers."""
+    if resource is None:
+        return {'process': None, 'workers': None}
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'process': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20, 1),
+        'workers': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2 ** 20, 1),
+    }
+
+
+def load_training_data(paths: List[str]) -> pd.DataFrame:
+    """
+    Date, the features and the target from CSV or Parquet files, with the
+    ingestion schema's compact dtypes. Rows missing any of them are dropped
+    and the rest sorted by Date.
+    """
+    columns = ['Date'] + FEATURES + [TARGET]
+    dtypes = {col: SCHEMA[col] for col in FEATURES + [TARGET]}
+    frames = []
+    for path in paths:
+        if path.endswith('.parquet'):
+            frame = pd.read_parquet(path, columns=columns)
+        else:
+            frame = pd.read_csv(path, usecols=columns, dtype=dtypes)
+        frame['Date'] = pd.to_datetime(frame['Date'], errors='coerce')
+        frames.append(frame.astype(dtypes))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # Files with different category sets concatenate to object columns
+    for col in ('Store ID', 'Product ID'):
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+
+    rows = len(df)
+    df = df.dropna(subset=columns)
+    if len(df) < rows:
+        logger.info(f"Dropped {rows - len(df)} rows with missing values")
+    return df.sort_values('Date', kind='stable').reset_index(drop=True)
+
+
+def encode(df: pd.DataFrame) -> np.ndarray:
+    """
+    The feature matrix the LGBMRegressor sees, minus the scaling (which
+    doesn't change tree splits): IDs as sorted-label codes, like LabelEncoder.
+    """
+    X = np.empty((len(df), len(FEATURES)), dtype=np.float32)
+    for j, col in enumerate(FEATURES):
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.reorder_categories(sorted(values.cat.categories))
+            X[:, j] = values.cat.codes.to_numpy()
+        else:
+            X[:, j] = values.to_numpy(dtype=np.float32)
+    return X
+
+
+def time_split(df: pd.DataFrame, test_fraction: float) -> int:
+    """Index of the first test row: the most recent ``test_fraction`` of dates are held out."""
+    dates = np.sort(df['Date'].unique())
+    if len(dates) < 2:
+        raise ValueError("Need at least two distinct dates to hold out a test period")
+    cut = dates[min(max(int(len(dates) * (1 - test_fraction)), 1), len(dates) - 1)]
+    return int(np.searchsorted(df['Date'].to_numpy(), cut, side='left'))
+
+
+def time_folds(n: int, folds: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Expanding-window folds over rows already sorted by time."""
+    from sklearn.model_selection import TimeSeriesSplit
+    return list(TimeSeriesSplit(n_splits=folds).split(np.empty((n, 1))))
+
+
+def candidates(count: int, seed: int) -> List[Dict[str, Any]]:
+    """The notebook configuration followed by ``count - 1`` distinct random draws from SEARCH_SPACE."""
+    from sklearn.model_selection import ParameterSampler
+
+    drawn = [NOTEBOOK_PARAMS]
+    for params in ParameterSampler(SEARCH_SPACE, n_iter=max(count * 4, 1), random_state=seed):
+        if len(drawn) >= count:
+            break
+        if params not in drawn:
+            drawn.append(params)
+    return drawn
+
+
+def regressor(params: Dict[str, Any], seed: int, n_jobs: int = 1):
+    from lightgbm import LGBMRegressor
+    return LGBMRegressor(objective='regression', random_state=seed, n_jobs=n_jobs, verbose=-1, **params)
+
+
+def _init_worker(X: np.ndarray, y: np.ndarray):
+    """Receive the training matrix once per worker process."""
+    global _X, _y
+    _X, _y = X, y
+
+
+def _fit_fold(params: Dict[str, Any], train_index: np.ndarray, test_index: np.ndarray,
+              seed: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    model = regressor(params, seed).fit(_X[train_index], _y[train_index])
+    predicted = model.predict(_X[test_index])
+    return dict(regression_metrics(_y[test_index], predicted), seconds=time.perf_counter() - start)
+
+
+def regression_metrics(actual: np.ndarray, predicted: np.ndarray) -> Dict[str, float]:
+    actual = np.asarray(actual, dtype=np.float64)
+    errors = actual - predicted
+    total = ((actual - actual.mean()) ** 2).sum()
+    return {
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mae': float(np.mean(np.abs(errors))),
+        'r2': float(1 - (errors ** 2).sum() / total) if total > 0 else 0.0,
+    }
+
+
+def search(X: np.ndarray, y: np.ndarray, params_list: List[Dict[str, Any]], folds: int, workers: int,
+           time_budget: float, seed: int) -> List[Dict[str, Any]]:
+    """
+    Cross-validate every candidate, ``workers`` folds at a time, until
+    ``time_budget`` seconds have passed. Returns the candidates whose folds
+    all finished, best (lowest mean RMSE) first. Folds that are already
+    running when the budget runs out are allowed to finish.
+    """
+    splits = time_folds(len(X), folds)
+    tasks = [(c, f) for c in range(len(params_list)) for f in range(len(splits))]
+    results: Dict[int, List[Dict[str, float]]] = {c: [] for c in range(len(params_list))}
+    deadline = time.perf_counter() + time_budget
+
+    if workers <= 1:
+        _init_worker(X, y)
+        for c, f in tasks:
+            if time.perf_counter() > deadline:
+                break
+            results[c].append(_fit_fold(params_list[c], *splits[f], seed))
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y))
+        try:
+            # Submitted candidate by candidate, so the budget cuts off whole candidates at the end
+            futures = {pool.submit(_fit_fold, params_list[c], *splits[f], seed): c for c, f in tasks}
+            pending = set(futures)
+            try:
+                for future in as_completed(futures, timeout=max(time_budget, 0)):
+                    pending.discard(future)
+                    results[futures[future]].append(future.result())
+            except TimeoutError:
+                logger.info("Time budget reached; cancelling the remaining folds")
+                for future in pending:
+                    future.cancel()
+                # Collect the folds that were already running
+                for future in pending:
+                    if not future.cancelled():
+                        results[futures[future]].append(future.result())
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    evaluated = []
+    for c, fold_results in results.items():
+        if len(fold_results) < len(splits):
+            continue
+        evaluated.append({
+            'params': params_list[c],
+            'notebook_config': c == 0,
+            **{f"cv_{name}": float(np.mean([r[name] for r in fold_results])) for name in ('rmse', 'mae', 'r2')},
+            'cv_rmse_std': float(np.std([r['rmse'] for r in fold_results])),
+            'fit_seconds': float(sum(r['seconds'] for r in fold_results)),
+        })
+    logger.info(f"Evaluated {len(evaluated)} of {len(params_list)} candidates on {len(splits)} folds")
+    return sorted(evaluated, key=lambda result: result['cv_rmse'])
+
+
+def pipeline(params: Dict[str, Any], seed: int, n_jobs: int):
+    """The notebook's Pipeline structure, which model_artifacts compiles."""
+    from sklearn.pipeline import Pipeline
+
+    from inventory_model import SimplePreprocessor
+    return Pipeline([('preprocessor', SimplePreprocessor()), ('regressor', regressor(params, seed, n_jobs))])
+
+
+def train(paths: List[str], output_path: str, n_candidates: int = 20, folds: int = 3,
+          time_budget: float = 600.0, workers: int = None, test_fraction: float = 0.2,
+          seed: int = 42) -> Dict[str, Any]:
+    """Search, refit and export; returns the training report also written to ``training.json``."""
+    from drift import BASELINE_FILE, build_baseline, write_baseline
+    from model_artifacts import export_model, verify_artifact
+
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    timings = {}
+
+    df = load_training_data(paths)
+    timings['load'] = time.perf_counter() - started
+    logger.info(f"Loaded {len(df)} rows ({df.memory_usage(deep=True).sum() / 2 ** 20:.1f} MB) "
+                f"in {timings['load']:.2f}s")
+
+    cut = time_split(df, test_fraction)
+    train_df, test_df = df.iloc[:cut], df.iloc[cut:]
+    X = encode(train_df)
+    y = train_df[TARGET].to_numpy(dtype=np.float32)
+
+    phase = time.perf_counter()
+    evaluated = search(X, y, candidates(n_candidates, seed), folds, workers,
+                       max(time_budget - (phase - started), 0), seed)
+    timings['search'] = time.perf_counter() - phase
+    if not evaluated:
+        raise RuntimeError("No candidate finished within the time budget; raise --time-budget")
+    best = evaluated[0]
+
+    # Refit the best candidate (and the notebook's, to compare) on every training row
+    phase = time.perf_counter()
+    model = pipeline(best['params'], seed, workers).fit(train_df[FEATURES], train_df[TARGET])
+    test_metrics = regression_metrics(test_df[TARGET], model.predict(test_df[FEATURES]))
+    if best['notebook_config']:
+        baseline_metrics = test_metrics
+    else:
+        baseline = pipeline(NOTEBOOK_PARAMS, seed, workers).fit(train_df[FEATURES], train_df[TARGET])
+        baseline_metrics = regression_metrics(test_df[TARGET], baseline.predict(test_df[FEATURES]))
+    timings['refit'] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    export_model(model, output_path, source=', '.join(paths))
+    max_diff = verify_artifact(model, output_path)
+    # What /admin/drift compares the served traffic against
+    write_baseline(build_baseline(train_df, np.maximum(model.predict(train_df[FEATURES]), 0), source=', '.join(paths)),
+                   os.path.join(output_path, BASELINE_FILE))
+    timings['export'] = time.perf_counter() - phase
+    timings['total'] = time.perf_counter() - started
+
+    report = {
+        'trained_at': datetime.now().isoformat(),
+        'inputs': paths,
+        'rows': {'train': len(train_df), 'test': len(test_df)},
+        'test_period': {'start': str(test_df['Date'].min().date()), 'end': str(test_df['Date'].max().date())},
+        'best_params': best['params'],
+        'test_metrics': test_metrics,
+        'notebook_config_test_metrics': baseline_metrics,
+        'candidates': evaluated,
+        'candidates_requested': n_candidates,
+        'folds': folds,
+        'workers': workers,
+        'artifact_max_abs_diff': max_diff,
+        'wall_seconds': {phase: round(seconds, 3) for phase, seconds in timings.items()},
+        'peak_memory_mb': peak_memory_mb(),
+    }
+    with open(os.path.join(output_path, TRAINING_FILE), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    logger.info(
+        f"Test RMSE {test_metrics['rmse']:.3f}, MAE {test_metrics['mae']:.3f}, R² {test_metrics['r2']:.4f} "
+        f"(notebook config: RMSE {baseline_metrics['rmse']:.3f}, R² {baseline_metrics['r2']:.4f}); "
+        f"wall time {timings['total']:.1f}s (search {timings['search']:.1f}s on {workers} workers); "
+        f"peak memory {report['peak_memory_mb']['process']} MB, "
+        f"workers {report['peak_memory_mb']['workers']} MB"
+    )
+    return report
+
+
+def ingested_files(root: str = None) -> List[str]:
+    from ingestion import IngestionStore
+
+    store = IngestionStore(root)
+    return [store.file_path(relative) for batch in store.manifest()['batches'] for relative in batch['files']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrain the demand model with a parallel hyperparameter search')
+    parser.add_argument('inputs', nargs='*', help='CSV or Parquet training files')
+    parser.add_argument('--ingested', action='store_true',
+                        help='Train on every file in the ingestion store ($INGESTION_DIR or ingested)')
+    parser.add_argument('-o', '--output', default='demand_model.trained', help='Artifact directory to write')
+    parser.add_argument('--candidates', type=int, default=20, help='Hyperparameter candidates to evaluate')
+    parser.add_argument('--folds', type=int, default=3, help='Time-ordered cross-validation folds')
+    parser.add_argument('--time-budget', type=float, default=600.0,
+                        help='Seconds allowed for loading and the search (default: 600)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--test-fraction', type=float, default=0.2, help='Most recent share of dates held out')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--register', metavar='VERSION', help='Also register the artifact in the model registry')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    paths = list(args.inputs) + (ingested_files() if args.ingested else [])
+    if not paths:
+        parser.error('give training files or --ingested')
+    if not 0 < args.test_fraction < 1:
+        parser.error('--test-fraction must be between 0 and 1')
+
+    report = train(paths, args.output, n_candidates=args.candidates, folds=args.folds,
+                   time_budget=args.time_budget, workers=args.workers,
+                   test_fraction=args.test_fraction, seed=args.seed)
+    if args.register:
+        from model_registry import ModelRegistry
+        ModelRegistry(os.environ.get('MODEL_REGISTRY_DIR', 'models')).register(args.register, args.output)
+    print(json.dumps({key: report[key] for key in ('best_params', 'test_metrics', 'notebook_config_test_metrics',
+                                                   'wall_seconds', 'peak_memory_mb')}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
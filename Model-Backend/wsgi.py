@@ -0,0 +1,15 @@
+"""
+WSGI entry point for production serving.
+
+Usage:
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing this module loads the model, so with ``preload_app`` the server
+master holds it before forking and workers share its pages copy-on-write.
+With ``FAST_STARTUP=1`` the import returns at once and the model loads in
+the background (see startup.py).
+"""
+
+from app import app, model_activator, predictor
+
+__all__ = ['app', 'model_activator', 'predictor']
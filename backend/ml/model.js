@@ -1,17 +1,63 @@
 // Placeholder for ML model integration
 // In production, load your trained model here (e.g., via Python shell, ONNX, or TensorFlow.js)
 
+// Python Model-Backend (see Model-Backend/README.md); the placeholders below
+// are used when it isn't configured
+const MODEL_API_URL = process.env.MODEL_API_URL;
+
 module.exports = {
   predictDemand: async ({ store_id, item_id, date }) => {
-    // Call your ML model here
-    return Math.floor(Math.random() * 100); // Dummy prediction
+    if (!MODEL_API_URL) {
+      return Math.floor(Math.random() * 100); // Dummy prediction
+    }
+    // Served from the precomputed forecast table when it covers the date.
+    // Without a date /forecast would start at the table's first day, so ask for today.
+    const day = date || new Date().toISOString().slice(0, 10);
+    const res = await fetch(`${MODEL_API_URL}/forecast`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ 'Store ID': store_id, 'Product ID': item_id, start_date: day, end_date: day }),
+    });
+    const data = await res.json();
+    if (!res.ok || data.forecasts.length === 0) {
+      const error = (data.errors || [])[0];
+      throw new Error(data.message || (error && error.error) || 'Demand forecast failed');
+    }
+    return data.forecasts[0].daily[0].demand_forecast;
   },
   reorderStock: async ({ store_id, item_id, current_stock }) => {
-    // Call your ML model here
-    return Math.max(0, 100 - current_stock); // Dummy logic
+    if (!MODEL_API_URL) {
+      return Math.max(0, 100 - current_stock); // Dummy logic
+    }
+    const res = await fetch(`${MODEL_API_URL}/reorder/plan`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ 'Store ID': store_id, 'Product ID': item_id, 'Inventory Level': current_stock }),
+    });
+    const data = await res.json();
+    if (!res.ok || data.plan.length === 0) {
+      const error = (data.errors || [])[0];
+      throw new Error(data.message || (error && error.error) || 'Reorder plan failed');
+    }
+    return data.plan[0].order_quantity;
   },
   storeInsights: async ({ store_id }) => {
-    // Call your ML model here
-    return { top_items: ['item1', 'item2'], low_stock: ['item3'] };
+    if (!MODEL_API_URL) {
+      return { top_items: ['item1', 'item2'], low_stock: ['item3'] };
+    }
+    const res = await fetch(`${MODEL_API_URL}/store-insights?store_id=${encodeURIComponent(store_id)}`);
+    const data = await res.json();
+    if (!res.ok) {
+      throw new Error(data.message || 'Store insights failed');
+    }
+    const { insights } = data;
+    return {
+      total_items: insights.total_items,
+      total_inventory: insights.total_inventory,
+      total_predicted_demand: insights.total_predicted_demand,
+      overall_stock_ratio: insights.overall_stock_ratio,
+      low_stock: insights.critical_items.map((item) => item.product_id).join(', '),
+      overstocked: insights.overstocked_items.map((item) => item.product_id).join(', ')
+    };
   }
 };
@@ -1,3 +1,4 @@
+const fs = require('fs');
 const express = require('express');
 const multer = require('multer');
 const { authenticate, authorize } = require('../../config/auth');
@@ -5,9 +6,24 @@ const router = express.Router();
 const upload = multer({ dest: 'uploads/' });
 
 // Upload CSV (Admin only)
-router.post('/upload-csv', authenticate, authorize(['admin']), upload.single('file'), (req, res) => {
-  // TODO: Process CSV and update DB/model
-  res.json({ message: 'Upload successful' });
+router.post('/upload-csv', authenticate, authorize(['admin']), upload.single('file'), async (req, res) => {
+  // Without MODEL_API_URL the file stays in uploads/ for `python ingestion.py watch`
+  if (!process.env.MODEL_API_URL || !req.file) {
+    return res.json({ message: 'Upload successful' });
+  }
+  try {
+    const form = new FormData();
+    form.append('file', new Blob([await fs.promises.readFile(req.file.path)]), req.file.originalname);
+    const headers = process.env.MODEL_API_ADMIN_TOKEN ? { 'X-Admin-Token': process.env.MODEL_API_ADMIN_TOKEN } : {};
+    const ingestRes = await fetch(`${process.env.MODEL_API_URL}/ingest`, { method: 'POST', body: form, headers });
+    const data = await ingestRes.json();
+    if (!ingestRes.ok) {
+      return res.status(400).json({ message: data.message || 'Ingestion failed' });
+    }
+    res.json({ message: 'Upload successful', ingestion: data.batch });
+  } catch (err) {
+    res.status(502).json({ message: err.message });
+  }
 });
 
 module.exports = router;
@@ -6,22 +6,34 @@ const router = express.Router();
 // Demand Prediction
 router.post('/predict-demand', authenticate, authorize(['admin', 'store']), async (req, res) => {
   const { store_id, item_id, date } = req.body;
-  const predicted_demand = await model.predictDemand({ store_id, item_id, date });
-  res.json({ predicted_demand });
+  try {
+    const predicted_demand = await model.predictDemand({ store_id, item_id, date });
+    res.json({ predicted_demand });
+  } catch (err) {
+    res.status(502).json({ message: err.message });
+  }
 });
 
 // Stock Reordering
 router.post('/reorder-stock', authenticate, authorize(['admin', 'store']), async (req, res) => {
   const { store_id, item_id, current_stock } = req.body;
-  const reorder_quantity = await model.reorderStock({ store_id, item_id, current_stock });
-  res.json({ reorder_quantity });
+  try {
+    const reorder_quantity = await model.reorderStock({ store_id, item_id, current_stock });
+    res.json({ reorder_quantity });
+  } catch (err) {
+    res.status(502).json({ message: err.message });
+  }
 });
 
 // Store Insights
 router.get('/store-insights', authenticate, authorize(['admin', 'store']), async (req, res) => {
   const { store_id } = req.query;
-  const insights = await model.storeInsights({ store_id });
-  res.json({ insights });
+  try {
+    const insights = await model.storeInsights({ store_id });
+    res.json({ insights });
+  } catch (err) {
+    res.status(502).json({ message: err.message });
+  }
 });
 
 module.exports = router;